@@ -0,0 +1,125 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from collections import namedtuple
+
+from portstate import CLOCK_FREQUENCY_RANGE
+
+
+BGR_MAX = 0xffffffff
+
+# Oversampling the DPLL divides the bit clock by, 1 when it isn't used
+DIVISORS = (1, 8, 16, 32)
+
+TOLERANCE = 0.001  # Default allowed rate error, as a fraction of the rate
+SEARCH_LIMIT = 4096  # BGR values tried per divisor when the clock changes
+
+BaudSolution = namedtuple('BaudSolution', ['clock_frequency', 'bgr',
+                                           'divisor', 'rate', 'error'])
+
+
+def baud_rate(clock_frequency, bgr, divisor=1):
+    """Returns the bit rate a clock frequency and BGR value give."""
+    return clock_frequency / ((bgr + 1) * divisor)
+
+
+def _solution(rate, clock_frequency, bgr, divisor):
+    actual = baud_rate(clock_frequency, bgr, divisor)
+    return BaudSolution(clock_frequency, bgr, divisor, actual,
+                        abs(actual - rate) / rate)
+
+
+def solve_with_clock(rate, clock_frequency, divisors=(1,)):
+    """Returns the closest rate a fixed clock frequency can divide down to.
+
+    Each divisor's achievable rates are clock / ((BGR + 1) * divisor), so
+    the nearest BGR values come straight from a division.
+    """
+    best = None
+
+    for divisor in divisors:
+        n = clock_frequency / (rate * divisor)
+
+        for bgr in set([int(n) - 1, int(n)]):
+            if not 0 <= bgr <= BGR_MAX:
+                continue
+
+            solution = _solution(rate, clock_frequency, bgr, divisor)
+
+            if best is None or solution.error < best.error:
+                best = solution
+
+    return best
+
+
+def solve_with_new_clock(rate, divisors=(1,)):
+    """Returns the closest rate any clock frequency can give.
+
+    The clock is programmed in whole Hz, so the error is the rounding of
+    rate * (BGR + 1) * divisor. Lower BGR values (slower clocks) are
+    preferred when several are exact.
+    """
+    low, high = CLOCK_FREQUENCY_RANGE
+    best = None
+
+    for divisor in divisors:
+        step = rate * divisor
+
+        first = max(int(-(-low // step)), 1)
+        last = min(int(high // step), BGR_MAX + 1)
+
+        for n in range(first, min(last, first + SEARCH_LIMIT - 1) + 1):
+            solution = _solution(rate, int(round(step * n)), n - 1, divisor)
+
+            if best is None or solution.error < best.error:
+                best = solution
+
+            if not solution.error:
+                break
+
+    return best
+
+
+def solve_baud_rate(rate, clock_frequency=None, divisors=(1,),
+                    tolerance=TOLERANCE):
+    """Returns the BaudSolution for a bit rate, or None if nothing is
+    within tolerance.
+
+    Reprogramming the clock is slow and disrupts the line, so when
+    clock_frequency (the clock already programmed) can reach the rate
+    within tolerance it is kept, even if a new clock would be closer.
+    """
+    rate = float(rate)
+
+    if rate <= 0:
+        raise ValueError('The bit rate must be positive')
+
+    if clock_frequency:
+        solution = solve_with_clock(rate, clock_frequency, divisors)
+
+        if solution and solution.error <= tolerance:
+            return solution
+
+    solution = solve_with_new_clock(rate, divisors)
+
+    if solution and solution.error <= tolerance:
+        return solution
+
+    return None
@@ -0,0 +1,205 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import time
+import platform
+from functools import partial
+
+from engine import *
+from pool import PortPool
+from simulator import *
+
+
+LATENCY = 0.0002  # Seconds per simulated driver call
+ITERATIONS = 50
+FRAME_SIZE = 256
+FRAME_COUNT = 10000
+
+
+def summarize(timings):
+    """Returns statistics (in seconds) for a list of timings."""
+    timings = sorted(timings)
+    count = len(timings)
+
+    return {
+        'iterations': count,
+        'min': timings[0],
+        'max': timings[-1],
+        'mean': sum(timings) / count,
+        'p50': timings[int(count * 0.50)],
+        'p99': timings[min(int(count * 0.99), count - 1)],
+    }
+
+
+def timed(function, iterations):
+    timings = []
+
+    for i in range(iterations):
+        start = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - start)
+
+    return summarize(timings)
+
+
+def alternate_settings():
+    """Returns two complete settings that differ in every field."""
+    first = {
+        'append_status': False,
+        'append_timestamp': False,
+        'ignore_timeout': False,
+        'rx_multiple': False,
+        'tx_modifiers': 0,
+        'memory_cap': {'input': DEFAULT_MEMORY_CAP,
+                       'output': DEFAULT_MEMORY_CAP},
+        'registers': dict((name, hex(DEFAULT_REGISTERS[name]))
+                          for name in REGISTER_NAMES),
+        'clock_frequency': 18432000,
+    }
+
+    second = {
+        'append_status': True,
+        'append_timestamp': True,
+        'ignore_timeout': True,
+        'rx_multiple': True,
+        'tx_modifiers': fscc.XREP,
+        'memory_cap': {'input': DEFAULT_MEMORY_CAP * 2,
+                       'output': DEFAULT_MEMORY_CAP * 2},
+        'registers': dict((name, hex(DEFAULT_REGISTERS[name] ^ 0x1))
+                          for name in REGISTER_NAMES),
+        'clock_frequency': 1000000,
+    }
+
+    return first, second
+
+
+def bench_port_switch(latency, iterations):
+    """Cold opens versus switching between ports held by a PortPool."""
+    names = simulated_port_names(2)
+    opener = partial(open_simulated_port, latency=latency)
+
+    def cold(i):
+        opener(names[i % 2]).port.close()
+
+    pool = PortPool(size=2, revalidate_after=float('inf'), opener=opener)
+
+    def pooled(i):
+        state = pool.acquire(names[i % 2])
+        pool.release(names[i % 2], state)
+
+    results = {'cold': timed(cold, iterations),
+               'pooled': timed(pooled, iterations)}
+    pool.close_all()
+
+    return results
+
+
+def bench_apply(latency, iterations):
+    """Applying complete settings that change every field, then applying
+    the same settings again which shouldn't write anything."""
+    state = open_simulated_port('SIM0', latency)
+    settings = alternate_settings()
+
+    results = {
+        'changed': timed(lambda i: apply_settings(state.port, settings[i % 2],
+                                                  state), iterations),
+        'unchanged': timed(lambda i: apply_settings(state.port, settings[0],
+                                                    state), iterations),
+    }
+
+    state.port.close()
+
+    return results
+
+
+def bench_settings_io(latency, iterations):
+    """Exporting the port state to JSON and loading it back."""
+    state = open_simulated_port('SIM0', latency)
+    exported = state.to_json(sort_keys=True, indent=4)
+
+    def export(i):
+        state.to_json(sort_keys=True, indent=4)
+
+    def import_(i):
+        check_settings(json.loads(exported))
+
+    results = {'export': timed(export, iterations),
+               'import': timed(import_, iterations)}
+
+    state.port.close()
+
+    return results
+
+
+def bench_frame_throughput(latency, frame_size, frame_count):
+    """Writing frames to a simulated port and reading them back."""
+    state = open_simulated_port('SIM0', latency)
+    port = state.port
+    port.purge()
+
+    frame = bytes(frame_size)
+
+    start = time.perf_counter()
+
+    for i in range(frame_count):
+        port.write(frame)
+        port.read(size=frame_size + 32)
+
+    elapsed = time.perf_counter() - start
+
+    port.close()
+
+    return {
+        'frames': frame_count,
+        'frame_size': frame_size,
+        'seconds': elapsed,
+        'frames_per_second': frame_count / elapsed,
+        'bytes_per_second': frame_count * frame_size / elapsed,
+    }
+
+
+def run_benchmarks(latency=LATENCY, iterations=ITERATIONS,
+                   frame_size=FRAME_SIZE, frame_count=FRAME_COUNT):
+    """Runs every benchmark against simulated ports.
+
+    Returns a dictionary that can be saved as JSON and compared between
+    builds.
+    """
+    reset_cards()
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'latency': latency,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'port_switch': bench_port_switch(latency, iterations),
+        'apply': bench_apply(latency, iterations),
+        'settings_io': bench_settings_io(latency, iterations),
+        # The driver latency would only measure time.sleep here
+        'frame_throughput': bench_frame_throughput(0.0, frame_size,
+                                                   frame_count),
+    }
+
+    reset_cards()
+
+    return results
@@ -0,0 +1,266 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import threading
+
+from capture import FrameReader
+from traffic import TrafficGenerator
+
+
+# Feedback taps (n, m) of the ITU-T O.150 patterns, x^n + x^m + 1
+PATTERNS = {
+    7: (7, 6),
+    15: (15, 14),
+    23: (23, 18),
+    31: (31, 28),
+}
+
+BLOCK_SIZE = 1024 * 1024  # Bytes of pattern generated at a time
+SYNC_THRESHOLD = 0.2  # Error ratio in a frame that means sync was lost
+
+try:
+    popcount = int.bit_count
+except AttributeError:
+    def popcount(value):
+        return bin(value).count('1')
+
+
+def extend(seed, n, m, total):
+    """Extends the first n bits of a sequence to total bits.
+
+    The sequence follows s[k] = s[k - n] ^ s[k - m]. Squaring the feedback
+    polynomial gives s[k] = s[k - 2n] ^ s[k - 2m] and so on, so each step
+    produces m * 2 ** j bits at once with big integer operations instead of
+    one bit at a time. Bit i of the integers is bit i of the sequence.
+    """
+    bits, length = seed, n
+
+    while length < total:
+        j = (length // n).bit_length() - 1
+        width = m << j
+
+        block = (bits >> (length - (n << j))) ^ (bits >> (length - width))
+        bits |= (block & ((1 << width) - 1)) << length
+        length += width
+
+    return bits & ((1 << total) - 1)
+
+
+class PRBS(object):
+    """Continuous pseudo-random bit sequence, sent least significant bit
+    first."""
+
+    def __init__(self, order, state=None):
+        try:
+            self.n, self.m = PATTERNS[order]
+        except KeyError:
+            raise ValueError('PRBS{} is not supported, use one of {}'.format(
+                order, ', '.join(str(o) for o in sorted(PATTERNS))))
+
+        self.order = order
+        self.mask = (1 << self.n) - 1
+        self.state = self.mask if state is None else state & self.mask
+
+        if not self.state:
+            raise ValueError('PRBS state can not be all zeros')
+
+    def next_bits(self, count):
+        """Returns the next count bits as an integer."""
+        bits = extend(self.state, self.n, self.m, self.n + count)
+        self.state = bits >> count
+
+        return bits >> self.n
+
+    def next_bytes(self, size):
+        return self.next_bits(size * 8).to_bytes(size, 'little')
+
+
+class BertChecker(object):
+    """Counts bit and frame errors in received PRBS frames.
+
+    Frames are expected to continue the sequence of the frame before them.
+    When they don't (a frame was lost or the link just came up) the checker
+    resynchronizes by seeding its reference from the frame's own first bits.
+    """
+
+    def __init__(self, order, threshold=SYNC_THRESHOLD):
+        self.reference = PRBS(order)
+        self.threshold = threshold
+        self.synced = False
+
+        self.bits = 0
+        self.bit_errors = 0
+        self.frames = 0
+        self.frame_errors = 0
+        self.sync_losses = 0
+        self.unsynced_bits = 0
+
+    def check(self, data):
+        length = len(data) * 8
+        received = int.from_bytes(data, 'little')
+
+        if self.synced:
+            errors = popcount(received ^ self.reference.next_bits(length))
+
+            if errors <= length * self.threshold:
+                self._count(length, errors)
+                return errors
+
+            self.synced = False
+            self.sync_losses += 1
+
+        return self._synchronize(received, length)
+
+    def _synchronize(self, received, length):
+        n = self.reference.n
+        seed = received & self.reference.mask
+
+        if length > n and seed:
+            self.reference.state = seed
+            expected = self.reference.next_bits(length - n)
+            errors = popcount((received >> n) ^ expected)
+
+            if errors <= (length - n) * self.threshold:
+                self.synced = True
+                self._count(length - n, errors)
+                return errors
+
+        self.frames += 1
+        self.frame_errors += 1
+        self.unsynced_bits += length
+
+        return None
+
+    def _count(self, bits, errors):
+        self.bits += bits
+        self.bit_errors += errors
+        self.frames += 1
+
+        if errors:
+            self.frame_errors += 1
+
+    def stats(self):
+        return {
+            'bits': self.bits,
+            'bit_errors': self.bit_errors,
+            'bit_error_rate': (self.bit_errors / self.bits if self.bits
+                               else None),
+            'frames': self.frames,
+            'frame_errors': self.frame_errors,
+            'sync_losses': self.sync_losses,
+            'unsynced_bits': self.unsynced_bits,
+            'synced': self.synced,
+        }
+
+
+class BertSender(TrafficGenerator):
+    """Sends a continuous PRBS split into frames of a fixed size."""
+
+    def __init__(self, port, order, size, **kwargs):
+        self.pattern = PRBS(order)
+        self.size = size
+        self.block_frames = max(BLOCK_SIZE // size, 1)
+        self.block = b''
+        self.offset = 0
+
+        super(BertSender, self).__init__(port, [b'\0' * size], **kwargs)
+
+    def next_frame(self, i):
+        if self.offset >= len(self.block):
+            self.block = self.pattern.next_bytes(self.size * self.block_frames)
+            self.offset = 0
+
+        frame = self.block[self.offset:self.offset + self.size]
+        self.offset += self.size
+
+        return frame
+
+
+class BertReceiver(threading.Thread):
+    def __init__(self, port, order, size):
+        super(BertReceiver, self).__init__()
+
+        self.daemon = True
+        self.reader = FrameReader(port, size + 64)
+        self.checker = BertChecker(order)
+        self.error = None
+
+        self._stop_event = threading.Event()
+
+    def run(self):
+        read, check = self.reader.read, self.checker.check
+
+        try:
+            while not self._stop_event.is_set():
+                frame = read()
+
+                if frame is not None:
+                    check(frame[0])
+        except OSError as e:
+            self.error = e
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class BertTest(object):
+    """Sends a PRBS out tx_port and checks it as it arrives on rx_port.
+
+    Leave rx_port off when the frames come back on the same port.
+    """
+
+    def __init__(self, tx_port, rx_port=None, order=23, size=1024,
+                 bit_rate=None, duration=None):
+        self.rx_port = rx_port or tx_port
+        self.receiver = BertReceiver(self.rx_port, order, size)
+        self.sender = BertSender(tx_port, order, size, bit_rate=bit_rate,
+                                 duration=duration)
+
+    def start(self):
+        self.rx_port.purge(False, True)
+        self.receiver.start()
+        self.sender.start()
+
+    def is_alive(self):
+        return self.sender.is_alive()
+
+    def stop(self, drain_time=1.0):
+        self.sender.stop()
+
+        # Give frames still on the wire a chance to arrive
+        deadline = time.monotonic() + drain_time
+
+        while (self.receiver.checker.frames < self.sender.sent and
+               time.monotonic() < deadline):
+            time.sleep(0.01)
+
+        self.receiver.stop()
+
+    def stats(self):
+        """Returns the running counts, safe to call while the test runs."""
+        stats = self.receiver.checker.stats()
+        stats['frames_sent'] = self.sender.sent
+        stats['bit_rate'] = self.sender.stats()['bit_rate']
+        stats['errors'] = [str(e) for e in (self.sender.error,
+                                            self.receiver.error) if e]
+
+        return stats
@@ -0,0 +1,227 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import json
+import time
+import zipfile
+import platform
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import *
+from scan import normalize_settings, fingerprint, diff_settings
+
+
+BUNDLE_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+ExportResult = namedtuple('ExportResult', ['port_name', 'fingerprint',
+                                           'error'])
+RestoreResult = namedtuple('RestoreResult', ['port_name', 'differences',
+                                             'applied', 'unverified',
+                                             'error'])
+
+
+class InvalidBundleError(InvalidSettingsError):
+    pass
+
+
+def settings_filename(port_name):
+    """Returns the name of a port's .fscc file inside a bundle."""
+    return '{}.fscc'.format(os.path.basename(str(port_name)))
+
+
+def _with_state(port_name, function, opener, pool):
+    if pool is not None:
+        state = pool.acquire(port_name)
+
+        try:
+            # A pooled state can be a few seconds old, so it is read again
+            # before being exported or compared
+            with port_lock(state.port):
+                state.refresh()
+                return function(state)
+        finally:
+            pool.release(port_name, state)
+
+    state = opener(port_name)
+
+    try:
+        return function(state)
+    finally:
+        state.port.close()
+
+
+def _export_port(port_name, opener, pool):
+    try:
+        settings = _with_state(port_name, lambda state: state._to_json(),
+                               opener, pool)
+    except Exception as e:
+        return port_name, None, e
+
+    return port_name, settings, None
+
+
+def export_bundle(filename, port_names, workers=None, opener=open_port,
+                  pool=None):
+    """Saves the settings of many ports into one compressed bundle.
+
+    The ports are read at once, one port per worker. Each port is stored
+    as the same .fscc file the dialog's Export button writes, next to a
+    manifest listing the ports and a fingerprint of their settings. Ports
+    that can't be read are left out. Returns an ExportResult for each
+    port, in the order given.
+    """
+    port_names = list(port_names)
+    workers = workers or max(len(port_names), 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        exported = list(executor.map(
+            lambda name: _export_port(name, opener, pool), port_names))
+
+    manifest = OrderedDict([
+        ('version', BUNDLE_VERSION),
+        ('created', time.strftime('%Y-%m-%d %H:%M:%S')),
+        ('host', platform.node()),
+        ('ports', [])])
+
+    results = []
+
+    # Written beside the bundle first so a failed export doesn't leave half
+    # of one behind, or clobber an older one
+    temporary = filename + '.tmp'
+
+    try:
+        with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            for port_name, settings, error in exported:
+                if error:
+                    results.append(ExportResult(port_name, None, error))
+                    continue
+
+                port_fingerprint = fingerprint(normalize_settings(settings))
+                name = settings_filename(port_name)
+
+                bundle.writestr(name, json.dumps(settings, sort_keys=True,
+                                                 indent=4))
+                manifest['ports'].append(OrderedDict([
+                    ('port', port_name),
+                    ('file', name),
+                    ('fingerprint', port_fingerprint)]))
+
+                results.append(ExportResult(port_name, port_fingerprint,
+                                            None))
+
+            bundle.writestr(MANIFEST_NAME, json.dumps(manifest, indent=4))
+
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+    return results
+
+
+def read_bundle(filename):
+    """Returns the manifest of a bundle and each port's settings by port
+    name, raising InvalidBundleError if it is damaged."""
+    try:
+        with zipfile.ZipFile(filename, 'r') as bundle:
+            manifest = json.loads(bundle.read(MANIFEST_NAME).decode('utf-8'))
+
+            if manifest.get('version') != BUNDLE_VERSION:
+                raise InvalidBundleError('{} is an unsupported bundle '
+                                         'version'.format(filename))
+
+            settings = OrderedDict()
+
+            for entry in manifest['ports']:
+                port_settings = json.loads(
+                    bundle.read(entry['file']).decode('utf-8'))
+                check_settings(port_settings)
+
+                if (fingerprint(normalize_settings(port_settings)) !=
+                        entry['fingerprint']):
+                    raise InvalidBundleError('{} in {} doesn\'t match the '
+                                             'manifest'.format(entry['file'],
+                                                               filename))
+
+                settings[entry['port']] = port_settings
+    except (zipfile.BadZipFile, KeyError, TypeError, ValueError) as e:
+        if isinstance(e, InvalidBundleError):
+            raise
+
+        raise InvalidBundleError('{} is not a valid settings '
+                                 'bundle'.format(filename))
+
+    return manifest, settings
+
+
+def _restore_port(port_name, settings, dry_run, opener, pool):
+    golden = normalize_settings(settings)
+
+    def restore(state):
+        differences = diff_settings(golden,
+                                    normalize_settings(state._to_json()))
+        unverified = {}
+
+        if differences and not dry_run:
+            unverified = apply_settings(state.port, settings, state)
+
+        return differences, unverified
+
+    try:
+        differences, unverified = _with_state(port_name, restore, opener,
+                                              pool)
+    except Exception as e:
+        return RestoreResult(port_name, None, False, None, e)
+
+    return RestoreResult(port_name, differences,
+                         bool(differences) and not dry_run, unverified, None)
+
+
+def restore_bundle(filename, port_names=None, workers=None, dry_run=False,
+                   opener=open_port, pool=None):
+    """Applies a bundle back to its ports, one port per worker.
+
+    Each port is read first and only ports whose settings differ from the
+    bundle are written. port_names limits the restore to some of the
+    bundled ports (by number), dry_run only reports the differences.
+    Returns a RestoreResult for each port, in bundle order.
+    """
+    manifest, settings = read_bundle(filename)
+
+    if port_names is not None:
+        # By number, so /dev/fscc0 and FSCC0 are the same port
+        wanted = set(port_number(name) for name in port_names)
+        settings = OrderedDict((name, value) for name, value
+                               in settings.items()
+                               if port_number(name) in wanted)
+
+    if not settings:
+        return []
+
+    workers = workers or len(settings)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda item: _restore_port(item[0], item[1], dry_run, opener,
+                                       pool),
+            settings.items()))
@@ -0,0 +1,695 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import mmap
+import time
+import ctypes
+import struct
+import threading
+
+import fscc
+
+from crc import check_fcs
+
+
+# How the driver on this platform appends the timestamp to a frame
+if os.name == 'nt':
+    TIMESTAMP_SIZE = 8  # FILETIME, 100 ns intervals since 1601
+elif ctypes.sizeof(ctypes.c_voidp) == 8:
+    TIMESTAMP_SIZE = 16  # struct timeval with 64-bit fields
+else:
+    TIMESTAMP_SIZE = 8  # struct timeval with 32-bit fields
+
+STATUS_SIZE = 2
+
+CAPTURE_SIZE = 256 * 1024 * 1024  # Bytes of frame data kept in a capture
+READ_SIZE = 8192
+READ_TIMEOUT = 100  # Milliseconds, how quickly a recorder notices stop()
+
+MAGIC = b'QFSCCCAP'
+VERSION = 1
+
+# magic, version, header size, capacity, head, tail, first sequence,
+# next sequence, wraps
+FILE_HEADER = struct.Struct('<8sIIQQQQQQ')
+
+# length, flags, status, timestamp, sequence
+RECORD_HEADER = struct.Struct('<IHHdQ')
+RECORD_ALIGNMENT = 8
+WRAP_MARKER = 0xffffffff
+
+# Record flags
+HAS_STATUS = 0x1
+HAS_TIMESTAMP = 0x2  # Otherwise the timestamp is when the host read it
+MULTIPLE = 0x4  # Raw rx_multiple buffer that may hold several frames
+
+INDEX_MAGIC = b'QFSCCIDX'
+INDEX_VERSION = 1
+INDEX_BLOCK = 1024  # Records summarized by each index entry
+
+# magic, version, header size, records per block, slots, next sequence
+INDEX_HEADER = struct.Struct('<8sIIIIQ')
+
+# first sequence, ring offset, lowest timestamp, highest timestamp, status
+# bits set in any record, status bits set in every record, records
+INDEX_ENTRY = struct.Struct('<QQddHHI')
+
+
+class InvalidCaptureError(ValueError):
+    pass
+
+
+def record_size(length):
+    """Returns the bytes a record with length bytes of data takes up."""
+    size = RECORD_HEADER.size + length
+    return size + (-size % RECORD_ALIGNMENT)
+
+
+def trailer_size(append_status, append_timestamp):
+    return ((STATUS_SIZE if append_status else 0) +
+            (TIMESTAMP_SIZE if append_timestamp else 0))
+
+
+def index_path(path):
+    """Returns where the index of the capture at path is kept."""
+    return path + '.idx'
+
+
+def unpack_timestamp(buffer, offset):
+    """Converts a timestamp appended by the driver to seconds since the
+    epoch."""
+    if os.name == 'nt':
+        filetime = struct.unpack_from('q', buffer, offset)[0]
+        return filetime / 10000000 - 11644473600
+    else:
+        seconds, useconds = struct.unpack_from('ll', buffer, offset)
+        return seconds + useconds / 1000000
+
+
+class CaptureFile(object):
+    """Preallocated, memory-mapped ring of received frames.
+
+    Each record is a fixed RECORD_HEADER followed by the frame data. Once
+    the file is full the oldest records are overwritten, so the file never
+    grows past its capacity.
+
+    Passing a capacity creates a new file, leaving it off opens an
+    existing one. New captures keep a CaptureIndex next to them as they
+    are written, which find() uses to skip to the records it wants.
+    """
+
+    def __init__(self, path, capacity=None, index=True):
+        self.path = path
+        self.index = None
+
+        if capacity is not None:
+            self._create(path, capacity)
+        else:
+            self._file = open(path, 'r+b')
+
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        (magic, version, header_size, self.capacity, self.head, self.tail,
+         self.first_sequence, self.next_sequence,
+         self.wraps) = FILE_HEADER.unpack_from(self._map, 0)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise InvalidCaptureError('{} is not a capture file'.format(path))
+
+        self.data_offset = header_size
+
+        if capacity is not None:
+            if index:
+                self.index = CaptureIndex(index_path(path), self.capacity)
+            elif os.path.exists(index_path(path)):
+                # Left over from an earlier capture at the same path
+                os.remove(index_path(path))
+
+    def _create(self, path, capacity):
+        capacity -= capacity % RECORD_ALIGNMENT
+
+        if capacity < record_size(READ_SIZE):
+            raise ValueError('Capture capacity is too small')
+
+        self._file = open(path, 'w+b')
+
+        size = FILE_HEADER.size + capacity
+
+        # Reserve the blocks now instead of while frames are arriving
+        try:
+            os.posix_fallocate(self._file.fileno(), 0, size)
+        except (AttributeError, OSError):
+            self._file.truncate(size)
+
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, FILE_HEADER.size,
+                                          capacity, 0, 0, 0, 0, 0))
+        self._file.flush()
+
+    def __len__(self):
+        return self.next_sequence - self.first_sequence
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data, status=0, timestamp=None, flags=0):
+        """Appends a record, overwriting the oldest records if needed."""
+        length = len(data)
+        size = record_size(length)
+
+        if size > self.capacity:
+            raise ValueError('Frame is larger than the capture')
+
+        if timestamp is None:
+            timestamp = time.time()
+        else:
+            flags |= HAS_TIMESTAMP
+
+        offset = self._make_room(size)
+        start = self.data_offset + offset
+
+        RECORD_HEADER.pack_into(self._map, start, length, flags, status,
+                                timestamp, self.next_sequence)
+        start += RECORD_HEADER.size
+        self._map[start:start + length] = data
+
+        self.tail = offset + size
+
+        if self.index is not None:
+            self.index.add(self.next_sequence, offset,
+                           status if flags & HAS_STATUS else None, timestamp)
+
+        self.next_sequence += 1
+
+        # The record is in place before the header says it exists
+        self._write_header()
+
+    def read(self, offset):
+        """Returns (length, flags, status, timestamp, sequence, data offset)
+        of the record at offset, or None for a wrap marker."""
+        if offset + RECORD_HEADER.size > self.capacity:
+            return None
+
+        header = RECORD_HEADER.unpack_from(self._map, self.data_offset + offset)
+
+        if header[0] == WRAP_MARKER:
+            return None
+
+        return header + (self.data_offset + offset + RECORD_HEADER.size,)
+
+    def records(self):
+        """Yields every record from oldest to newest as (sequence, flags,
+        status, timestamp, data)."""
+        offset = self.head
+
+        for i in range(len(self)):
+            record = self.read(offset)
+
+            if record is None:
+                offset = 0
+                record = self.read(offset)
+
+            length, flags, status, timestamp, sequence, start = record
+
+            yield (sequence, flags, status, timestamp,
+                   self._map[start:start + length])
+
+            offset += record_size(length)
+
+    def find(self, start_time=None, end_time=None, first=None, last=None,
+             status_any=0, status_missing=0):
+        """Yields the records matching every condition given, oldest first,
+        in the same form as records().
+
+        Times are seconds since the epoch and first/last are sequence
+        numbers, all inclusive. status_any matches records with any of
+        those status bits set and status_missing ones with any of them
+        clear; records without an appended status match neither. Whole
+        blocks of records are skipped using the index.
+        """
+        for offset, record in self._find(start_time, end_time, first, last,
+                                         status_any, status_missing):
+            length, flags, status, timestamp, sequence, start = record
+
+            yield (sequence, flags, status, timestamp,
+                   self._map[start:start + length])
+
+    def find_offsets(self, *args, **kwargs):
+        """Yields the file offsets of the records find() would, for
+        decode.decode_records."""
+        for offset, record in self._find(*args, **kwargs):
+            yield self.data_offset + offset
+
+    def _find(self, start_time=None, end_time=None, first=None, last=None,
+              status_any=0, status_missing=0):
+        index = self._current_index()
+
+        low = self.first_sequence if first is None else max(
+            first, self.first_sequence)
+        high = self.next_sequence if last is None else min(
+            last + 1, self.next_sequence)
+
+        if low >= high:
+            return
+
+        block_records = index.block_records
+
+        for block in range(low // block_records,
+                           (high - 1) // block_records + 1):
+            entry = index.entry(block)
+
+            if entry is None:
+                continue
+
+            (sequence, offset, lowest, highest, any_bits, every_bits,
+             count) = entry
+
+            if start_time is not None and highest < start_time:
+                continue
+
+            if end_time is not None and lowest > end_time:
+                continue
+
+            if status_any and not any_bits & status_any:
+                continue
+
+            if status_missing and (every_bits & status_missing ==
+                                   status_missing):
+                continue
+
+            # The start of the oldest block may have been overwritten
+            if sequence < self.first_sequence:
+                sequence, offset = self.first_sequence, self.head
+
+            end = min(entry[0] + count, high)
+
+            while sequence < end:
+                record = self.read(offset)
+
+                if record is None:
+                    offset = 0
+                    record = self.read(offset)
+
+                length, flags, status, timestamp = record[:4]
+
+                if (sequence >= low and
+                        (start_time is None or timestamp >= start_time) and
+                        (end_time is None or timestamp <= end_time) and
+                        (not status_any or (flags & HAS_STATUS and
+                                            status & status_any)) and
+                        (not status_missing or (flags & HAS_STATUS and
+                                                ~status & status_missing))):
+                    yield offset, record
+
+                offset += record_size(length)
+                sequence += 1
+
+    def _current_index(self):
+        """Returns the index, (re)building it if it is missing or doesn't
+        match this capture."""
+        if self.index is not None:
+            return self.index
+
+        path = index_path(self.path)
+
+        if os.path.exists(path):
+            try:
+                index = CaptureIndex(path)
+            except InvalidCaptureError:
+                pass
+            else:
+                if (index.next_sequence == self.next_sequence and
+                        index.slots == index_slots(self.capacity,
+                                                   index.block_records)):
+                    self.index = index
+                    return index
+
+                index.close()
+
+        return self.build_index()
+
+    def build_index(self):
+        """Indexes the records already in the capture, for captures
+        written without one."""
+        if self.index is not None:
+            self.index.close()
+
+        self.index = CaptureIndex(index_path(self.path), self.capacity)
+
+        offset = self.head
+
+        for sequence in range(self.first_sequence, self.next_sequence):
+            record = self.read(offset)
+
+            if record is None:
+                offset = 0
+                record = self.read(offset)
+
+            length, flags, status, timestamp = record[:4]
+
+            self.index.add(sequence, offset,
+                           status if flags & HAS_STATUS else None, timestamp)
+
+            offset += record_size(length)
+
+        return self.index
+
+    def _make_room(self, size):
+        offset = self.tail
+
+        if offset + size > self.capacity:
+            # Records still between here and the end are the oldest ones
+            while len(self) and self.head >= offset:
+                self._drop_oldest()
+
+            if offset + RECORD_HEADER.size <= self.capacity:
+                struct.pack_into('<I', self._map, self.data_offset + offset,
+                                 WRAP_MARKER)
+
+            offset = 0
+            self.wraps += 1
+
+        while len(self) and offset <= self.head < offset + size:
+            self._drop_oldest()
+
+        if not len(self):
+            self.head = offset
+
+        return offset
+
+    def _drop_oldest(self):
+        record = self.read(self.head)
+
+        if record is None:
+            self.head = 0
+            record = self.read(self.head)
+
+        self.head += record_size(record[0])
+        self.first_sequence += 1
+
+        if self.head + RECORD_HEADER.size > self.capacity:
+            self.head = 0
+
+    def _write_header(self):
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.data_offset,
+                              self.capacity, self.head, self.tail,
+                              self.first_sequence, self.next_sequence,
+                              self.wraps)
+
+    def flush(self):
+        self._map.flush()
+
+        if self.index is not None:
+            self.index.flush()
+
+    def close(self):
+        if not self._map.closed:
+            self._map.flush()
+            self._map.close()
+
+        self._file.close()
+
+        if self.index is not None:
+            self.index.close()
+
+
+def index_slots(capacity, block_records=INDEX_BLOCK):
+    """Returns the index entries needed so the blocks a capture of this
+    capacity can hold at once never share one."""
+    return capacity // (record_size(0) * block_records) + 2
+
+
+class CaptureIndex(object):
+    """Memory-mapped summary of a capture, one entry per block_records
+    records.
+
+    Each entry has where its block starts in the ring, the range of its
+    timestamps and the status bits set in any and in every record. The
+    entries form a ring of their own, an entry is only valid while its
+    first sequence number is in the block asked for.
+
+    Passing a capacity creates a new index for a capture of that size,
+    leaving it off opens an existing one.
+    """
+
+    def __init__(self, path, capacity=None, block_records=INDEX_BLOCK):
+        self.path = path
+
+        if capacity is not None:
+            slots = index_slots(capacity, block_records)
+
+            self._file = open(path, 'w+b')
+            self._file.truncate(INDEX_HEADER.size + slots * INDEX_ENTRY.size)
+            self._file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                               INDEX_HEADER.size,
+                                               block_records, slots, 0))
+            self._file.flush()
+        else:
+            self._file = open(path, 'r+b')
+
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        except ValueError:
+            self._file.close()
+            raise InvalidCaptureError('{} is empty'.format(path))
+
+        (magic, version, self.entries_offset, self.block_records, self.slots,
+         self.next_sequence) = INDEX_HEADER.unpack_from(self._map, 0)
+
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self.close()
+            raise InvalidCaptureError('{} is not a capture index'.format(path))
+
+        # The block being added to
+        self._entry = None
+
+    def _entry_offset(self, block):
+        return self.entries_offset + (block % self.slots) * INDEX_ENTRY.size
+
+    def entry(self, block):
+        """Returns (first sequence, ring offset, lowest timestamp, highest
+        timestamp, status bits in any, status bits in every, records) of a
+        block, or None if it isn't indexed."""
+        entry = INDEX_ENTRY.unpack_from(self._map, self._entry_offset(block))
+
+        if not entry[6] or entry[0] // self.block_records != block:
+            return None
+
+        return entry
+
+    def add(self, sequence, offset, status, timestamp):
+        """Adds a record to its block, status is None for records without
+        an appended status."""
+        block = sequence // self.block_records
+        entry = self._entry
+
+        if entry is None or entry[0] // self.block_records != block:
+            entry = self.entry(block)
+
+            # Carries on a block left part way by an earlier writer
+            if entry is not None and entry[0] + entry[6] == sequence:
+                entry = list(entry)
+            else:
+                entry = [sequence, offset, timestamp, timestamp, 0, 0xffff, 0]
+
+            self._entry = entry
+            self._entry_at = self._entry_offset(block)
+
+            # Otherwise only kept up to date by flush, a stale count just
+            # has the capture reindex itself when it is next opened
+            self._write_header(sequence)
+
+        if timestamp < entry[2]:
+            entry[2] = timestamp
+
+        if timestamp > entry[3]:
+            entry[3] = timestamp
+
+        if status is not None:
+            entry[4] |= status
+            entry[5] &= status
+
+        entry[6] += 1
+
+        INDEX_ENTRY.pack_into(self._map, self._entry_at, *entry)
+
+        self.next_sequence = sequence + 1
+
+    def _write_header(self, next_sequence):
+        INDEX_HEADER.pack_into(self._map, 0, INDEX_MAGIC, INDEX_VERSION,
+                               self.entries_offset, self.block_records,
+                               self.slots, next_sequence)
+
+    def flush(self):
+        self._write_header(self.next_sequence)
+        self._map.flush()
+
+    def close(self):
+        if not self._map.closed:
+            self._write_header(self.next_sequence)
+            self._map.flush()
+            self._map.close()
+
+        self._file.close()
+
+
+class FrameReader(object):
+    """Reads frames from a port into one reused buffer.
+
+    The append settings are read once up front instead of on every read
+    like fscc.Port.read does. Ports without a driver handle, such as
+    simulated ones, fall back to their own read.
+    """
+
+    def __init__(self, port, size=READ_SIZE):
+        self.port = port
+        self.size = size
+
+        self.append_status = port.append_status
+        self.append_timestamp = port.append_timestamp
+        self.rx_multiple = port.rx_multiple
+
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+        if hasattr(port, '_handle'):
+            self._c_buffer = (ctypes.c_char * size).from_buffer(self.buffer)
+            self._bytes_read = ctypes.c_uint()
+        else:
+            self._c_buffer = None
+
+    def read(self, timeout=READ_TIMEOUT):
+        """Returns (data, status, timestamp, flags) or None on a timeout.
+
+        data is a view into the reused buffer, it is only valid until the
+        next read.
+        """
+        if self._c_buffer is None:
+            return self._port_read(timeout)
+
+        e = fscc.lib.fscc_read_with_timeout(self.port._handle, self._c_buffer,
+                                            self.size,
+                                            ctypes.byref(self._bytes_read),
+                                            int(timeout))
+
+        try:
+            fscc.Port._check_error(e)
+        except fscc.TimeoutError:
+            return None
+
+        length = self._bytes_read.value
+
+        if not length:
+            return None
+
+        if self.rx_multiple:
+            return (self.view[:length], 0, None, MULTIPLE)
+
+        flags, status, timestamp = 0, 0, None
+
+        if self.append_timestamp:
+            length -= TIMESTAMP_SIZE
+            timestamp = unpack_timestamp(self.buffer, length)
+
+        if self.append_status:
+            length -= STATUS_SIZE
+            status = self.buffer[length] | (self.buffer[length + 1] << 8)
+            flags |= HAS_STATUS
+
+        return (self.view[:length], status, timestamp, flags)
+
+    def _port_read(self, timeout):
+        data, status, timestamp = self.port.read(timeout, self.size)
+
+        if data is None:
+            return None
+
+        if self.rx_multiple:
+            return (data, 0, None, MULTIPLE)
+
+        flags = 0
+
+        if status is not None:
+            status = status[0] | (status[1] << 8)
+            flags |= HAS_STATUS
+        else:
+            status = 0
+
+        return (data, status, timestamp, flags)
+
+
+class CaptureRecorder(threading.Thread):
+    """Records frames from a port into a CaptureFile until stopped.
+
+    Given a crc.CrcMode, the FCS of every frame is checked as it arrives,
+    for ports passing the CRC through to software. Frames with any of the
+    error_mask bits set in their appended status count as status errors.
+    """
+
+    def __init__(self, port, capture, read_size=READ_SIZE, fcs_mode=None):
+        super(CaptureRecorder, self).__init__()
+
+        self.daemon = True
+        self.capture = capture
+        self.reader = FrameReader(port, read_size)
+        self.fcs_mode = fcs_mode
+        self.error_mask = 0
+        self.error = None
+
+        self.frames = 0
+        self.bytes = 0
+        self.fcs_errors = 0
+        self.status_errors = 0
+
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                frame = self.reader.read()
+
+                if frame is None:
+                    continue
+
+                data, status, timestamp, flags = frame
+
+                self.capture.write(data, status, timestamp, flags)
+
+                # A raw rx_multiple buffer can't be split to find the FCS
+                if (self.fcs_mode and not flags & MULTIPLE and
+                        not check_fcs(data, self.fcs_mode)):
+                    self.fcs_errors += 1
+
+                if flags & HAS_STATUS and status & self.error_mask:
+                    self.status_errors += 1
+
+                self.frames += 1
+                self.bytes += len(data)
+        except (OSError, ValueError) as e:
+            self.error = e
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.capture.flush()
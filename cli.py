@@ -0,0 +1,1173 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import sys
+import json
+import time
+import argparse
+
+from engine import *
+import benchmark
+import capture
+import crc
+import timeseries
+import tuning
+import scan
+import bundle
+import daemon
+from pool import IDLE_TIMEOUT
+
+
+def apply_command(args):
+    try:
+        settings = load_settings(args.profile)
+
+        if args.clock_frequency is not None:
+            settings['clock_frequency'] = args.clock_frequency
+
+        check_settings(settings)
+    except (OSError, InvalidSettingsError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    names = args.ports or port_names()
+
+    if not names:
+        print('No FSCC ports found', file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    results = configure_ports(names, settings, args.workers)
+    total_time = time.perf_counter() - start
+
+    failures = 0
+
+    for result in results:
+        if result.error:
+            failures += 1
+            print('{:<16} failed: {}'.format(result.port_name, result.error))
+        elif result.unverified:
+            failures += 1
+            print('{:<16} not verified: {}'.format(
+                result.port_name, ', '.join(result.unverified)))
+        else:
+            print('{:<16} ok      open {:8.1f} ms  apply {:8.1f} ms'.format(
+                result.port_name, result.open_time * 1000,
+                result.apply_time * 1000))
+
+    print('{} of {} ports configured in {:.1f} ms'.format(
+        len(results) - failures, len(results), total_time * 1000))
+
+    return 1 if failures else 0
+
+
+def capture_command(args):
+    try:
+        state = open_port(args.port)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    try:
+        capture_file = capture.CaptureFile(args.file,
+                                           args.size * 1024 * 1024)
+    except (OSError, ValueError) as e:
+        state.port.close()
+        print(e, file=sys.stderr)
+        return 1
+
+    fcs_mode = crc.CRC_MODES[args.fcs] if args.fcs else None
+
+    recorder = capture.CaptureRecorder(state.port, capture_file,
+                                       fcs_mode=fcs_mode)
+    recorder.error_mask = args.error_mask
+    recorder.start()
+
+    drop_counter = tuning.InterruptCounter(state.port,
+                                           timeseries.DROP_INTERRUPTS)
+    drop_counter.start()
+
+    counters = timeseries.PortCounters()
+    counters.attach(recorder=recorder, drop_counter=drop_counter)
+    history = timeseries.ThroughputHistory(counters)
+    history.sample()
+
+    start = time.monotonic()
+    wait = min(args.report or 1, 1)
+    next_report = start + (args.report or 0)
+
+    try:
+        while recorder.is_alive():
+            if args.duration and time.monotonic() - start >= args.duration:
+                break
+
+            recorder.join(wait)
+
+            if args.report and time.monotonic() >= next_report:
+                next_report += args.report
+                history.sample()
+
+                rates = history.rates()
+                print('{:10.0f} frames/s  {:12.0f} bytes/s  {:6.0f} drops/s  '
+                      '{:6.0f} status errors/s'.format(
+                          rates['rx_frames'], rates['rx_bytes'],
+                          rates['drops'], rates['status_errors']))
+    except KeyboardInterrupt:
+        pass
+
+    recorder.stop()
+    drop_counter.stop()
+    capture_file.close()
+    state.port.close()
+
+    print('{:,} frames ({:,} bytes) captured, {} wraps'.format(
+        recorder.frames, recorder.bytes, capture_file.wraps))
+
+    totals = counters.totals()
+
+    print('{:,} drops, {:,} status errors'.format(totals['drops'],
+                                                 totals['status_errors']))
+
+    if fcs_mode:
+        print('{:,} FCS errors'.format(recorder.fcs_errors))
+
+    if recorder.error:
+        print(recorder.error, file=sys.stderr)
+        return 1
+
+    return 0
+
+
+def decode_command(args):
+    import numpy
+    import decode
+
+    try:
+        capture_file = capture.CaptureFile(args.file)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    names = ('offsets', 'lengths', 'status', 'timestamps', 'sequences')
+    batches = []
+
+    for frames in decode.decode_capture(
+            capture_file, frame_size=args.frame_size,
+            append_status=args.append_status,
+            append_timestamp=args.append_timestamp):
+        # Copied out since the frames point into the mapped file
+        batches.append(dict((name, getattr(frames, name).copy())
+                            for name in names))
+
+    # The mapping can't be closed while arrays still refer to it
+    frames = None
+    capture_file.close()
+
+    columns = dict((name, numpy.concatenate([b[name] for b in batches])
+                    if batches else numpy.empty(0))
+                   for name in names)
+
+    print('{:,} frames, {:,} bytes'.format(len(columns['lengths']),
+                                           int(columns['lengths'].sum())))
+
+    timestamps = columns['timestamps']
+    timestamps = timestamps[~numpy.isnan(timestamps)]
+
+    if len(timestamps):
+        print('{} to {}'.format(time.ctime(timestamps.min()),
+                                time.ctime(timestamps.max())))
+
+    values, counts = numpy.unique(columns['status'], return_counts=True)
+
+    for value, count in zip(values, counts):
+        print('status {:04x}: {:,} frames'.format(int(value), int(count)))
+
+    if args.output:
+        numpy.savez(args.output, **columns)
+
+    return 0
+
+
+def fcs_command(args):
+    try:
+        capture_file = capture.CaptureFile(args.file)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+
+    stats = crc.check_capture(capture_file, crc.CRC_MODES[args.mode],
+                              frame_size=args.frame_size,
+                              append_status=args.append_status,
+                              append_timestamp=args.append_timestamp)
+
+    elapsed = time.perf_counter() - start
+    capture_file.close()
+
+    results = stats.as_dict()
+
+    print('{:,} frames, {:,} FCS errors ({:.3g}), {:,} too short for an '
+          'FCS'.format(results['frames'], results['errors'],
+                       results['error_ratio'], results['short']))
+    print('longest run of errors: {:,} frames'.format(
+        results['longest_burst']))
+
+    for status, count in results['errors_by_status'].items():
+        print('status {}: {:,} errors'.format(status, count))
+
+    for sequence, length, status in results['mismatches'][:args.list]:
+        print('{:>12}  {:>6} bytes  status {:04x}'.format(sequence, length,
+                                                         status))
+
+    print('checked in {:.1f} s'.format(elapsed))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    return 0
+
+
+def capture_time(value, oldest):
+    """Parses a --from/--to time, either seconds after the oldest frame
+    or a local 'YYYY-MM-DD HH:MM:SS' time."""
+    try:
+        return oldest + float(value)
+    except ValueError:
+        return time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+
+
+def find_command(args):
+    try:
+        capture_file = capture.CaptureFile(args.file)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    conditions = {'status_any': args.status_any,
+                  'status_missing': args.status_missing}
+
+    if args.frames:
+        conditions['first'], conditions['last'] = args.frames
+
+    try:
+        oldest = next(capture_file.records())[3]
+    except StopIteration:
+        oldest = 0
+
+    try:
+        if args.start is not None:
+            conditions['start_time'] = capture_time(args.start, oldest)
+
+        if args.end is not None:
+            conditions['end_time'] = capture_time(args.end, oldest)
+    except ValueError as e:
+        capture_file.close()
+        print(e, file=sys.stderr)
+        return 1
+
+    count = 0
+
+    for sequence, flags, status, timestamp, data in capture_file.find(
+            **conditions):
+        if count == args.limit:
+            print('...')
+            break
+
+        print('{:>12}  {}.{:06d}  {:>6} bytes  {}'.format(
+            sequence, time.strftime('%Y-%m-%d %H:%M:%S',
+                                    time.localtime(timestamp)),
+            int(timestamp % 1 * 1000000), len(data),
+            'status {:04x}'.format(status) if flags & capture.HAS_STATUS
+            else ''))
+
+        count += 1
+
+    data = None
+    capture_file.close()
+
+    return 0
+
+
+def send_command(args):
+    import traffic
+
+    gaps = None
+
+    try:
+        if args.replay:
+            frames, gaps = traffic.capture_frames(args.replay, args.count)
+
+            if not args.original_timing:
+                gaps = None
+        elif args.frame:
+            frames = [bytes.fromhex(frame) for frame in args.frame]
+        else:
+            frames = traffic.template_frames(args.size)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    try:
+        state = open_port(args.port)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    try:
+        generator = traffic.TrafficGenerator(
+            state.port, frames, args.frame_rate, args.bit_rate, gaps,
+            args.count, args.duration)
+    except ValueError as e:
+        state.port.close()
+        print(e, file=sys.stderr)
+        return 1
+
+    generator.start()
+
+    try:
+        while generator.is_alive():
+            generator.join(1)
+    except KeyboardInterrupt:
+        pass
+
+    generator.stop()
+    state.port.close()
+
+    stats = generator.stats()
+
+    print('{:,} frames ({:,} bytes) in {:.3f} s'.format(
+        stats['frames'], stats['bytes'], stats['seconds']))
+    print('{:,.1f} frames/s, {:,.0f} bits/s'.format(stats['frame_rate'],
+                                                   stats['bit_rate']))
+
+    if args.frame_rate:
+        print('requested {:,.1f} frames/s'.format(args.frame_rate))
+    elif args.bit_rate:
+        print('requested {:,.0f} bits/s'.format(args.bit_rate))
+
+    if generator.error:
+        print(generator.error, file=sys.stderr)
+        return 1
+
+    return 0
+
+
+def loopback_command(args):
+    import loopback
+
+    ports = []
+
+    try:
+        for name in [args.port] + ([args.rx_port] if args.rx_port else []):
+            ports.append(open_port(name).port)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+
+        for port in ports:
+            port.close()
+
+        return 1
+
+    try:
+        results = loopback.run_loopback(
+            ports[0], ports[-1], args.size, args.frame_rate, args.bit_rate,
+            args.duration, args.count)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        for port in ports:
+            port.close()
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(json.dumps(results, sort_keys=True, indent=4))
+
+    print('{:,} sent, {:,} received, {:,} lost ({:.3%})'.format(
+        results['sent'], results['received'], results['lost'],
+        results['loss_ratio']))
+    print('{:,.1f} frames/s, {:,.0f} bits/s received'.format(
+        results['receive_frame_rate'], results['receive_bit_rate']))
+
+    latency = results['latency']
+
+    if latency['p50'] is not None:
+        print('latency (us): ' + ', '.join(
+            '{} {:,.1f}'.format(name, latency[name])
+            for name in ['min', 'p50', 'p99', 'p99.9', 'max']))
+
+    for error in results['errors']:
+        print(error, file=sys.stderr)
+
+    return 1 if results['errors'] else 0
+
+
+def bert_command(args):
+    import bert
+
+    ports = []
+
+    try:
+        for name in [args.port] + ([args.rx_port] if args.rx_port else []):
+            ports.append(open_port(name).port)
+
+        test = bert.BertTest(ports[0], ports[-1], args.pattern, args.size,
+                             args.bit_rate, args.duration)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+
+        for port in ports:
+            port.close()
+
+        return 1
+
+    def report():
+        stats = test.stats()
+        ber = stats['bit_error_rate']
+
+        print('{:,} bits, {:,} errors, BER {}, {:,}/{:,} frames errored, '
+              '{} sync losses{}'.format(
+                  stats['bits'], stats['bit_errors'],
+                  '{:.2e}'.format(ber) if ber is not None else '-',
+                  stats['frame_errors'], stats['frames'],
+                  stats['sync_losses'], '' if stats['synced'] else
+                  ' (not synchronized)'))
+
+        return stats
+
+    test.start()
+
+    try:
+        while test.is_alive():
+            time.sleep(args.interval)
+            report()
+    except KeyboardInterrupt:
+        pass
+
+    test.stop()
+
+    for port in ports:
+        port.close()
+
+    stats = report()
+
+    for error in stats['errors']:
+        print(error, file=sys.stderr)
+
+    return 1 if stats['errors'] else 0
+
+
+def tune_memory_cap_command(args):
+    ports = []
+
+    try:
+        for name in [args.port] + ([args.rx_port] if args.rx_port else []):
+            ports.append(open_port(name).port)
+
+        results = tuning.tune_memory_cap(
+            ports[0], args.frame_rate, ports[-1], args.size,
+            duration=args.duration, read_interval=args.read_interval,
+            max_loss=args.max_loss, apply=args.apply)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        for port in ports:
+            port.close()
+
+    print('{:>12} {:>12} {:>10} {:>14} {:>10}'.format(
+        'memory cap', 'frames/s', 'lost', 'peak in flight', 'sustained'))
+
+    for trial in results['trials']:
+        print('{:>12,} {:>12,.1f} {:>10,} {:>14,} {:>10}'.format(
+            trial['memory_cap'], trial['frame_rate'], trial['lost'],
+            trial['peak_in_flight'], 'yes' if trial['sustained'] else 'no'))
+
+    if results['recommended'] is None:
+        print('no memory cap kept up with {:,} frames/s'.format(
+            args.frame_rate), file=sys.stderr)
+        return 1
+
+    print('recommended memory cap: {:,} bytes{}'.format(
+        results['recommended'], ' (applied)' if args.apply else ''))
+
+    return 0
+
+
+def tune_fifo_command(args):
+    ports = []
+
+    try:
+        for name in [args.port] + ([args.rx_port] if args.rx_port else []):
+            ports.append(open_port(name).port)
+
+        triggers = None
+
+        if args.triggers:
+            triggers = [(level, level) for level in args.triggers]
+
+        trials = tuning.tune_fifo_triggers(ports[0], args.frame_rate,
+                                           ports[-1], args.size, triggers,
+                                           args.duration)
+
+        efficient = [t for t in trials if t['efficient']]
+
+        if args.apply and efficient:
+            best = efficient[0]
+            tuning.set_fifo_triggers(ports[0], ports[-1], best['rx_trigger'],
+                                     best['tx_trigger'])
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        for port in ports:
+            port.close()
+
+    print('{:>10} {:>10} {:>12} {:>10} {:>6} {:>10} {:>10}'.format(
+        'rx trigger', 'tx trigger', 'interrupts/s', 'frames/s', 'lost',
+        'p50 us', 'p99 us'))
+
+    for trial in trials:
+        print('{:>10} {:>10} {:>12,.0f} {:>10,.1f} {:>6,} {:>10,.1f} '
+              '{:>10,.1f}{}'.format(
+                  trial['rx_trigger'], trial['tx_trigger'],
+                  trial['interrupt_rate'], trial['frame_rate'], trial['lost'],
+                  trial['latency_p50'] or 0, trial['latency_p99'] or 0,
+                  ' *' if trial['efficient'] else ''))
+
+    print('* on the tradeoff curve, no other level has both fewer '
+          'interrupts and lower latency')
+
+    if args.apply:
+        if not efficient:
+            print('no level ran without loss, FIFOT was not changed',
+                  file=sys.stderr)
+            return 1
+
+        print('applied rx trigger {rx_trigger}, tx trigger '
+              '{tx_trigger}'.format(**efficient[0]))
+
+    return 0
+
+
+def baud_command(args):
+    import baud
+
+    try:
+        solution = baud.solve_baud_rate(args.rate, args.clock_frequency,
+                                        args.divisor, args.tolerance)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if solution is None:
+        print('no clock frequency gives {:,} bits/s within {:%}'.format(
+            args.rate, args.tolerance), file=sys.stderr)
+        return 1
+
+    print('clock frequency {:,} Hz, BGR {} (0x{:x}), divisor {}'.format(
+        solution.clock_frequency, solution.bgr, solution.bgr,
+        solution.divisor))
+    print('{:,.6f} bits/s, error {:.6%}'.format(solution.rate,
+                                                 solution.error))
+
+    if args.port:
+        # The DPLL oversampling lives in CCR0/CCR1 with the line coding,
+        # which is left to the user, so other divisors would run at the
+        # wrong rate
+        if solution.divisor != 1:
+            print('--port only programs solutions with divisor 1, set the '
+                  'DPLL for divisor {} in CCR0/CCR1 and write the BGR '
+                  'yourself'.format(solution.divisor), file=sys.stderr)
+            return 1
+
+        try:
+            state = open_port(args.port)
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            return 1
+
+        state.clock_frequency = args.clock_frequency
+
+        try:
+            if state.set_clock_frequency(solution.clock_frequency):
+                print('clock frequency set')
+
+            write_registers(state.port, {'BGR': solution.bgr})
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            return 1
+        finally:
+            state.port.close()
+
+    return 0
+
+
+def scan_command(args):
+    from pool import PortPool
+
+    try:
+        golden = load_settings(args.profile)
+        check_settings(golden)
+    except (OSError, InvalidSettingsError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    names = args.ports or port_names()
+
+    if not names:
+        print('No FSCC ports found', file=sys.stderr)
+        return 1
+
+    ignored = [] if args.all_registers else scan.IGNORED_REGISTERS
+    cache = scan.FingerprintCache(None if args.no_cache else args.cache)
+
+    # Ports stay open between watched scans, each scan still re-reads
+    # every setting
+    pool = PortPool(len(names)) if args.watch else None
+
+    try:
+        while True:
+            start = time.perf_counter()
+            results = scan.scan_ports(names, golden, args.workers,
+                                      pool=pool, cache=cache,
+                                      ignored_registers=ignored)
+            scan_time = time.perf_counter() - start
+
+            drifted = 0
+
+            for result in results:
+                if result.error:
+                    drifted += 1
+                    print('{:<16} failed: {}'.format(result.port_name,
+                                                     result.error))
+                    continue
+
+                if result.differences:
+                    drifted += 1
+
+                print('{:<16} {}{}'.format(
+                    result.port_name,
+                    'differs' if result.differences else 'matches',
+                    ' (changed since the last scan)' if result.changed
+                    else ''))
+
+                for name, (expected, actual) in result.differences.items():
+                    print('    {:<20} expected {:<12} found {}'.format(
+                        name, scan.format_value(name, expected),
+                        scan.format_value(name, actual)))
+
+            print('{} of {} ports match in {:.1f} ms'.format(
+                len(results) - drifted, len(results), scan_time * 1000))
+
+            cache.save()
+
+            if not args.watch:
+                return 1 if drifted else 0
+
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if pool:
+            pool.close_all()
+
+
+def backup_command(args):
+    names = args.ports or port_names()
+
+    if not names:
+        print('No FSCC ports found', file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+
+    try:
+        results = bundle.export_bundle(args.file, names, args.workers)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    total_time = time.perf_counter() - start
+
+    failures = 0
+
+    for result in results:
+        if result.error:
+            failures += 1
+            print('{:<16} failed: {}'.format(result.port_name, result.error))
+        else:
+            print('{:<16} saved'.format(result.port_name))
+
+    print('{} of {} ports saved in {:.1f} ms'.format(
+        len(results) - failures, len(results), total_time * 1000))
+
+    return 1 if failures else 0
+
+
+def restore_command(args):
+    start = time.perf_counter()
+
+    try:
+        results = bundle.restore_bundle(args.file, args.ports, args.workers,
+                                        args.dry_run)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    total_time = time.perf_counter() - start
+
+    failures = 0
+    changed = 0
+
+    for result in results:
+        if result.error:
+            failures += 1
+            print('{:<16} failed: {}'.format(result.port_name, result.error))
+            continue
+
+        if not result.differences:
+            print('{:<16} unchanged'.format(result.port_name))
+            continue
+
+        changed += 1
+
+        if result.unverified:
+            failures += 1
+            print('{:<16} not verified: {}'.format(
+                result.port_name, ', '.join(result.unverified)))
+        else:
+            print('{:<16} {}'.format(result.port_name, 'applied'
+                                     if result.applied else 'differs'))
+
+        for name, (expected, actual) in result.differences.items():
+            print('    {:<20} {:<12} was {}'.format(
+                name, scan.format_value(name, expected),
+                scan.format_value(name, actual)))
+
+    print('{} of {} ports {} in {:.1f} ms'.format(
+        changed, len(results),
+        'differ' if args.dry_run else 'restored', total_time * 1000))
+
+    return 1 if failures else 0
+
+
+def daemon_command(args):
+    try:
+        daemon.serve(args.socket, args.pool_size, args.idle_timeout)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    return 0
+
+
+def call_command(args):
+    try:
+        params = json.loads(args.params) if args.params else {}
+    except ValueError:
+        print('params must be JSON', file=sys.stderr)
+        return 1
+
+    try:
+        with daemon.DaemonClient(args.socket) as client:
+            if isinstance(params, list):
+                result = client.call(args.method, *params)
+            else:
+                result = client.call(args.method, **params)
+    except (OSError, daemon.RPCError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print(json.dumps(result, sort_keys=True, indent=4))
+
+    return 0
+
+
+def benchmark_command(args):
+    results = benchmark.run_benchmarks(args.latency, args.iterations,
+                                       args.frame_size, args.frame_count)
+    output = json.dumps(results, sort_keys=True, indent=4)
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output)
+    else:
+        print(output)
+
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='qfscc')
+    commands = parser.add_subparsers(dest='command')
+
+    apply_parser = commands.add_parser(
+        'apply', help='apply a .fscc settings file to ports')
+    apply_parser.add_argument('profile', help='.fscc settings file')
+    apply_parser.add_argument('--ports', nargs='+', metavar='PORT',
+                              help='port names or numbers (default: all)')
+    apply_parser.add_argument('--clock-frequency', type=int, metavar='HZ',
+                              help='also set the clock frequency')
+    apply_parser.add_argument('--workers', type=int,
+                              help='ports to configure at once '
+                                   '(default: all)')
+    apply_parser.set_defaults(func=apply_command)
+
+    capture_parser = commands.add_parser(
+        'capture', help='record received frames to a capture file')
+    capture_parser.add_argument('port', help='port name or number')
+    capture_parser.add_argument('file', help='capture file to create')
+    capture_parser.add_argument('--size', type=int, metavar='MB',
+                                default=capture.CAPTURE_SIZE // (1024 * 1024),
+                                help='capture file size, the oldest frames '
+                                     'are overwritten once it is full '
+                                     '(default: %(default)s)')
+    capture_parser.add_argument('--duration', type=float, metavar='SECONDS',
+                                help='stop after this long (default: until '
+                                     'interrupted)')
+    capture_parser.add_argument('--report', type=float, metavar='SECONDS',
+                                help='print the receive rates this often')
+    capture_parser.add_argument('--error-mask', type=lambda x: int(x, 0),
+                                default=0, metavar='MASK',
+                                help='appended status bits counted as '
+                                     'status errors')
+    capture_parser.add_argument('--fcs', choices=list(crc.CRC_MODES),
+                                help='count frames whose FCS (passed through '
+                                     'by the card) is wrong')
+    capture_parser.set_defaults(func=capture_command)
+
+    decode_parser = commands.add_parser(
+        'decode', help='split a capture into frames and summarize it')
+    decode_parser.add_argument('file', help='capture file')
+    decode_parser.add_argument('--frame-size', type=int,
+                               help='split rx_multiple buffers into frames '
+                                    'of this size (trailer included)')
+    decode_parser.add_argument('--append-status', action='store_true',
+                               help='rx_multiple frames end in a status word')
+    decode_parser.add_argument('--append-timestamp', action='store_true',
+                               help='rx_multiple frames end in a timestamp')
+    decode_parser.add_argument('--output', metavar='FILE',
+                               help='save the offsets, lengths, status, '
+                                    'timestamps and sequence numbers as a '
+                                    'NumPy .npz file')
+    decode_parser.set_defaults(func=decode_command)
+
+    fcs_parser = commands.add_parser(
+        'fcs', help='check the FCS of every frame in a capture')
+    fcs_parser.add_argument('file', help='capture file')
+    fcs_parser.add_argument('--mode', choices=list(crc.CRC_MODES),
+                            default=crc.CRC16_CCITT.name,
+                            help='(default: %(default)s)')
+    fcs_parser.add_argument('--frame-size', type=int,
+                            help='split rx_multiple buffers into frames '
+                                 'of this size (trailer included)')
+    fcs_parser.add_argument('--append-status', action='store_true',
+                            help='rx_multiple frames end in a status word')
+    fcs_parser.add_argument('--append-timestamp', action='store_true',
+                            help='rx_multiple frames end in a timestamp')
+    fcs_parser.add_argument('--list', type=int, default=20, metavar='N',
+                            help='frames with errors to list '
+                                 '(default: %(default)s)')
+    fcs_parser.add_argument('--output', metavar='FILE',
+                            help='save the results as JSON')
+    fcs_parser.set_defaults(func=fcs_command)
+
+    find_parser = commands.add_parser(
+        'find', help='list the frames of a capture by time, number or '
+                     'status')
+    find_parser.add_argument('file', help='capture file')
+    find_parser.add_argument('--from', dest='start', metavar='TIME',
+                             help='seconds after the oldest frame, or '
+                                  '"YYYY-MM-DD HH:MM:SS"')
+    find_parser.add_argument('--to', dest='end', metavar='TIME',
+                             help='seconds after the oldest frame, or '
+                                  '"YYYY-MM-DD HH:MM:SS"')
+    find_parser.add_argument('--frames', type=int, nargs=2,
+                             metavar=('FIRST', 'LAST'),
+                             help='range of frame sequence numbers')
+    find_parser.add_argument('--status-any', type=lambda x: int(x, 0),
+                             default=0, metavar='MASK',
+                             help='frames with any of these status bits set')
+    find_parser.add_argument('--status-missing', type=lambda x: int(x, 0),
+                             default=0, metavar='MASK',
+                             help='frames with any of these status bits clear')
+    find_parser.add_argument('--limit', type=int, default=100,
+                             help='frames to list (default: %(default)s)')
+    find_parser.set_defaults(func=find_command)
+
+    send_parser = commands.add_parser(
+        'send', help='transmit frames at a controlled rate')
+    send_parser.add_argument('port', help='port name or number')
+    source = send_parser.add_mutually_exclusive_group()
+    source.add_argument('--frame', action='append', metavar='HEX',
+                        help='frame to send, can be given more than once')
+    source.add_argument('--size', type=int, default=64,
+                        help='send a counting pattern of this many bytes '
+                             '(default: %(default)s)')
+    source.add_argument('--replay', metavar='FILE',
+                        help='send the frames of a capture file')
+    rate = send_parser.add_mutually_exclusive_group()
+    rate.add_argument('--frame-rate', type=float, metavar='FPS')
+    rate.add_argument('--bit-rate', type=float, metavar='BPS',
+                      help='payload bits per second')
+    rate.add_argument('--original-timing', action='store_true',
+                      help='replay with the gaps the frames were captured '
+                           'with')
+    send_parser.add_argument('--count', type=int,
+                             help='frames to send (default: until '
+                                  'interrupted)')
+    send_parser.add_argument('--duration', type=float, metavar='SECONDS')
+    send_parser.set_defaults(func=send_command)
+
+    loopback_parser = commands.add_parser(
+        'loopback', help='measure loopback throughput, loss and latency')
+    loopback_parser.add_argument('port', help='port to transmit on')
+    loopback_parser.add_argument('--rx-port', metavar='PORT',
+                                 help='port to receive on when the ports are '
+                                      'cabled together (default: the '
+                                      'transmitting port)')
+    loopback_parser.add_argument('--size', type=int, default=64,
+                                 help='frame size in bytes '
+                                      '(default: %(default)s)')
+    rate = loopback_parser.add_mutually_exclusive_group()
+    rate.add_argument('--frame-rate', type=float, metavar='FPS')
+    rate.add_argument('--bit-rate', type=float, metavar='BPS',
+                      help='payload bits per second')
+    loopback_parser.add_argument('--duration', type=float, default=10.0,
+                                 metavar='SECONDS',
+                                 help='(default: %(default)s)')
+    loopback_parser.add_argument('--count', type=int,
+                                 help='frames to send')
+    loopback_parser.add_argument('--output', metavar='FILE',
+                                 help='also write the JSON results, including '
+                                      'the latency histogram, to a file')
+    loopback_parser.set_defaults(func=loopback_command)
+
+    bert_parser = commands.add_parser(
+        'bert', help='run a bit error rate test with a PRBS pattern')
+    bert_parser.add_argument('port', help='port to transmit on')
+    bert_parser.add_argument('--rx-port', metavar='PORT',
+                             help='port to receive on when the ports are '
+                                  'cabled together (default: the '
+                                  'transmitting port)')
+    bert_parser.add_argument('--pattern', type=int, default=23,
+                             choices=[7, 15, 23, 31],
+                             help='PRBS order (default: %(default)s)')
+    bert_parser.add_argument('--size', type=int, default=1024,
+                             help='frame size in bytes '
+                                  '(default: %(default)s)')
+    bert_parser.add_argument('--bit-rate', type=float, metavar='BPS',
+                             help='(default: as fast as the port sends)')
+    bert_parser.add_argument('--duration', type=float, metavar='SECONDS',
+                             help='(default: until interrupted)')
+    bert_parser.add_argument('--interval', type=float, default=1.0,
+                             metavar='SECONDS',
+                             help='how often to print the counts '
+                                  '(default: %(default)s)')
+    bert_parser.set_defaults(func=bert_command)
+
+    tune_parser = commands.add_parser(
+        'tune', help='find port settings that keep up with a traffic rate')
+    tune_commands = tune_parser.add_subparsers(dest='setting')
+    tune_commands.required = True
+
+    memory_cap_parser = tune_commands.add_parser(
+        'memory-cap', help='find the smallest memory cap that keeps up '
+                           'with loopback traffic')
+    memory_cap_parser.add_argument('port', help='port to transmit on')
+    memory_cap_parser.add_argument('--rx-port', metavar='PORT',
+                                   help='port to receive on when the ports '
+                                        'are cabled together (default: the '
+                                        'transmitting port)')
+    memory_cap_parser.add_argument('--frame-rate', type=float, required=True,
+                                   metavar='FPS', help='rate to keep up with')
+    memory_cap_parser.add_argument('--size', type=int, default=1024,
+                                   help='frame size in bytes '
+                                        '(default: %(default)s)')
+    memory_cap_parser.add_argument('--duration', type=float,
+                                   default=tuning.TRIAL_TIME,
+                                   metavar='SECONDS',
+                                   help='traffic per memory cap tried '
+                                        '(default: %(default)s)')
+    memory_cap_parser.add_argument('--read-interval', type=float,
+                                   default=tuning.READ_INTERVAL,
+                                   metavar='SECONDS',
+                                   help='how often the receiver reads, like '
+                                        'the application will '
+                                        '(default: %(default)s)')
+    memory_cap_parser.add_argument('--max-loss', type=float, default=0.0,
+                                   metavar='RATIO',
+                                   help='fraction of frames that may be lost '
+                                        '(default: %(default)s)')
+    memory_cap_parser.add_argument('--apply', action='store_true',
+                                   help='set the recommended memory cap')
+    memory_cap_parser.set_defaults(func=tune_memory_cap_command)
+
+    fifo_parser = tune_commands.add_parser(
+        'fifo', help='measure interrupt rate, throughput and latency at '
+                     'several FIFO trigger levels')
+    fifo_parser.add_argument('port', help='port to transmit on')
+    fifo_parser.add_argument('--rx-port', metavar='PORT',
+                             help='port to receive on when the ports are '
+                                  'cabled together (default: the '
+                                  'transmitting port)')
+    fifo_parser.add_argument('--frame-rate', type=float, required=True,
+                             metavar='FPS')
+    fifo_parser.add_argument('--size', type=int, default=1024,
+                             help='frame size in bytes '
+                                  '(default: %(default)s)')
+    fifo_parser.add_argument('--triggers', type=int, nargs='+',
+                             metavar='BYTES',
+                             help='trigger levels to try (default: {})'.format(
+                                 ' '.join(str(level) for level
+                                          in tuning.FIFO_TRIGGERS)))
+    fifo_parser.add_argument('--duration', type=float,
+                             default=tuning.TRIAL_TIME, metavar='SECONDS',
+                             help='traffic per level tried '
+                                  '(default: %(default)s)')
+    fifo_parser.add_argument('--apply', action='store_true',
+                             help='set the level with the fewest interrupts '
+                                  'that ran without loss')
+    fifo_parser.set_defaults(func=tune_fifo_command)
+
+    baud_parser = commands.add_parser(
+        'baud', help='find the clock frequency and BGR for a bit rate')
+    baud_parser.add_argument('rate', type=float, help='bits per second')
+    baud_parser.add_argument('--clock-frequency', type=int, metavar='HZ',
+                             help='clock already programmed, kept if it can '
+                                  'reach the rate')
+    baud_parser.add_argument('--divisor', type=int, nargs='+', default=[1],
+                             choices=[1, 8, 16, 32],
+                             help='DPLL oversampling to allow, 1 when the '
+                                  'DPLL isn\'t used (default: 1)')
+    baud_parser.add_argument('--tolerance', type=float, default=0.001,
+                             metavar='RATIO',
+                             help='allowed rate error (default: '
+                                  '%(default)s)')
+    baud_parser.add_argument('--port',
+                             help='also program the port (divisor 1 only), '
+                                  'the clock only if it differs from '
+                                  '--clock-frequency')
+    baud_parser.set_defaults(func=baud_command)
+
+    scan_parser = commands.add_parser(
+        'scan', help='check that ports still match a .fscc settings file')
+    scan_parser.add_argument('profile', help='.fscc settings file')
+    scan_parser.add_argument('--ports', nargs='+', metavar='PORT',
+                             help='port names or numbers (default: all)')
+    scan_parser.add_argument('--workers', type=int,
+                             help='ports to read at once (default: all)')
+    scan_parser.add_argument('--all-registers', action='store_true',
+                             help='also compare STAR and VSTR')
+    scan_parser.add_argument('--cache', default=scan.CACHE_FILE,
+                             metavar='FILE',
+                             help='fingerprints from the last scan '
+                                  '(default: %(default)s)')
+    scan_parser.add_argument('--no-cache', action='store_true',
+                             help='don\'t read or write the cache')
+    scan_parser.add_argument('--watch', type=float, metavar='SECONDS',
+                             help='keep the ports open and scan again this '
+                                  'often')
+    scan_parser.set_defaults(func=scan_command)
+
+    backup_parser = commands.add_parser(
+        'backup', help='save the settings of every port to one bundle')
+    backup_parser.add_argument('file', help='bundle to create')
+    backup_parser.add_argument('--ports', nargs='+', metavar='PORT',
+                               help='port names or numbers (default: all)')
+    backup_parser.add_argument('--workers', type=int,
+                               help='ports to read at once (default: all)')
+    backup_parser.set_defaults(func=backup_command)
+
+    restore_parser = commands.add_parser(
+        'restore', help='apply a bundle back to the ports that differ')
+    restore_parser.add_argument('file', help='bundle from qfscc backup')
+    restore_parser.add_argument('--ports', nargs='+', metavar='PORT',
+                                help='port names or numbers (default: every '
+                                     'port in the bundle)')
+    restore_parser.add_argument('--workers', type=int,
+                                help='ports to restore at once '
+                                     '(default: all)')
+    restore_parser.add_argument('--dry-run', action='store_true',
+                                help='only list the ports that differ')
+    restore_parser.set_defaults(func=restore_command)
+
+    daemon_parser = commands.add_parser(
+        'daemon', help='serve port settings and captures over a local '
+                       'socket')
+    daemon_parser.add_argument('--socket', default=daemon.SOCKET_PATH,
+                               metavar='PATH',
+                               help='(default: %(default)s)')
+    daemon_parser.add_argument('--pool-size', type=int,
+                               default=daemon.POOL_SIZE,
+                               help='ports to keep open '
+                                    '(default: %(default)s)')
+    daemon_parser.add_argument('--idle-timeout', type=float,
+                               default=IDLE_TIMEOUT, metavar='SECONDS',
+                               help='seconds an unused port is kept open '
+                                    '(default: %(default)s)')
+    daemon_parser.set_defaults(func=daemon_command)
+
+    call_parser = commands.add_parser(
+        'call', help='call a method of a running daemon')
+    call_parser.add_argument('method', help='ports, get, set, '
+                                            'apply_profile, capture_start, '
+                                            'capture_stop or capture_status')
+    call_parser.add_argument('params', nargs='?',
+                             help='JSON object (or list) of parameters')
+    call_parser.add_argument('--socket', default=daemon.SOCKET_PATH,
+                             metavar='PATH',
+                             help='(default: %(default)s)')
+    call_parser.set_defaults(func=call_command)
+
+    benchmark_parser = commands.add_parser(
+        'benchmark', help='measure performance against simulated ports')
+    benchmark_parser.add_argument('--latency', type=float,
+                                  default=benchmark.LATENCY, metavar='SECONDS',
+                                  help='simulated driver call latency '
+                                       '(default: %(default)s)')
+    benchmark_parser.add_argument('--iterations', type=int,
+                                  default=benchmark.ITERATIONS,
+                                  help='(default: %(default)s)')
+    benchmark_parser.add_argument('--frame-size', type=int,
+                                  default=benchmark.FRAME_SIZE,
+                                  help='(default: %(default)s)')
+    benchmark_parser.add_argument('--frame-count', type=int,
+                                  default=benchmark.FRAME_COUNT,
+                                  help='(default: %(default)s)')
+    benchmark_parser.add_argument('--output', metavar='FILE',
+                                  help='write the JSON results to a file '
+                                       'instead of stdout')
+    benchmark_parser.set_defaults(func=benchmark_command)
+
+    args = parser.parse_args(argv)
+
+    if (args.command == 'send' and args.original_timing and
+            not args.replay):
+        send_parser.error('--original-timing needs --replay')
+
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    return args.func(args)
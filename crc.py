@@ -0,0 +1,321 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import binascii
+from collections import namedtuple, OrderedDict
+
+# width in bits, reflected polynomial, initial value, final xor. The FCS
+# follows the data least significant byte first, as HDLC sends it.
+CrcMode = namedtuple('CrcMode', ['name', 'width', 'polynomial', 'init',
+                                 'xor_out'])
+
+CRC16_CCITT = CrcMode('crc16-ccitt', 16, 0x8408, 0xffff, 0xffff)  # FCS-16
+CRC16 = CrcMode('crc16', 16, 0xa001, 0x0000, 0x0000)  # CRC-16/ARC
+CRC32 = CrcMode('crc32', 32, 0xedb88320, 0xffffffff, 0xffffffff)  # FCS-32
+
+CRC_MODES = OrderedDict((mode.name, mode) for mode in [CRC16_CCITT, CRC16,
+                                                      CRC32])
+
+SLICES = 8  # Bytes folded in per table step
+
+# Frames at least this long are checked faster one at a time by binascii
+# than in a batch, the per frame overhead is small next to them
+SINGLE_LENGTHS = {CRC32: 128, CRC16_CCITT: 1024}
+MAX_LISTED = 1000  # Mismatched frames kept by FcsStats
+
+_tables = {}
+
+# Bit reversal of every byte, crc_hqx only does the unreflected CCITT CRC
+_REVERSED = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+
+def fcs_size(mode):
+    return mode.width // 8
+
+
+def crc_table(mode):
+    table = []
+
+    for i in range(256):
+        crc = i
+
+        for bit in range(8):
+            crc = (crc >> 1) ^ mode.polynomial if crc & 1 else crc >> 1
+
+        table.append(crc)
+
+    return table
+
+
+def slicing_tables(mode):
+    """Returns the byte table and the slicing-by-8 tables, paired up into
+    SLICES // 2 tables indexed by 16 bits so a step takes half the
+    lookups."""
+    import numpy
+
+    tables = _tables.get(mode)
+
+    if tables is None:
+        table = crc_table(mode)
+        rows = [table]
+
+        # Row k is the CRC of a byte followed by k zero bytes
+        for k in range(1, SLICES):
+            rows.append([(x >> 8) ^ table[x & 0xff] for x in rows[-1]])
+
+        rows = numpy.array(rows, dtype=numpy.uint64)
+        x = numpy.arange(1 << 16)
+
+        pairs = numpy.array([rows[SLICES - 1 - 2 * j][x & 0xff] ^
+                             rows[SLICES - 2 - 2 * j][x >> 8]
+                             for j in range(SLICES // 2)])
+
+        tables = _tables[mode] = (rows[0], pairs)
+
+    return tables
+
+
+def _reverse16(value):
+    return (_REVERSED[value & 0xff] << 8) | _REVERSED[value >> 8]
+
+
+def crc(data, mode=CRC16_CCITT):
+    """Returns the CRC of one frame's data, FCS not included."""
+    if mode == CRC32:
+        return binascii.crc32(data)
+
+    if mode == CRC16_CCITT:
+        # The reflected CRC is the mirror image of the plain one run over
+        # bit reversed bytes
+        value = binascii.crc_hqx(bytes(data).translate(_REVERSED),
+                                 _reverse16(mode.init))
+        return _reverse16(value) ^ mode.xor_out
+
+    table = _tables.get((mode, 'bytes'))
+
+    if table is None:
+        table = _tables[(mode, 'bytes')] = crc_table(mode)
+
+    value = mode.init
+
+    for byte in bytes(data):
+        value = (value >> 8) ^ table[(value ^ byte) & 0xff]
+
+    return value ^ mode.xor_out
+
+
+def check_fcs(data, mode=CRC16_CCITT):
+    """Returns whether a frame ending in its FCS is intact."""
+    size = fcs_size(mode)
+
+    if len(data) < size:
+        return False
+
+    received = int.from_bytes(bytes(data[-size:]), 'little')
+
+    return crc(memoryview(data)[:-size], mode) == received
+
+
+def crc_frames(buffer, starts, lengths, mode=CRC16_CCITT):
+    """Returns the CRCs of many frames in buffer at once.
+
+    Every frame advances SLICES bytes per step using the slicing tables,
+    then the last few bytes one at a time. Frames are grouped by where
+    they start within a word so each step reads one 64-bit word per frame,
+    and sorted by length so a step only touches the frames still going.
+    """
+    import numpy
+    import decode
+
+    buffer = decode.as_array(buffer)
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    lengths = numpy.asarray(lengths, dtype=numpy.int64)
+    table, pairs = slicing_tables(mode)
+
+    crcs = numpy.full(len(starts), mode.init, dtype=numpy.uint64)
+
+    if mode in SINGLE_LENGTHS:
+        single = lengths >= SINGLE_LENGTHS[mode]
+
+        for i in numpy.flatnonzero(single).tolist():
+            crcs[i] = crc(buffer[starts[i]:starts[i] + lengths[i]], mode)
+
+        # Left out of the batch and past the final xor below
+        crcs[single] ^= numpy.uint64(mode.xor_out)
+        lengths = numpy.where(single, 0, lengths)
+
+    words = lengths // SLICES
+    alignments = starts % SLICES
+
+    for alignment in range(SLICES):
+        group = numpy.flatnonzero((alignments == alignment) & (words > 0))
+
+        if not len(group):
+            continue
+
+        count = (len(buffer) - alignment) // SLICES
+        view = buffer[alignment:alignment + count * SLICES].view('<u8')
+
+        group = group[numpy.argsort(-words[group], kind='stable')]
+        first = (starts[group] - alignment) // SLICES
+        descending = -words[group]
+
+        for step in range(int(words[group[0]])):
+            active = numpy.searchsorted(descending, -step, 'left')
+            frames = group[:active]
+
+            value = crcs[frames] ^ view[first[:active] + step]
+            result = pairs[0][value & 0xffff]
+
+            for j in range(1, SLICES // 2):
+                result ^= pairs[j][(value >> (16 * j)) & 0xffff]
+
+            crcs[frames] = result
+
+    remaining = lengths - words * SLICES
+    ends = starts + words * SLICES
+
+    for i in range(SLICES - 1):
+        frames = numpy.flatnonzero(remaining > i)
+
+        if not len(frames):
+            break
+
+        byte = buffer[ends[frames] + i].astype(numpy.uint64)
+        value = crcs[frames]
+        crcs[frames] = (value >> 8) ^ table[(value ^ byte) & 0xff]
+
+    return crcs ^ numpy.uint64(mode.xor_out)
+
+
+def check_frames(buffer, starts, lengths, mode=CRC16_CCITT):
+    """Checks many frames that end in their FCS.
+
+    Returns (ok, computed, received) arrays. Frames too short to hold an
+    FCS are not ok and have both CRCs 0.
+    """
+    import numpy
+    import decode
+
+    buffer = decode.as_array(buffer)
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    lengths = numpy.asarray(lengths, dtype=numpy.int64) - fcs_size(mode)
+
+    short = lengths < 0
+    lengths[short] = 0
+
+    computed = crc_frames(buffer, starts, lengths, mode)
+    computed[short] = 0
+
+    # A short frame has no FCS to read, and at the end of the buffer its
+    # would be past the end
+    received = numpy.zeros(len(starts), dtype=numpy.uint64)
+    fcs = decode.gather(buffer, starts[~short] + lengths[~short],
+                        fcs_size(mode))
+    received[~short] = fcs.view('<u{}'.format(fcs_size(mode))).reshape(-1)
+
+    return (computed == received) & ~short, computed, received
+
+
+class FcsStats(object):
+    """Totals FCS checks over the batches of a capture."""
+
+    def __init__(self, mode=CRC16_CCITT):
+        self.mode = mode
+        self.frames = 0
+        self.errors = 0
+        self.short = 0
+        self.longest_burst = 0
+        self.errors_by_status = {}
+        self.mismatches = []  # (sequence, length, status) of the first ones
+
+        self._burst = 0
+
+    def update(self, frames, ok):
+        """Adds a decode.Frames batch and the ok array check_frames gave
+        for it."""
+        import numpy
+
+        self.frames += len(ok)
+        self.short += int((frames.lengths < fcs_size(self.mode)).sum())
+
+        bad = numpy.flatnonzero(~ok)
+        self.errors += len(bad)
+
+        values, counts = numpy.unique(frames.status[bad], return_counts=True)
+
+        for value, count in zip(values.tolist(), counts.tolist()):
+            self.errors_by_status[value] = (
+                self.errors_by_status.get(value, 0) + count)
+
+        for i in bad[:MAX_LISTED - len(self.mismatches)].tolist():
+            self.mismatches.append((int(frames.sequences[i]),
+                                    int(frames.lengths[i]),
+                                    int(frames.status[i])))
+
+        self._count_bursts(ok)
+
+    def _count_bursts(self, ok):
+        import numpy
+
+        if ok.all():
+            self._burst = 0
+            return
+
+        # Runs of errors, carrying the last one over from the batch before
+        edges = numpy.diff(numpy.concatenate(([0], (~ok).astype(numpy.int8),
+                                              [0])))
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1)
+        runs = ends - starts
+
+        if starts[0] == 0:
+            runs[0] += self._burst
+
+        self.longest_burst = max(self.longest_burst, int(runs.max()))
+        self._burst = int(runs[-1]) if ends[-1] == len(ok) else 0
+
+    def as_dict(self):
+        return OrderedDict([
+            ('mode', self.mode.name),
+            ('frames', self.frames),
+            ('errors', self.errors),
+            ('error_ratio', self.errors / self.frames if self.frames else 0),
+            ('short', self.short),
+            ('longest_burst', self.longest_burst),
+            ('errors_by_status', OrderedDict(
+                ('{:04x}'.format(status), count)
+                for status, count in sorted(self.errors_by_status.items()))),
+            ('mismatches', self.mismatches)])
+
+
+def check_capture(capture_file, mode=CRC16_CCITT, **kwargs):
+    """Checks the FCS of every frame in a capture and returns its
+    FcsStats, see decode.decode_records for the keyword arguments."""
+    import decode
+
+    stats = FcsStats(mode)
+
+    for frames in decode.decode_capture(capture_file, **kwargs):
+        ok, computed, received = check_frames(frames.buffer, frames.offsets,
+                                              frames.lengths, mode)
+        stats.update(frames, ok)
+
+    return stats
@@ -0,0 +1,414 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import inspect
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import *
+from transaction import ChangeSet, ApplyError, apply_change_set
+from pool import PortPool, IDLE_TIMEOUT
+from capture import CaptureFile, CaptureRecorder, CAPTURE_SIZE
+
+
+SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or
+                           tempfile.gettempdir(), 'qfscc.sock')
+
+POOL_SIZE = 32  # The daemon keeps more ports open than the dialog does
+MAX_MESSAGE = 1024 * 1024
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+PORT_ERROR = -32000
+
+
+class RPCError(Exception):
+    """A JSON-RPC error, raised by the daemon's methods and by
+    DaemonClient.call."""
+
+    def __init__(self, code, message):
+        super(RPCError, self).__init__(code, message)
+
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class ControlDaemon(object):
+    """Serves port settings and captures to local clients over JSON-RPC.
+
+    Ports are kept open in a PortPool so repeated queries only cost a
+    re-read of the settings (or nothing, within the pool's revalidate
+    time). Requests for the same port are serialized with its port lock,
+    which the pool also takes to revalidate.
+    """
+
+    def __init__(self, pool=None, workers=None, enumerate_ports=port_names):
+        self.pool = pool if pool is not None else PortPool(POOL_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=workers or 16)
+        self.enumerate_ports = enumerate_ports
+        self.captures = {}
+
+        self.methods = {
+            'ports': self.ports,
+            'get': self.get,
+            'set': self.set,
+            'apply_profile': self.apply_profile,
+            'capture_start': self.capture_start,
+            'capture_stop': self.capture_stop,
+            'capture_status': self.capture_status,
+        }
+
+    def _check_port(self, port_name):
+        if not isinstance(port_name, (str, int)):
+            raise RPCError(INVALID_PARAMS,
+                           'Invalid port name: {}'.format(port_name))
+
+        try:
+            port_number(port_name)
+        except ValueError as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+
+    def _use_port(self, port_name, function):
+        self._check_port(port_name)
+
+        state = self.pool.acquire(port_name)
+
+        try:
+            with port_lock(state.port):
+                return function(state)
+        finally:
+            self.pool.release(port_name, state)
+
+    def ports(self, refresh=False):
+        """Returns the port names."""
+        if refresh:
+            return self.enumerate_ports(True)
+
+        return self.enumerate_ports()
+
+    def get(self, port, refresh=False):
+        """Returns a port's settings in the .fscc layout."""
+        def get_settings(state):
+            if refresh:
+                state.refresh()
+
+            return state._to_json()
+
+        return self._use_port(port, get_settings)
+
+    def set(self, port, settings):
+        """Applies settings in the .fscc layout, returning the ones that
+        didn't read back what was written."""
+        check_settings(settings)
+
+        def set_settings(state):
+            unverified = apply_change_set(state,
+                                          ChangeSet.from_settings(settings))
+            return dict((name, list(values))
+                        for name, values in unverified.items())
+
+        return {'unverified': self._use_port(port, set_settings)}
+
+    async def apply_profile(self, profile, ports=None):
+        """Applies a .fscc file (or settings) to several ports at once."""
+        loop = asyncio.get_event_loop()
+
+        if isinstance(profile, str):
+            settings = await loop.run_in_executor(self.executor,
+                                                  load_settings, profile)
+        else:
+            settings = profile
+
+        check_settings(settings)
+
+        if ports is None:
+            ports = await loop.run_in_executor(self.executor,
+                                               self.enumerate_ports)
+
+        async def apply_one(port):
+            try:
+                result = await loop.run_in_executor(self.executor, self.set,
+                                                    port, settings)
+            except Exception as e:
+                return {'port': port, 'error': str(e)}
+
+            result['port'] = port
+            return result
+
+        return await asyncio.gather(*[apply_one(port) for port in ports])
+
+    def capture_start(self, port, file, size=CAPTURE_SIZE):
+        """Starts recording a port's received frames to a capture file."""
+        self._check_port(port)
+
+        if port in self.captures:
+            raise ValueError('{} is already capturing'.format(port))
+
+        state = self.pool.acquire(port)
+
+        try:
+            capture_file = CaptureFile(file, int(size))
+        except Exception:
+            self.pool.release(port, state)
+            raise
+
+        recorder = CaptureRecorder(state.port, capture_file)
+        recorder.start()
+
+        self.captures[port] = (recorder, capture_file, file, time.time(),
+                               state)
+
+        return self._capture_status(port)
+
+    def capture_stop(self, port):
+        """Stops a capture, returning its final counts."""
+        try:
+            recorder, capture_file, file, started, state = self.captures[port]
+        except KeyError:
+            raise ValueError('{} is not capturing'.format(port))
+
+        recorder.stop()
+        status = self._capture_status(port)
+
+        del self.captures[port]
+        capture_file.close()
+        self.pool.release(port, state)
+
+        return status
+
+    def capture_status(self, port=None):
+        """Returns the counts of one capture or of all of them."""
+        if port is not None:
+            if port not in self.captures:
+                raise ValueError('{} is not capturing'.format(port))
+
+            return self._capture_status(port)
+
+        return dict((name, self._capture_status(name))
+                    for name in list(self.captures))
+
+    def _capture_status(self, port):
+        recorder, capture_file, file, started, state = self.captures[port]
+
+        return {
+            'file': file,
+            'started': started,
+            'frames': recorder.frames,
+            'bytes': recorder.bytes,
+            'wraps': capture_file.wraps,
+            'running': recorder.is_alive(),
+            'error': str(recorder.error) if recorder.error else None,
+        }
+
+    async def call(self, method_name, params):
+        """Runs a method, blocking ones on the worker threads."""
+        try:
+            method = self.methods[method_name]
+        except (KeyError, TypeError):
+            raise RPCError(METHOD_NOT_FOUND,
+                           'Method not found: {}'.format(method_name))
+
+        args, kwargs = [], {}
+
+        if isinstance(params, list):
+            args = params
+        elif isinstance(params, dict):
+            kwargs = params
+        elif params is not None:
+            raise RPCError(INVALID_PARAMS, 'params must be a list or object')
+
+        try:
+            inspect.signature(method).bind(*args, **kwargs)
+        except TypeError as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+
+        try:
+            if asyncio.iscoroutinefunction(method):
+                return await method(*args, **kwargs)
+
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor, lambda: method(*args, **kwargs))
+        except RPCError:
+            raise
+        except (OSError, ValueError, KeyError, ApplyError) as e:
+            raise RPCError(PORT_ERROR, str(e) or e.__class__.__name__)
+        except Exception as e:
+            raise RPCError(INTERNAL_ERROR, '{}: {}'.format(
+                e.__class__.__name__, e))
+
+    async def dispatch(self, line):
+        """Returns the response to one request line, None for
+        notifications."""
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError:
+            return {'jsonrpc': '2.0', 'id': None,
+                    'error': {'code': PARSE_ERROR, 'message': 'Parse error'}}
+
+        if not isinstance(request, dict) or 'method' not in request:
+            return {'jsonrpc': '2.0', 'id': None,
+                    'error': {'code': INVALID_REQUEST,
+                              'message': 'Invalid request'}}
+
+        request_id = request.get('id')
+
+        try:
+            result = await self.call(request['method'],
+                                     request.get('params'))
+        except RPCError as e:
+            response = {'error': {'code': e.code, 'message': e.message}}
+        else:
+            response = {'result': result}
+
+        if 'id' not in request:
+            return None
+
+        response['jsonrpc'] = '2.0'
+        response['id'] = request_id
+
+        return response
+
+    async def handle_client(self, reader, writer):
+        # One request per line, a client's requests are answered in order
+        # while other clients are served in between
+        try:
+            while True:
+                line = await reader.readline()
+
+                if not line:
+                    break
+
+                if not line.strip():
+                    continue
+
+                response = await self.dispatch(line)
+
+                if response is not None:
+                    writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                    await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path=SOCKET_PATH):
+        server = await asyncio.start_unix_server(self.handle_client,
+                                                 path=path, limit=MAX_MESSAGE)
+
+        # Only this user can configure ports through the socket
+        os.chmod(path, 0o600)
+
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        for port in list(self.captures):
+            self.capture_stop(port)
+
+        self.pool.close_all()
+        self.executor.shutdown()
+
+
+def serve(path=SOCKET_PATH, pool_size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT,
+          opener=open_port, enumerate_ports=port_names):
+    """Runs a ControlDaemon on a Unix socket until interrupted."""
+    if os.path.exists(path):
+        # Left behind by a daemon that didn't shut down, unless one is
+        # still listening
+        try:
+            DaemonClient(path).close()
+        except OSError:
+            os.unlink(path)
+        else:
+            raise OSError('A daemon is already listening on {}'.format(path))
+
+    daemon = ControlDaemon(PortPool(pool_size, idle_timeout, opener=opener),
+                           enumerate_ports=enumerate_ports)
+
+    try:
+        asyncio.run(daemon.serve(path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+class DaemonClient(object):
+    """Calls a running daemon's methods, one request at a time."""
+
+    def __init__(self, path=SOCKET_PATH, timeout=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+
+        try:
+            self.socket.connect(path)
+        except OSError:
+            self.socket.close()
+            raise
+
+        self.file = self.socket.makefile('rwb')
+        self.next_id = 1
+
+    def call(self, method, *args, **kwargs):
+        """Returns a method's result, raising RPCError for errors."""
+        request = {'jsonrpc': '2.0', 'id': self.next_id, 'method': method,
+                   'params': list(args) if args else kwargs}
+        self.next_id += 1
+
+        self.file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.file.flush()
+
+        line = self.file.readline()
+
+        if not line:
+            raise OSError('The daemon closed the connection')
+
+        response = json.loads(line.decode('utf-8'))
+
+        if 'error' in response:
+            raise RPCError(response['error']['code'],
+                           response['error']['message'])
+
+        return response['result']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,249 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import struct
+from collections import namedtuple
+
+import numpy
+
+import capture
+
+
+# Layouts the driver uses for the appended timestamp
+FILETIME = 'filetime'  # Windows, 100 ns intervals since 1601
+TIMEVAL32 = 'timeval32'  # Linux on 32-bit
+TIMEVAL64 = 'timeval64'  # Linux on 64-bit
+
+if os.name == 'nt':
+    NATIVE_TIMESTAMP = FILETIME
+elif capture.TIMESTAMP_SIZE == 16:
+    NATIVE_TIMESTAMP = TIMEVAL64
+else:
+    NATIVE_TIMESTAMP = TIMEVAL32
+
+TIMESTAMP_SIZES = {FILETIME: 8, TIMEVAL32: 8, TIMEVAL64: 16}
+
+BATCH_SIZE = 1000000  # Capture records decoded at a time
+
+RECORD_DTYPE = numpy.dtype([('length', '<u4'), ('flags', '<u2'),
+                            ('status', '<u2'), ('timestamp', '<f8'),
+                            ('sequence', '<u8')])
+
+# Frames found in a buffer. offsets and lengths locate each payload in
+# buffer, status is 0 and timestamps NaN where nothing was appended.
+Frames = namedtuple('Frames', ['buffer', 'offsets', 'lengths', 'status',
+                               'timestamps', 'sequences'])
+
+
+def as_array(buffer):
+    """Returns a uint8 array over a bytes-like object without copying."""
+    if isinstance(buffer, numpy.ndarray):
+        return buffer.view(numpy.uint8).reshape(-1)
+
+    return numpy.frombuffer(buffer, dtype=numpy.uint8)
+
+
+def gather(buffer, offsets, width):
+    """Returns a (len(offsets), width) array of the bytes at each offset."""
+    index = offsets.astype(numpy.int64)[:, None] + numpy.arange(width)
+    return numpy.ascontiguousarray(buffer[index])
+
+
+def decode_status(buffer, offsets):
+    status = gather(buffer, offsets, 2)
+    return status.view('<u2').reshape(-1)
+
+
+def decode_timestamps(buffer, offsets, timestamp_format=NATIVE_TIMESTAMP):
+    """Converts appended timestamps to seconds since the epoch."""
+    if timestamp_format == FILETIME:
+        filetime = gather(buffer, offsets, 8).view('<i8').reshape(-1)
+        return filetime / 10000000 - 11644473600
+
+    if timestamp_format == TIMEVAL64:
+        timeval = gather(buffer, offsets, 16).view('<i8')
+    else:
+        timeval = gather(buffer, offsets, 8).view('<i4')
+
+    return timeval[:, 0] + timeval[:, 1] / 1000000
+
+
+def decode_trailers(buffer, starts, lengths, append_status, append_timestamp,
+                    timestamp_format=NATIVE_TIMESTAMP, sequences=None):
+    """Splits frames that end in appended status/timestamp bytes.
+
+    starts and lengths locate each frame including its trailer.
+    """
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    lengths = numpy.asarray(lengths, dtype=numpy.int64)
+    ends = starts + lengths
+
+    status = numpy.zeros(len(starts), dtype=numpy.uint16)
+    timestamps = numpy.full(len(starts), numpy.nan)
+
+    if append_timestamp:
+        ends = ends - TIMESTAMP_SIZES[timestamp_format]
+        timestamps = decode_timestamps(buffer, ends, timestamp_format)
+
+    if append_status:
+        ends = ends - capture.STATUS_SIZE
+        status = decode_status(buffer, ends)
+
+    if sequences is None:
+        sequences = numpy.arange(len(starts), dtype=numpy.uint64)
+
+    return Frames(buffer, starts, ends - starts, status, timestamps,
+                  sequences)
+
+
+def split_frames(buffer, lengths, append_status, append_timestamp,
+                 timestamp_format=NATIVE_TIMESTAMP):
+    """Splits back to back frames of known lengths (trailers included)."""
+    buffer = as_array(buffer)
+    lengths = numpy.asarray(lengths, dtype=numpy.int64)
+    starts = numpy.cumsum(lengths) - lengths
+
+    return decode_trailers(buffer, starts, lengths, append_status,
+                           append_timestamp, timestamp_format)
+
+
+def split_fixed(buffer, frame_size, append_status, append_timestamp,
+                timestamp_format=NATIVE_TIMESTAMP):
+    """Splits an rx_multiple buffer holding frames of one size.
+
+    frame_size includes the trailer. The driver doesn't mark where frames
+    end in an rx_multiple buffer, so frames of varying length can't be
+    split without knowing their lengths (see split_frames).
+    """
+    buffer = as_array(buffer)
+    count = len(buffer) // frame_size
+    starts = numpy.arange(count, dtype=numpy.int64) * frame_size
+
+    return decode_trailers(buffer, starts, numpy.full(count, frame_size),
+                           append_status, append_timestamp, timestamp_format)
+
+
+def record_offsets(capture_file, count, offset=None):
+    """Returns the file offsets of count capture records and the ring
+    offset of the record after them.
+
+    Starts at the oldest record unless a ring offset returned by an earlier
+    call is given. Only record lengths are read here, everything else is
+    decoded in bulk.
+    """
+    length_of = struct.Struct('<I').unpack_from
+    buffer = capture_file._map
+    data_offset = capture_file.data_offset
+    capacity = capture_file.capacity
+    header_size = capture.RECORD_HEADER.size
+    alignment = capture.RECORD_ALIGNMENT
+
+    offsets = numpy.empty(count, dtype=numpy.int64)
+
+    if offset is None:
+        offset = capture_file.head
+
+    for i in range(count):
+        if offset + header_size > capacity:
+            offset = 0
+
+        length = length_of(buffer, data_offset + offset)[0]
+
+        if length == capture.WRAP_MARKER:
+            offset = 0
+            length = length_of(buffer, data_offset)[0]
+
+        offsets[i] = data_offset + offset
+
+        size = header_size + length
+        offset += size + (-size % alignment)
+
+    return offsets, offset
+
+
+def decode_records(capture_file, offsets, frame_size=None,
+                   append_status=False, append_timestamp=False,
+                   timestamp_format=NATIVE_TIMESTAMP):
+    """Decodes the capture records at offsets into Frames.
+
+    Records holding a raw rx_multiple buffer are split into frame_size
+    frames (with the given trailer settings) if frame_size is set, and
+    returned whole otherwise.
+    """
+    buffer = as_array(capture_file._map)
+    headers = gather(buffer, offsets, RECORD_DTYPE.itemsize)
+    headers = headers.view(RECORD_DTYPE).reshape(-1)
+
+    starts = offsets + capture.RECORD_HEADER.size
+    lengths = headers['length'].astype(numpy.int64)
+    status = headers['status'].copy()
+    timestamps = headers['timestamp'].copy()
+    timestamps[(headers['flags'] & capture.HAS_TIMESTAMP) == 0] = numpy.nan
+    sequences = headers['sequence']
+
+    multiple = (headers['flags'] & capture.MULTIPLE) != 0
+
+    if not frame_size or not multiple.any():
+        return Frames(buffer, starts, lengths, status, timestamps, sequences)
+
+    # Each raw buffer becomes lengths // frame_size frames
+    counts = numpy.where(multiple, lengths // frame_size, 1)
+    record = numpy.repeat(numpy.arange(len(offsets)), counts)
+    first = numpy.cumsum(counts) - counts
+    index = numpy.arange(len(record)) - first[record]
+
+    frame_starts = starts[record] + index * numpy.where(multiple[record],
+                                                        frame_size, 0)
+    frame_lengths = numpy.where(multiple[record], frame_size, lengths[record])
+
+    split = decode_trailers(buffer, frame_starts, frame_lengths,
+                            append_status, append_timestamp,
+                            timestamp_format, sequences[record])
+
+    is_multiple = multiple[record]
+
+    return Frames(buffer, frame_starts,
+                  numpy.where(is_multiple, split.lengths, frame_lengths),
+                  numpy.where(is_multiple, split.status, status[record]),
+                  numpy.where(is_multiple, split.timestamps,
+                              timestamps[record]),
+                  sequences[record])
+
+
+def found_offsets(capture_file, **conditions):
+    """Returns the file offsets of the records capture_file.find() matches,
+    for decode_records."""
+    return numpy.fromiter(capture_file.find_offsets(**conditions),
+                          dtype=numpy.int64)
+
+
+def decode_capture(capture_file, batch_size=BATCH_SIZE, **kwargs):
+    """Yields the frames of a capture as Frames batches of up to
+    batch_size records, see decode_records for the keyword arguments."""
+    remaining = len(capture_file)
+    offset = None
+
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        offsets, offset = record_offsets(capture_file, count, offset)
+        remaining -= count
+
+        yield decode_records(capture_file, offsets, **kwargs)
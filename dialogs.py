@@ -20,6 +20,8 @@
 
 from PySide.QtGui import *
 
+from portstate import CLOCK_FREQUENCY_RANGE
+
 
 class FNoPortsFound(QMessageBox):
 
@@ -59,12 +61,23 @@ class FInvalidClockFrequency(QMessageBox):
     def __init__(self, *args, **kwargs):
         super(FInvalidClockFrequency, self).__init__(*args, **kwargs)
 
-        value_range = (15000, 270000000)
-
         self.setWindowTitle('Invalid Clock Frequency')
         self.setText('The clock frequency was not set. Make sure to set the '
                      'clock frequency to a value between '
-                     '{:,.0f} and {:,.0f} Hz.'.format(*value_range))
+                     '{:,.0f} and {:,.0f} Hz.'.format(*CLOCK_FREQUENCY_RANGE))
+        self.setIcon(QMessageBox.Warning)
+
+
+class FBaudRateNotFound(QMessageBox):
+
+    def __init__(self, rate, *args, **kwargs):
+        super(FBaudRateNotFound, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('Baud Rate Not Found')
+        self.setText('No clock frequency between {:,.0f} and {:,.0f} Hz gives '
+                     'a bit rate close enough to {:,}.'.format(
+                         CLOCK_FREQUENCY_RANGE[0], CLOCK_FREQUENCY_RANGE[1],
+                         rate))
         self.setIcon(QMessageBox.Warning)
 
 
@@ -87,3 +100,99 @@ class FInvalidSettingsFile(QMessageBox):
         self.setWindowTitle('Invalid Settings File')
         self.setText('There was a problem opening this settings file. Make sure '
                      'you select the correct file.')
+
+
+class FMemoryCapTuned(QMessageBox):
+
+    def __init__(self, memory_cap, frame_rate, *args, **kwargs):
+        super(FMemoryCapTuned, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('Memory Cap Tuned')
+
+        if memory_cap is None:
+            self.setText('None of the memory caps tried kept up with {:,} '
+                         'frames per second. Make sure the port is looped '
+                         'back.'.format(frame_rate))
+            self.setIcon(QMessageBox.Warning)
+        else:
+            self.setText('A memory cap of {:,} bytes kept up with {:,} '
+                         'frames per second. Press Apply to use '
+                         'it.'.format(memory_cap, frame_rate))
+            self.setIcon(QMessageBox.Information)
+
+
+class FCaptureFailed(QMessageBox):
+
+    def __init__(self, *args, **kwargs):
+        super(FCaptureFailed, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('Capture Failed')
+        self.setText('There was a problem capturing to this file. Make sure '
+                     'the file can be written and there is enough disk '
+                     'space.')
+        self.setIcon(QMessageBox.Warning)
+
+
+class FSettingsNotVerified(QMessageBox):
+
+    def __init__(self, setting_names, *args, **kwargs):
+        super(FSettingsNotVerified, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('Settings Not Verified')
+        self.setText('The following settings did not read back the value '
+                     'that was written: {}.'.format(', '.join(setting_names)))
+        self.setIcon(QMessageBox.Warning)
+
+
+class FApplyFailed(QMessageBox):
+
+    def __init__(self, error, *args, **kwargs):
+        super(FApplyFailed, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('Apply Failed')
+
+        if error.rolled_back:
+            self.setText('The settings could not be applied ({}). The '
+                         'previous settings were restored.'.format(
+                             error.error))
+            self.setIcon(QMessageBox.Warning)
+        else:
+            self.setText('The settings could not be applied ({}) and the '
+                         'previous settings could not all be restored. '
+                         'Check the port before using it.'.format(
+                             error.error))
+            self.setIcon(QMessageBox.Critical)
+
+
+class FBulkActionFailed(QMessageBox):
+
+    def __init__(self, action, failures, *args, **kwargs):
+        super(FBulkActionFailed, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('{} Failed'.format(action))
+        self.setText('{} failed on {} of the ports:\n\n{}'.format(
+            action, len(failures), '\n'.join(
+                '{}: {}'.format(name, error)
+                for name, error in sorted(failures.items()))))
+        self.setIcon(QMessageBox.Warning)
+
+
+class FInvalidBundle(QMessageBox):
+
+    def __init__(self, *args, **kwargs):
+        super(FInvalidBundle, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('Invalid Settings Bundle')
+        self.setText('There was a problem opening this settings bundle. Make '
+                     'sure you select a bundle saved by Back Up.')
+
+
+class FBackupFailed(QMessageBox):
+
+    def __init__(self, *args, **kwargs):
+        super(FBackupFailed, self).__init__(*args, **kwargs)
+
+        self.setWindowTitle('Back Up Failed')
+        self.setText('There was a problem saving the settings bundle. Make '
+                     'sure the file can be written.')
+        self.setIcon(QMessageBox.Warning)
@@ -0,0 +1,148 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from portstate import *
+from transaction import ChangeSet, apply_change_set
+
+
+class InvalidSettingsError(ValueError):
+    pass
+
+
+class SettingsNotVerifiedError(Exception):
+    """Settings were written but didn't read back what was written."""
+
+    def __init__(self, unverified):
+        super(SettingsNotVerifiedError, self).__init__(unverified)
+
+        self.unverified = unverified
+
+    def __str__(self):
+        return 'not verified: {}'.format(', '.join(self.unverified))
+
+
+PortResult = namedtuple('PortResult', ['port_name', 'open_time', 'apply_time',
+                                       'unverified', 'error'])
+
+
+def load_settings(filename):
+    """Loads a .fscc settings file."""
+    with open(filename, 'r') as infile:
+        try:
+            return json.load(infile)
+        except ValueError:
+            raise InvalidSettingsError('{} is not a valid settings '
+                                       'file'.format(filename))
+
+
+def check_settings(settings):
+    """Raises InvalidSettingsError for values the widgets would reject."""
+    if 'memory_cap' in settings:
+        try:
+            memory_cap = [int(settings['memory_cap'][key])
+                          for key in ('input', 'output')]
+        except (KeyError, TypeError, ValueError):
+            raise InvalidSettingsError('Invalid memory cap')
+
+        if min(memory_cap) < 0:
+            raise InvalidSettingsError('Invalid memory cap')
+
+    if 'clock_frequency' in settings:
+        try:
+            clock_frequency = int(settings['clock_frequency'])
+        except (TypeError, ValueError):
+            raise InvalidSettingsError('Invalid clock frequency')
+
+        low, high = CLOCK_FREQUENCY_RANGE
+
+        if not low <= clock_frequency <= high:
+            raise InvalidSettingsError('Invalid clock frequency')
+
+    for name, value in settings.get('registers', {}).items():
+        try:
+            int(value, 0)
+        except (TypeError, ValueError):
+            raise InvalidSettingsError('Invalid {} value'.format(name))
+
+
+def apply_settings(port, settings, state=None):
+    """Applies settings in the .fscc layout to an open port.
+
+    This follows what importing the settings in PortForm and pressing Apply
+    does: settings already on the card aren't written again, settings the
+    port doesn't support are skipped and a failed write rolls the others
+    back (raising ApplyError). Returns {setting: (written, read back)} for
+    the settings that didn't read back what was written.
+    """
+    check_settings(settings)
+
+    if state is None:
+        state = PortState(port)
+
+    return apply_change_set(state, ChangeSet.from_settings(settings))
+
+
+def configure_port(port_name, settings, opener=open_port):
+    """Opens a port, applies settings to it and closes it again."""
+    open_time, apply_time, unverified = None, None, None
+
+    start = time.perf_counter()
+
+    try:
+        state = opener(port_name)
+    except Exception as e:
+        return PortResult(port_name, open_time, apply_time, unverified, e)
+
+    opened = time.perf_counter()
+    open_time = opened - start
+
+    try:
+        unverified = apply_settings(state.port, settings, state)
+    except Exception as e:
+        return PortResult(port_name, open_time, apply_time, unverified, e)
+    else:
+        apply_time = time.perf_counter() - opened
+        return PortResult(port_name, open_time, apply_time, unverified, None)
+    finally:
+        state.port.close()
+
+
+def configure_ports(port_names, settings, workers=None, opener=open_port):
+    """Applies settings to many ports at once, one port per worker.
+
+    Returns a PortResult for each port, in the order given.
+    """
+    check_settings(settings)
+
+    port_names = list(port_names)
+
+    if not port_names:
+        return []
+
+    workers = workers or len(port_names)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda name: configure_port(name, settings, opener), port_names))
@@ -0,0 +1,284 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import ctypes
+import struct
+import threading
+from array import array
+
+from capture import FrameReader, READ_TIMEOUT
+from traffic import TrafficGenerator
+
+
+# magic, sequence number, send time
+FRAME_HEADER = struct.Struct('<4sQd')
+MAGIC = b'QLBK'
+
+SLOTS = 64  # Preallocated transmit buffers reused in turn
+DRAIN_TIME = 1.0  # Seconds to wait for stragglers after sending stops
+
+
+class LatencyHistogram(object):
+    """Log-linear histogram of latencies in nanoseconds.
+
+    Like an HDR histogram, every power of two range is split into the same
+    number of sub-buckets, so any recorded value is reported to within
+    1 / 2 ** (SUB_BUCKET_BITS - 1) of itself in a fixed amount of memory.
+    """
+    SUB_BUCKET_BITS = 7
+    MAX_BITS = 40  # About 18 minutes
+
+    def __init__(self):
+        self.half = 1 << (self.SUB_BUCKET_BITS - 1)
+        self.counts = array('Q', [0]) * self._index((1 << self.MAX_BITS) - 1)
+        self.counts.append(0)
+
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+
+        if shift <= 0:
+            return value
+
+        return shift * self.half + (value >> shift)
+
+    def _highest_value(self, index):
+        if index < 2 * self.half:
+            return index
+
+        shift = index // self.half - 1
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, value):
+        value = min(max(int(value), 0), (1 << self.MAX_BITS) - 1)
+
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Returns the value percent of the recorded values are at or
+        below."""
+        if not self.count:
+            return None
+
+        target = max(self.count * percent / 100.0, 1)
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= target:
+                return min(self._highest_value(index), self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def buckets(self):
+        """Returns (highest value, count) for every non-empty bucket."""
+        return [(self._highest_value(index), count)
+                for index, count in enumerate(self.counts) if count]
+
+
+class LoopbackSender(TrafficGenerator):
+    """Sends numbered, timestamped frames from preallocated buffers."""
+
+    def __init__(self, port, size, **kwargs):
+        size = max(size, FRAME_HEADER.size)
+
+        self.buffers = [bytearray(size) for i in range(SLOTS)]
+        self.slots = [(ctypes.c_char * size).from_buffer(buffer)
+                      for buffer in self.buffers]
+
+        super(LoopbackSender, self).__init__(port, self.buffers, **kwargs)
+
+    def next_frame(self, i):
+        slot = self.sent % SLOTS
+        FRAME_HEADER.pack_into(self.buffers[slot], 0, MAGIC, self.sent,
+                               time.perf_counter())
+
+        return self.slots[slot]
+
+
+class LoopbackReceiver(threading.Thread):
+    """Matches frames from a LoopbackSender and records their latency."""
+
+    def __init__(self, port, size, read_interval=None):
+        super(LoopbackReceiver, self).__init__()
+
+        self.daemon = True
+        self.read_interval = read_interval
+        self.reader = FrameReader(port, max(size, FRAME_HEADER.size) + 64)
+        self.histogram = LatencyHistogram()
+        self.error = None
+
+        self.received = 0
+        self.bytes = 0
+        self.foreign = 0  # Frames that didn't come from the sender
+        self.out_of_order = 0
+        self.first_time = None
+        self.last_time = None
+
+        self._stop_event = threading.Event()
+
+    def run(self):
+        read, unpack = self.reader.read, FRAME_HEADER.unpack_from
+        record, clock = self.histogram.record, time.perf_counter
+        interval = self.read_interval
+        timeout = 1 if interval else READ_TIMEOUT
+        expected = 0
+        poll_time = clock()
+
+        try:
+            while not self._stop_event.is_set():
+                frame = read(timeout)
+
+                if frame is None:
+                    if interval:
+                        self._stop_event.wait(interval)
+                        poll_time = clock()
+
+                    continue
+
+                now = clock()
+                data = frame[0]
+
+                if len(data) < FRAME_HEADER.size:
+                    self.foreign += 1
+                    continue
+
+                magic, sequence, sent = unpack(data)
+
+                if magic != MAGIC:
+                    self.foreign += 1
+                    continue
+
+                if sequence < expected:
+                    self.out_of_order += 1
+
+                expected = max(expected, sequence + 1)
+
+                record((now - sent) * 1000000000)
+
+                self.received += 1
+                self.bytes += len(data)
+
+                if self.first_time is None:
+                    self.first_time = now
+
+                self.last_time = now
+
+                # Polling only reads what was queued when the poll started,
+                # newer frames wait in the driver like they would for a
+                # busy application
+                if interval and sent > poll_time:
+                    self._stop_event.wait(interval)
+                    poll_time = clock()
+        except OSError as e:
+            self.error = e
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_loopback(tx_port, rx_port=None, size=64, frame_rate=None,
+                 bit_rate=None, duration=10.0, count=None, read_interval=None):
+    """Sends frames out tx_port and matches them on rx_port.
+
+    Leave rx_port off when the frames come back on the same port (internal
+    loopback or a loopback plug). With a read_interval the receiver only
+    drains the port that often. Returns the results as a dictionary,
+    latencies are in microseconds.
+    """
+    rx_port = rx_port or tx_port
+    rx_port.purge(False, True)
+
+    receiver = LoopbackReceiver(rx_port, size, read_interval)
+    sender = LoopbackSender(tx_port, size, frame_rate=frame_rate,
+                            bit_rate=bit_rate, duration=duration, count=count)
+
+    receiver.start()
+    sender.start()
+
+    # Bytes sent but not yet received are held by the driver somewhere (or
+    # were lost, so it only measures memory use when nothing is lost)
+    peak_in_flight = 0
+
+    while sender.is_alive():
+        sender.join(0.01)
+        peak_in_flight = max(peak_in_flight, sender.bytes - receiver.bytes)
+
+    # Give frames still on the wire a chance to arrive
+    deadline = time.monotonic() + DRAIN_TIME
+
+    while receiver.received < sender.sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    receiver.stop()
+
+    histogram = receiver.histogram
+    stats = sender.stats()
+    lost = max(sender.sent - receiver.received, 0)
+
+    elapsed = 0.0
+
+    if receiver.first_time is not None:
+        elapsed = receiver.last_time - receiver.first_time
+
+    def microseconds(value):
+        return value / 1000.0 if value is not None else None
+
+    return {
+        'sent': sender.sent,
+        'received': receiver.received,
+        'lost': lost,
+        'loss_ratio': lost / sender.sent if sender.sent else 0.0,
+        'out_of_order': receiver.out_of_order,
+        'foreign': receiver.foreign,
+        'send_frame_rate': stats['frame_rate'],
+        'receive_frame_rate': receiver.received / elapsed if elapsed else 0.0,
+        'receive_bit_rate': receiver.bytes * 8 / elapsed if elapsed else 0.0,
+        'peak_in_flight': peak_in_flight,
+        'latency': {
+            'min': microseconds(histogram.min),
+            'mean': microseconds(histogram.mean()),
+            'p50': microseconds(histogram.percentile(50)),
+            'p99': microseconds(histogram.percentile(99)),
+            'p99.9': microseconds(histogram.percentile(99.9)),
+            'max': microseconds(histogram.max),
+        },
+        'histogram': [(microseconds(value), count)
+                      for value, count in histogram.buckets()],
+        'errors': [str(e) for e in (sender.error, receiver.error) if e],
+    }
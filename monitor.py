@@ -0,0 +1,132 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import threading
+from array import array
+
+from portstate import read_registers
+
+
+HISTORY_SIZE = 4096  # Samples kept per register
+POLL_RATE = 10.0  # Samples per second
+
+
+class RegisterHistory(object):
+    """Fixed size ring buffer of register samples.
+
+    Samples are stored in flat arrays so the memory used never grows, the
+    oldest sample is overwritten once the buffer is full.
+    """
+
+    def __init__(self, register_names, size=HISTORY_SIZE):
+        self.register_names = list(register_names)
+        self.size = size
+        self.count = 0  # Samples appended since the history was created
+
+        self._times = array('d', [0.0]) * size
+        self._values = array('I', [0]) * (size * len(self.register_names))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, timestamp, registers):
+        """Adds a sample, registers is a dictionary of register values."""
+        width = len(self.register_names)
+
+        with self._lock:
+            index = self.count % self.size
+            self._times[index] = timestamp
+
+            for i, name in enumerate(self.register_names):
+                self._values[index * width + i] = registers[name] & 0xffffffff
+
+            self.count += 1
+
+    def latest(self):
+        """Returns (count, timestamp, values) for the newest sample."""
+        width = len(self.register_names)
+
+        with self._lock:
+            if not self.count:
+                return None
+
+            index = (self.count - 1) % self.size
+            values = self._values[index * width:(index + 1) * width]
+
+            return (self.count, self._times[index],
+                    dict(zip(self.register_names, values)))
+
+    def samples(self, register_name):
+        """Returns the (timestamp, value) samples of a register, oldest
+        first."""
+        width = len(self.register_names)
+        column = self.register_names.index(register_name)
+
+        with self._lock:
+            length = min(self.count, self.size)
+            first = self.count - length
+
+            return [(self._times[i % self.size],
+                     self._values[(i % self.size) * width + column])
+                    for i in range(first, self.count)]
+
+
+class RegisterPoller(threading.Thread):
+    """Reads registers from a port into a RegisterHistory at a fixed rate."""
+
+    def __init__(self, port, history, rate=POLL_RATE):
+        super(RegisterPoller, self).__init__()
+
+        self.daemon = True
+        self.port = port
+        self.history = history
+        self.rate = rate
+        self.error = None
+
+        self._stop_event = threading.Event()
+
+    def run(self):
+        next_poll = time.monotonic()
+
+        while not self._stop_event.is_set():
+            try:
+                registers = read_registers(self.port,
+                                           self.history.register_names)
+            except OSError as e:
+                self.error = e
+                return
+
+            self.history.append(time.time(), registers)
+
+            # Rate can be changed while polling
+            next_poll += 1.0 / self.rate
+            delay = next_poll - time.monotonic()
+
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                # Fell behind, don't try to catch up with a burst of reads
+                next_poll = time.monotonic()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
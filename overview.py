@@ -0,0 +1,457 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+from collections import OrderedDict
+
+from PySide.QtCore import Signal, Qt, QThreadPool, QTimer
+from PySide.QtGui import *
+
+from widgets import FWorker, FRegisterModel
+from dialogs import *
+from engine import *
+import bundle
+
+
+REFRESH_INTERVAL = 1000  # Milliseconds between reads of each port
+DISPLAY_INTERVAL = 200  # Milliseconds between table updates
+HIGHLIGHT_TIME = 2.0  # Seconds a changed value stays highlighted
+
+# Rows above the registers, along with the ThroughputHistory metric of the
+# rate rows
+SUMMARY_ROWS = ['Firmware', 'Clock', 'Memory Cap In', 'Memory Cap Out',
+                'RX Frames/s', 'RX Bytes/s', 'Drops/s']
+RATE_ROWS = {'RX Frames/s': 'rx_frames', 'RX Bytes/s': 'rx_bytes',
+             'Drops/s': 'drops'}
+
+
+def summary_values(state):
+    """Returns the overview rows of a port other than its rates."""
+    values = OrderedDict()
+
+    major, minor = state.firmware
+    values['Firmware'] = (major << 8) | minor
+    values['Clock'] = state.clock_frequency or 0
+
+    if hasattr(state, 'memory_cap'):
+        values['Memory Cap In'] = state.memory_cap['input']
+        values['Memory Cap Out'] = state.memory_cap['output']
+
+    values.update(state.registers)
+
+    return values
+
+
+def refresh_port(pool, port_name):
+    """Re-reads a port for the overview.
+
+    Returns (port_name, values, error) instead of raising, so one
+    failing port is just reported along with the others.
+    """
+    try:
+        state = pool.acquire(port_name)
+    except Exception as e:
+        return (port_name, None, e)
+
+    try:
+        # Not while another worker is writing to the port
+        with port_lock(state.port):
+            pool.revalidate(state)
+            return (port_name, summary_values(state), None)
+    except Exception as e:
+        return (port_name, None, e)
+    finally:
+        pool.release(port_name, state)
+
+
+def purge_port(port_name, state):
+    state.port.purge()
+
+
+def apply_port(port_name, state, settings):
+    unverified = apply_settings(state.port, settings, state)
+
+    if unverified:
+        raise SettingsNotVerifiedError(unverified)
+
+
+def export_port(port_name, state, directory):
+    filename = os.path.join(directory, '{}.fscc'.format(
+        os.path.basename(str(port_name))))
+
+    with open(filename, 'w') as outfile:
+        outfile.write(state.to_json(sort_keys=True, indent=4))
+
+
+def run_on_port(pool, port_name, action, *args):
+    """Runs action(port_name, state, *args) on a pooled port and returns
+    (port_name, error)."""
+    try:
+        state = pool.acquire(port_name)
+    except Exception as e:
+        return (port_name, e)
+
+    try:
+        with port_lock(state.port):
+            action(port_name, state, *args)
+    except Exception as e:
+        return (port_name, e)
+    else:
+        return (port_name, None)
+    finally:
+        pool.release(port_name, state)
+
+
+class FOverviewModel(FRegisterModel):
+    """FRegisterModel with the summary rows shown in decimal."""
+    FORMATS = {
+        'Firmware': lambda v: '{:x}.{:02x}'.format(v >> 8, v & 0xff),
+        'Clock': lambda v: '{:,} Hz'.format(v) if v else '',
+        'Memory Cap In': '{:,}'.format,
+        'Memory Cap Out': '{:,}'.format,
+        'RX Frames/s': '{:,}'.format,
+        'RX Bytes/s': '{:,}'.format,
+        'Drops/s': '{:,}'.format}
+
+    def data(self, index, role=Qt.DisplayRole):
+        format = self.FORMATS.get(self.register_names[index.row()])
+
+        if format and role == Qt.DisplayRole:
+            return format(self.values[self._offset(index.row(),
+                                                   index.column())])
+
+        return super(FOverviewModel, self).data(index, role)
+
+    def set_column_name(self, column, name):
+        if self.column_names[column] != name:
+            self.column_names[column] = name
+            self.headerDataChanged.emit(Qt.Horizontal, column, column)
+
+
+class FOverview(QDialog):
+    """Every port side by side, refreshed concurrently.
+
+    Each port is read on its own worker and a port still busy with its
+    last refresh is skipped rather than queued, so a slow port only holds
+    up its own column. Results are gathered and shown together every
+    DISPLAY_INTERVAL.
+    """
+    settings_applied = Signal()
+
+    def __init__(self, pool, port_names, histories=None, parent=None):
+        super(FOverview, self).__init__(parent)
+
+        self.pool = pool
+        self.port_names = list(port_names)
+        self.histories = histories if histories is not None else {}
+
+        register_names = [r for r in READABLE_REGISTER_NAMES if r != 'VSTR']
+
+        self.model = FOverviewModel(SUMMARY_ROWS + register_names,
+                                    column_names=self.port_names)
+
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectColumns)
+        self.table.resizeColumnsToContents()
+
+        self.purge_button = QPushButton('Purge')
+        self.apply_button = QPushButton('Apply Profile')
+        self.export_button = QPushButton('Export')
+        self.backup_button = QPushButton('Back Up')
+        self.restore_button = QPushButton('Restore')
+
+        self.purge_button.clicked.connect(self.purge_clicked)
+        self.apply_button.clicked.connect(self.apply_clicked)
+        self.export_button.clicked.connect(self.export_clicked)
+        self.backup_button.clicked.connect(self.backup_clicked)
+        self.restore_button.clicked.connect(self.restore_clicked)
+
+        self.status_label = QLabel('Actions apply to the selected ports, or '
+                                   'all of them')
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.purge_button)
+        buttons.addWidget(self.apply_button)
+        buttons.addWidget(self.export_button)
+        buttons.addWidget(self.backup_button)
+        buttons.addWidget(self.restore_button)
+        buttons.addWidget(self.status_label)
+        buttons.addStretch()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.setWindowTitle('All Ports')
+        self.resize(900, 600)
+
+        workers = max(len(self.port_names), 1)
+
+        self.refresh_pool = QThreadPool(self)
+        self.refresh_pool.setMaxThreadCount(workers)
+        self.action_pool = QThreadPool(self)
+        self.action_pool.setMaxThreadCount(workers)
+
+        self.workers = set()
+        self.refreshing = set()
+        self.results = {}
+        self.filled = set()
+
+        self.action = None
+        self.action_remaining = set()
+        self.action_failures = {}
+
+        self.pool_size = None
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh_ports)
+
+        self.display_timer = QTimer(self)
+        self.display_timer.setInterval(DISPLAY_INTERVAL)
+        self.display_timer.timeout.connect(self.display_results)
+
+        self.finished.connect(self.stop)
+
+    def start_worker(self, thread_pool, function, finished, *args,
+                     failed=None):
+        worker = FWorker(function, *args)
+        worker.signals.finished.connect(finished)
+
+        if failed:
+            worker.signals.failed.connect(failed)
+
+        # Hold a reference until the worker is done with its signals
+        self.workers.add(worker)
+        worker.signals.finished.connect(lambda _: self.workers.discard(worker))
+        worker.signals.failed.connect(lambda _: self.workers.discard(worker))
+
+        thread_pool.start(worker)
+
+    def refresh_ports(self):
+        for port_name in self.port_names:
+            if port_name in self.refreshing:
+                continue
+
+            self.refreshing.add(port_name)
+            self.start_worker(self.refresh_pool, refresh_port,
+                              self.port_refreshed, self.pool, port_name)
+
+    def port_refreshed(self, result):
+        self.refreshing.discard(result[0])
+
+        # Only the newest result of each port is displayed
+        self.results[result[0]] = result
+
+    def display_results(self):
+        results, self.results = self.results, {}
+
+        for port_name, values, error in results.values():
+            column = self.port_names.index(port_name)
+
+            if error:
+                self.model.set_column_name(column, '{} ({})'.format(
+                    port_name, type(error).__name__))
+                continue
+
+            self.model.set_column_name(column, port_name)
+
+            # The first values aren't changes worth pointing out
+            self.model.set_values(column, values,
+                                  highlight=port_name in self.filled)
+            self.filled.add(port_name)
+
+        for column, port_name in enumerate(self.port_names):
+            history = self.histories.get(port_name)
+
+            if history:
+                rates = history.rates()
+                self.model.set_values(column, dict(
+                    (row, int(rates[metric] or 0))
+                    for row, metric in RATE_ROWS.items()))
+
+        self.model.fade_highlights(HIGHLIGHT_TIME)
+
+    def selected_ports(self):
+        columns = set(index.column() for index in
+                      self.table.selectionModel().selectedIndexes())
+
+        if not columns:
+            return list(self.port_names)
+
+        return [self.port_names[column] for column in sorted(columns)]
+
+    def run_action(self, action, function, *args):
+        """Runs function(port_name, state, *args) on every selected port at
+        once."""
+        port_names = self.selected_ports()
+
+        self.action = action
+        self.action_remaining = set(port_names)
+        self.action_failures = {}
+
+        self.set_actions_enabled(False)
+        self.status_label.setText('{} on {} ports...'.format(
+            action, len(port_names)))
+
+        for port_name in port_names:
+            self.start_worker(self.action_pool, run_on_port,
+                              self.action_finished, self.pool, port_name,
+                              function, *args)
+
+    def action_finished(self, result):
+        port_name, error = result
+
+        self.action_remaining.discard(port_name)
+
+        if error:
+            self.action_failures[port_name] = error
+
+        if self.action_remaining:
+            return
+
+        self.set_actions_enabled(True)
+        self.status_label.setText('{} done'.format(self.action))
+
+        if self.action == 'Apply':
+            self.settings_applied.emit()
+
+        if self.action_failures:
+            FBulkActionFailed(self.action, self.action_failures).exec_()
+
+    def run_bundle(self, action, function, *args):
+        """Runs a bundle export or restore, which works through the ports
+        concurrently itself."""
+        self.action = action
+
+        self.set_actions_enabled(False)
+        self.status_label.setText('{}...'.format(action))
+
+        self.start_worker(self.action_pool, function, self.bundle_finished,
+                          *args, failed=self.bundle_failed)
+
+    def bundle_finished(self, results):
+        failures = dict((result.port_name, result.error)
+                        for result in results if result.error)
+
+        for result in results:
+            if getattr(result, 'unverified', None):
+                failures[result.port_name] = SettingsNotVerifiedError(
+                    result.unverified)
+
+        self.set_actions_enabled(True)
+
+        if self.action == 'Restore':
+            applied = [result for result in results
+                       if getattr(result, 'applied', False)]
+            self.status_label.setText('{} of {} ports differed and were '
+                                      'restored'.format(len(applied),
+                                                        len(results)))
+
+            if applied:
+                self.settings_applied.emit()
+        else:
+            self.status_label.setText('{} of {} ports backed up'.format(
+                len(results) - len(failures), len(results)))
+
+        if failures:
+            FBulkActionFailed(self.action, failures).exec_()
+
+    def bundle_failed(self, error):
+        self.set_actions_enabled(True)
+        self.status_label.setText('{} failed'.format(self.action))
+
+        if self.action == 'Restore':
+            FInvalidBundle().exec_()
+        else:
+            FBackupFailed().exec_()
+
+    def set_actions_enabled(self, enabled):
+        for button in [self.purge_button, self.apply_button,
+                       self.export_button, self.backup_button,
+                       self.restore_button]:
+            button.setEnabled(enabled)
+
+    def purge_clicked(self):
+        self.run_action('Purge', purge_port)
+
+    def apply_clicked(self):
+        filename, filter = QFileDialog.getOpenFileName(
+            self, 'Open Settings', None, 'Settings Files (*.fscc)')
+
+        if not filename:
+            return
+
+        try:
+            settings = load_settings(filename)
+            check_settings(settings)
+        except (OSError, ValueError):
+            FInvalidSettingsFile().exec_()
+            return
+
+        self.run_action('Apply', apply_port, settings)
+
+    def export_clicked(self):
+        directory = QFileDialog.getExistingDirectory(self, 'Export Settings')
+
+        if directory:
+            self.run_action('Export', export_port, directory)
+
+    def backup_clicked(self):
+        filename, filter = QFileDialog.getSaveFileName(
+            self, 'Back Up Settings', None, 'Settings Bundles (*.zip)')
+
+        if filename:
+            self.run_bundle('Back Up', bundle.export_bundle, filename,
+                            self.port_names, None, open_port, self.pool)
+
+    def restore_clicked(self):
+        filename, filter = QFileDialog.getOpenFileName(
+            self, 'Restore Settings', None, 'Settings Bundles (*.zip)')
+
+        if filename:
+            self.run_bundle('Restore', bundle.restore_bundle, filename,
+                            self.port_names, None, False, open_port,
+                            self.pool)
+
+    def start(self):
+        if self.pool_size is None:
+            # Keeps every port open between refreshes
+            self.pool_size = self.pool.size
+            self.pool.size = max(self.pool.size, len(self.port_names))
+
+        self.refresh_timer.start()
+        self.display_timer.start()
+        self.refresh_ports()
+
+    def stop(self):
+        self.refresh_timer.stop()
+        self.display_timer.stop()
+
+        if self.pool_size is not None:
+            self.pool.size = self.pool_size
+            self.pool_size = None
+
+    def wait(self):
+        """Blocks until no refresh or action is using a port."""
+        self.refresh_pool.waitForDone()
+        self.action_pool.waitForDone()
@@ -0,0 +1,192 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from portstate import *
+
+
+POOL_SIZE = 4
+IDLE_TIMEOUT = 300  # Seconds an unused port is kept open
+REVALIDATE_AFTER = 2  # Seconds before a cached state is checked again
+
+
+class _PoolEntry(object):
+
+    def __init__(self, state):
+        self.state = state
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class PortPool(object):
+    """Keeps recently used ports open along with their PortState.
+
+    Ports are handed out with acquire and given back with release. Ports
+    that aren't in use are closed once there are more than size of them or
+    they have been idle for idle_timeout seconds. A handle that goes bad is
+    replaced for new users but only closed once its last user releases it.
+    """
+
+    def __init__(self, size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 revalidate_after=REVALIDATE_AFTER, opener=open_port):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.revalidate_after = revalidate_after
+        self.opener = opener
+
+        self._entries = OrderedDict()
+        self._retired = []  # Replaced entries that are still in use
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, port_name):
+        return port_name in self._entries
+
+    def acquire(self, port_name):
+        """Returns the PortState for a port, opening the port if needed."""
+        with self._lock:
+            entry = self._entries.pop(port_name, None)
+
+            if entry:
+                entry.users += 1
+                self._entries[port_name] = entry
+
+        if entry:
+            if time.monotonic() - entry.last_used >= self.revalidate_after:
+                try:
+                    # Not while another thread is writing to the port
+                    with port_lock(entry.state.port):
+                        self.revalidate(entry.state)
+                except OSError:
+                    # The cached handle went bad, start over with a new one
+                    self._discard(port_name, entry)
+                    return self.acquire(port_name)
+        else:
+            opened = _PoolEntry(self.opener(port_name))
+            opened.users = 1
+
+            with self._lock:
+                entry = self._entries.get(port_name)
+
+                if entry:
+                    entry.users += 1
+                else:
+                    entry = self._entries[port_name] = opened
+
+            # Another thread opened the same port at the same time and its
+            # handle may already be in use, so this one goes
+            if entry is not opened:
+                opened.state.port.close()
+
+        entry.last_used = time.monotonic()
+        self.sweep()
+
+        return entry.state
+
+    def release(self, port_name, state=None):
+        """Gives a port back to the pool, closing ports that aren't needed.
+
+        Pass the state acquire returned, in case its handle was replaced in
+        the meantime.
+        """
+        retired = None
+
+        with self._lock:
+            entry = self._entries.get(port_name)
+
+            if state is not None and (not entry or entry.state is not state):
+                entry = next((other for other in self._retired
+                              if other.state is state), None)
+
+            if entry:
+                entry.users = max(entry.users - 1, 0)
+                entry.last_used = time.monotonic()
+
+                if entry in self._retired and not entry.users:
+                    self._retired.remove(entry)
+                    retired = entry
+
+        if retired:
+            self._close(retired)
+
+        self.sweep()
+
+    def sweep(self):
+        """Closes idle ports and ports beyond the pool size."""
+        now = time.monotonic()
+        evicted = []
+
+        with self._lock:
+            unused = [(name, entry) for name, entry in self._entries.items()
+                      if not entry.users]
+
+            # Least recently used come first
+            for name, entry in unused:
+                if (len(self._entries) > self.size or
+                        now - entry.last_used >= self.idle_timeout):
+                    evicted.append(self._entries.pop(name))
+
+        for entry in evicted:
+            entry.state.port.close()
+
+    def close_all(self):
+        """Closes every port, including ones still in use."""
+        with self._lock:
+            entries = list(self._entries.values()) + self._retired
+            self._entries.clear()
+            self._retired = []
+
+        for entry in entries:
+            entry.state.port.close()
+
+    def revalidate(self, state):
+        """Brings an acquired port's state up to date with the card.
+
+        The registers are one bulk read and the memory cap and attributes
+        one driver call each, so everything is re-read rather than guessing
+        from the registers whether anything else changed.
+        """
+        state.refresh()
+
+    def _discard(self, port_name, entry):
+        """Gives up this user's share of a bad handle and unlinks it, it is
+        closed now or once its other users release it."""
+        with self._lock:
+            if self._entries.get(port_name) is entry:
+                del self._entries[port_name]
+
+            entry.users = max(entry.users - 1, 0)
+
+            if entry.users:
+                self._retired.append(entry)
+                return
+
+        self._close(entry)
+
+    def _close(self, entry):
+        try:
+            entry.state.port.close()
+        except OSError:
+            pass
@@ -0,0 +1,250 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import re
+import json
+import weakref
+import threading
+from collections import OrderedDict
+
+import fscc
+
+
+# Range the clock generator on the card can be programmed to, in Hz
+CLOCK_FREQUENCY_RANGE = (15000, 270000000)
+
+# Registers the driver will report a value for
+READABLE_REGISTER_NAMES = [
+    r for r in fscc.Port.Registers.register_names
+    if r not in fscc.Port.Registers.writeonly_register_names]
+
+# Port settings that are plain attributes on fscc.Port
+ATTRIBUTE_NAMES = ['append_status', 'append_timestamp', 'ignore_timeout',
+                   'rx_multiple', 'tx_modifiers']
+
+
+# Registers that can be both read and written, in the order the driver
+# stores them
+REGISTER_NAMES = [r for r in fscc.Port.Registers.register_names
+                  if r not in fscc.Port.Registers.readonly_register_names and
+                  r not in fscc.Port.Registers.writeonly_register_names]
+
+# Interrupt bits shared by the ISR and IMR registers
+RFT = 0x00000002  # Receive FIFO trigger
+RFE = 0x00000004  # Receive frame end
+RFO = 0x00000008  # Receive frame overflow
+RDO = 0x00000010  # Receive data overflow
+RFL = 0x00000020  # Receive frame lost
+TFT = 0x00010000  # Transmit FIFO trigger
+ALLS = 0x00020000  # All sent
+
+FIFO_SIZE = 8192  # Bytes in each of the receive and transmit FIFOs
+
+# Trigger levels in the FIFOT register, receive in the low bits and
+# transmit in the high bits
+FIFOT_RX_MASK = 0x00001fff
+FIFOT_TX_SHIFT = 16
+
+
+def fifo_triggers(fifot):
+    """Returns the (receive, transmit) trigger levels of a FIFOT value."""
+    return (fifot & FIFOT_RX_MASK,
+            (fifot >> FIFOT_TX_SHIFT) & FIFOT_RX_MASK)
+
+
+def fifot_value(rx_trigger, tx_trigger, fifot=0):
+    """Returns fifot with its trigger levels replaced."""
+    mask = FIFOT_RX_MASK | (FIFOT_RX_MASK << FIFOT_TX_SHIFT)
+
+    return ((fifot & ~mask & 0xffffffff) | (rx_trigger & FIFOT_RX_MASK) |
+            ((tx_trigger & FIFOT_RX_MASK) << FIFOT_TX_SHIFT))
+
+
+_port_names = None
+_port_names_lock = threading.Lock()
+
+
+def port_names(refresh=False):
+    """Returns the FSCC port names, only enumerating them the first time."""
+    global _port_names
+
+    # Only needed here, which usually runs in the background
+    from fscc.tools import list_ports
+
+    with _port_names_lock:
+        if _port_names is None or refresh:
+            _port_names = [x[1] for x in sorted(list_ports.fsccports())]
+
+        return list(_port_names)
+
+
+def port_number(port_name):
+    """Returns the port number at the end of a port name like /dev/fscc0,
+    raising ValueError for a name without one."""
+    match = re.search(r'(\d+)$', str(port_name))
+
+    if not match:
+        raise ValueError('Invalid port name: {}'.format(port_name))
+
+    return int(match.group(0))
+
+
+def open_port(port_name):
+    """Opens a port and reads its settings, returning the PortState."""
+    port = fscc.Port(port_number(port_name), None, None)
+
+    try:
+        return PortState(port)
+    except:
+        port.close()
+        raise
+
+
+_port_locks = weakref.WeakKeyDictionary()
+_port_locks_lock = threading.Lock()
+
+
+def port_lock(port):
+    """Returns the lock that serializes register access on a port.
+
+    fscc.Port.Registers stages values on itself before each driver call, so
+    threads sharing a port have to take turns.
+    """
+    with _port_locks_lock:
+        try:
+            return _port_locks[port]
+        except KeyError:
+            lock = _port_locks[port] = threading.RLock()
+            return lock
+
+
+def read_registers(port, register_names):
+    """Reads several registers from the port in a single driver call."""
+    registers = port.registers
+
+    with port_lock(port):
+        registers._clear_registers()
+
+        for name in register_names:
+            setattr(registers, '_%s' % name, fscc.FSCC_UPDATE_VALUE)
+
+        registers._get_registers()
+
+        return OrderedDict((name, getattr(registers, '_%s' % name))
+                           for name in register_names)
+
+
+def write_registers(port, values):
+    """Writes several registers to the port in a single driver call.
+
+    Registers not in values are left untouched by the driver.
+    """
+    registers = port.registers
+
+    with port_lock(port):
+        registers._clear_registers()
+
+        for name, value in values.items():
+            setattr(registers, '_%s' % name, int(value))
+
+        registers._set_registers()
+
+
+def changed_registers(old, new):
+    """Returns the registers in new whose value differs from old."""
+    return OrderedDict((name, value) for name, value in new.items()
+                       if old.get(name) != value)
+
+
+class PortState(object):
+    """Settings of an open FSCC port, read from the card in one pass.
+
+    Settings the port doesn't support are left unset so reading them raises
+    AttributeError, the same as reading them from the port would.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.registers = OrderedDict()
+
+        # The driver can't read the clock back, so this is the last value
+        # written through this state (None until then)
+        self.clock_frequency = None
+
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads every setting from the card."""
+        self.registers = read_registers(self.port, READABLE_REGISTER_NAMES)
+
+        try:
+            memory_cap = self.port.memory_cap._get_memcap()
+        except AttributeError:
+            self.__dict__.pop('memory_cap', None)
+        else:
+            self.memory_cap = {'input': memory_cap[0],
+                               'output': memory_cap[1]}
+
+        for name in ATTRIBUTE_NAMES:
+            try:
+                setattr(self, name, getattr(self.port, name))
+            except AttributeError:
+                self.__dict__.pop(name, None)
+
+    def set_clock_frequency(self, frequency):
+        """Programs the clock generator unless it was already set to
+        frequency, returning whether it was written.
+
+        Each write is slow and disrupts the line.
+        """
+        frequency = int(frequency)
+
+        if frequency == self.clock_frequency:
+            return False
+
+        self.port.clock_frequency = frequency
+        self.clock_frequency = frequency
+
+        return True
+
+    @property
+    def firmware(self):
+        """Returns the (PREV, FREV) firmware revision from VSTR."""
+        vstr = self.registers['VSTR']
+        return ((vstr & 0x0000ff00) >> 8, vstr & 0x000000ff)
+
+    def _to_json(self):
+        """Returns the settings in the same layout as Port.to_json."""
+        ol = {}
+
+        for name in ATTRIBUTE_NAMES:
+            if hasattr(self, name):
+                ol[name] = getattr(self, name)
+
+        ol['registers'] = dict((name, hex(value))
+                               for name, value in self.registers.items())
+
+        if hasattr(self, 'memory_cap'):
+            ol['memory_cap'] = dict(self.memory_cap)
+
+        return ol
+
+    def to_json(self, *args, **kwargs):
+        return json.dumps(self._to_json(), *args, **kwargs)
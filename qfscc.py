@@ -18,24 +18,57 @@
 
 """
 
+import time
+
+# Taken before anything else is imported so imports count toward startup
+started = time.perf_counter()
+
 import sys
+import argparse
+
+if (__name__ == '__main__' and len(sys.argv) > 1 and
+        not sys.argv[1].startswith('-')):
+    # Command line tools like 'qfscc apply' run without Qt
+    import cli
+    sys.exit(cli.main(sys.argv[1:]))
+
+from startup import StartupProfile
+
+profile = StartupProfile(started)
 
 from PySide.QtCore import Signal
 from PySide.QtGui import *
 
+profile.mark('import Qt')
+
+from portstate import port_names
+
+profile.mark('import fscc')
+
 from widgets import *
 from dialogs import *
+from pool import PortPool, POOL_SIZE, IDLE_TIMEOUT
 
-from fscc.tools import list_ports
+profile.mark('import widgets')
 
 
 class PortForm(QDialog):
     apply_changes = Signal()
+    painted = Signal()
 
-    def __init__(self):
+    def __init__(self, pool=None, enumerate_ports=port_names):
         super(PortForm, self).__init__()
 
-        self.port_name = FPortName(self.apply_changes)
+        self.port_name = FPortName(self.apply_changes, pool, enumerate_ports)
+        self.overview = None
+
+        # Only once the ports are known, the dialog shows before that
+        self.overview_button = QPushButton('All Ports')
+        self.overview_button.setToolTip('Show and act on every port at once')
+        self.overview_button.setEnabled(False)
+        self.overview_button.clicked.connect(self.overview_clicked)
+        self.port_name.addWidget(self.overview_button)
+        self.port_name.ports_listed.connect(self.ports_listed)
 
         firmware = FFirmware()
         clock_frequency = FClockFrequency()
@@ -48,19 +81,33 @@ class PortForm(QDialog):
         commands = FCommands()
         memory_cap = FMemoryCap()
         file_options = FFileOptions()
+        self.capture = capture = FCapture()
+        self.port_name.port_selected.connect(capture.set_port_name)
         buttons = FDialogButtonBox()
 
         for obj in [firmware, clock_frequency, registers, append_status,
                     append_timestamp, rx_multiple, ignore_timeout,
-                    tx_modifiers, commands, memory_cap, file_options, buttons]:
+                    tx_modifiers, commands, memory_cap, file_options,
+                    capture, buttons]:
+            obj.attach_port_loading(self.port_name.port_loading)
             obj.attach_port_changed(self.port_name.port_changed)
+            obj.attach_state_changed(self.port_name.state_changed)
             obj.attach_apply_changes(self.port_name.apply_changes)
             obj.attach_import_settings(file_options.import_selected)
 
+        clock_frequency.bgr_solved.connect(
+            lambda bgr: registers.set_register('BGR', bgr))
+
         buttons.apply.connect(self.apply_clicked)
         buttons.accepted.connect(self.ok_clicked)
         buttons.rejected.connect(self.close_clicked)
 
+        # Release every open port however the dialog is closed
+        self.finished.connect(registers.stop_monitor)
+        self.finished.connect(capture.stop_capture)
+        self.finished.connect(self.close_overview)
+        self.finished.connect(self.port_name.close_ports)
+
         settings = QVBoxLayout()
         settings.addWidget(self.port_name)
         settings.addWidget(firmware)
@@ -73,6 +120,7 @@ class PortForm(QDialog):
         settings.addWidget(commands)
         settings.addWidget(memory_cap)
         settings.addWidget(file_options)
+        settings.addWidget(capture)
 
         layout_top = QHBoxLayout()
         layout_top.addLayout(settings, 1)
@@ -90,6 +138,44 @@ class PortForm(QDialog):
         self.setFixedSize(self.sizeHint())
         self.setWindowTitle('Fastcom FSCC Settings')
 
+        self.was_painted = False
+
+    def paintEvent(self, event):
+        super(PortForm, self).paintEvent(event)
+
+        if not self.was_painted:
+            self.was_painted = True
+            self.painted.emit()
+
+    def ports_listed(self, names):
+        self.overview_button.setEnabled(bool(names))
+
+    def overview_clicked(self):
+        if self.overview is None:
+            # Only loaded once it is asked for
+            from overview import FOverview
+
+            self.overview = FOverview(self.port_name.pool,
+                                      self.port_name.names,
+                                      self.capture.histories, self)
+            self.overview.settings_applied.connect(self.settings_applied)
+
+        self.overview.start()
+        self.overview.show()
+        self.overview.raise_()
+
+    def settings_applied(self):
+        # The selected port may have been one of them
+        if self.port_name.state is not None:
+            self.port_name.state_changed.emit(self.port_name.state)
+
+    def close_overview(self):
+        # Before the pool closes the ports its workers may still be using
+        if self.overview is not None:
+            self.overview.close()
+            self.overview.stop()
+            self.overview.wait()
+
     def apply_clicked(self):
         self.apply_changes.emit()
 
@@ -101,18 +187,61 @@ class PortForm(QDialog):
         self.close()
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(prog='qfscc')
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE,
+                        help='ports to keep open when switching between them '
+                             '(default: {})'.format(POOL_SIZE))
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='seconds an unused port is kept open '
+                             '(default: {})'.format(IDLE_TIMEOUT))
+    parser.add_argument('--simulate', type=int, metavar='PORTS',
+                        help='use simulated ports instead of the driver')
+    parser.add_argument('--profile-startup', nargs='?', const='-',
+                        metavar='FILE',
+                        help='print how long each phase of startup took, or '
+                             'save it to FILE as JSON')
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+
+    profile.mark('create application')
+
+    if args.simulate:
+        import simulator
+
+        pool = PortPool(args.pool_size, args.idle_timeout,
+                        opener=simulator.open_simulated_port)
+        enumerate_ports = lambda: simulator.simulated_port_names(args.simulate)
+    else:
+        pool = PortPool(args.pool_size, args.idle_timeout)
+        enumerate_ports = port_names
 
-    form = PortForm()
-    form.show()
+    enumerate_ports = profile.timed('enumerate ports', enumerate_ports)
 
-    ports = sorted(list_ports.fsccports())
+    # Ports are found and opened in the background once this is showing
+    form = PortForm(pool, enumerate_ports)
 
-    if ports:
-        form.port_name.set_port(ports[0][1])
-    else:
-        form.port_name.set_port(None)
-        FNoPortsFound().exec_()
+    profile.mark('build widgets')
+
+    def painted():
+        profile.mark('first paint')
+        report()
+
+    def port_shown(state):
+        # Ready once the first port's settings fill in the widgets
+        if 'first port' not in profile:
+            profile.record('first port', profile.start, time.perf_counter())
+            report()
+
+    def report():
+        if ('first paint' in profile and 'first port' in profile and
+                args.profile_startup):
+            profile.save(args.profile_startup)
+            args.profile_startup = None
+
+    form.painted.connect(painted)
+    form.port_name.port_changed.connect(port_shown)
+    form.show()
 
     # Run the main Qt loop
     sys.exit(app.exec_())
@@ -0,0 +1,192 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from portstate import *
+
+
+# STAR is the status register and VSTR the firmware version, neither is a
+# setting a profile controls
+IGNORED_REGISTERS = ['STAR', 'VSTR']
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.qfscc',
+                          'scan-cache.json')
+
+ScanResult = namedtuple('ScanResult', ['port_name', 'fingerprint',
+                                       'differences', 'changed', 'error'])
+
+
+def normalize_settings(settings, ignored_registers=IGNORED_REGISTERS):
+    """Returns settings in the Port.to_json layout as flat field names and
+    plain values, so equal settings always compare and hash the same."""
+    fields = OrderedDict()
+
+    for name in ATTRIBUTE_NAMES:
+        if name in settings:
+            fields[name] = int(settings[name])
+
+    for name, value in sorted(settings.get('memory_cap', {}).items()):
+        fields['memory_cap.{}'.format(name)] = int(value)
+
+    for name, value in sorted(settings.get('registers', {}).items()):
+        if name not in ignored_registers:
+            fields['registers.{}'.format(name)] = (
+                int(value, 0) if isinstance(value, str) else int(value))
+
+    return fields
+
+
+def fingerprint(fields):
+    """Returns a short hash of normalized settings."""
+    text = json.dumps(fields, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def diff_settings(golden, fields):
+    """Returns {field: (expected, actual)} for the golden fields that
+    differ. Fields the profile leaves out aren't checked."""
+    return OrderedDict((name, (expected, fields.get(name)))
+                       for name, expected in golden.items()
+                       if fields.get(name) != expected)
+
+
+def format_value(name, value):
+    if value is None:
+        return 'missing'
+
+    if name.startswith('registers.'):
+        return '0x{:08x}'.format(value)
+
+    return str(value)
+
+
+class FingerprintCache(object):
+    """Remembers each port's fingerprint between scans to point out ports
+    whose settings changed since the last one."""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if filename:
+            try:
+                with open(filename, 'r') as infile:
+                    self.entries = json.load(infile)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def previous(self, port_name):
+        """Returns the fingerprint from the last scan of a port."""
+        with self._lock:
+            entry = self.entries.get(port_name)
+
+        return entry if isinstance(entry, str) else None
+
+    def store(self, port_name, port_fingerprint):
+        with self._lock:
+            self.entries[port_name] = port_fingerprint
+
+    def save(self):
+        if not self.filename:
+            return
+
+        directory = os.path.dirname(self.filename)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with self._lock:
+            text = json.dumps(self.entries, sort_keys=True)
+
+        with open(self.filename, 'w') as outfile:
+            outfile.write(text)
+
+
+def _read_settings(port_name, opener, pool):
+    if pool is not None:
+        state = pool.acquire(port_name)
+
+        try:
+            # The pooled state may be a few seconds old
+            with port_lock(state.port):
+                state.refresh()
+                return state._to_json()
+        finally:
+            pool.release(port_name, state)
+
+    state = opener(port_name)
+
+    try:
+        return state._to_json()
+    finally:
+        state.port.close()
+
+
+def scan_port(port_name, golden, cache, opener=open_port, pool=None,
+              ignored_registers=IGNORED_REGISTERS):
+    """Reads one port and compares it to the normalized golden settings."""
+    try:
+        settings = _read_settings(port_name, opener, pool)
+    except Exception as e:
+        return ScanResult(port_name, None, None, None, e)
+
+    fields = normalize_settings(settings, ignored_registers)
+    port_fingerprint = fingerprint(fields)
+    previous = cache.previous(port_name)
+
+    cache.store(port_name, port_fingerprint)
+
+    differences = diff_settings(golden, fields)
+    changed = previous is not None and previous != port_fingerprint
+
+    return ScanResult(port_name, port_fingerprint, differences, changed,
+                      None)
+
+
+def scan_ports(port_names, golden_settings, workers=None, opener=open_port,
+               pool=None, cache=None, ignored_registers=IGNORED_REGISTERS):
+    """Reads every port at once and compares each to a golden profile.
+
+    Pass a PortPool to keep the ports open between scans, then a repeat
+    scan skips opening them. Every setting is still read from the card
+    each time. Returns a ScanResult for each port, in the order given.
+    """
+    port_names = list(port_names)
+
+    if not port_names:
+        return []
+
+    golden = normalize_settings(golden_settings, ignored_registers)
+    cache = cache or FingerprintCache()
+
+    workers = workers or len(port_names)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda name: scan_port(name, golden, cache, opener, pool,
+                                   ignored_registers),
+            port_names))
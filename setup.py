@@ -12,7 +12,9 @@ else:
 
 # Dependencies are automatically detected, but it might need
 # fine tuning.
-buildOptions = dict(packages=['fscc'], excludes=[], includes=['re'],
+# tkinter is found through the standard library but never used, leaving it
+# out keeps it from being unpacked and scanned at every launch
+buildOptions = dict(packages=['fscc'], excludes=['tkinter'], includes=['re'],
                     include_files=[cfscc_path, settings_path], include_msvcr=True)
 
 
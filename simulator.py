@@ -0,0 +1,404 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import time
+import ctypes
+import struct
+import threading
+from collections import deque
+
+import fscc
+
+from portstate import *
+
+
+# Register values of a freshly loaded card, the same as defaults.fscc
+DEFAULT_REGISTERS = {
+    'FIFOT': 0x08001000, 'CMDR': 0x0, 'STAR': 0x00010004,
+    'CCR0': 0x0011201c, 'CCR1': 0x18, 'CCR2': 0x0, 'BGR': 0x0, 'SSR': 0x7e,
+    'SMR': 0x0, 'TSR': 0x7e, 'TMR': 0x0, 'RAR': 0x0, 'RAMR': 0x0,
+    'PPR': 0x0, 'TCR': 0x0, 'VSTR': 0x001a0416, 'IMR': 0x0f000000,
+    'DPLLR': 0x4, 'FCR': 0x40000000,
+}
+
+DEFAULT_MEMORY_CAP = 1000000
+
+_cards = {}
+_cards_lock = threading.Lock()
+
+
+class SimulatedCard(object):
+    """Settings and frame queues of a simulated port.
+
+    These outlive the SimulatedPort handles the same way a real card keeps
+    its settings after the port is closed.
+    """
+
+    def __init__(self):
+        self.registers = dict(DEFAULT_REGISTERS)
+        self.memory_cap = [DEFAULT_MEMORY_CAP, DEFAULT_MEMORY_CAP]
+        self.append_status = False
+        self.append_timestamp = False
+        self.ignore_timeout = False
+        self.rx_multiple = False
+        self.tx_modifiers = 0
+        self.clock_frequency = None
+
+        self.rx_frames = deque()
+        self.rx_bytes = 0
+        self.rx_dropped = 0
+
+        # Interrupts not yet reported to track_interrupts, by bit
+        self.interrupts = {}
+        self.trackers = 0
+
+        self.lock = threading.Lock()
+        self.rx_ready = threading.Condition(self.lock)
+        self.interrupt_ready = threading.Condition(self.lock)
+
+    def raise_interrupts(self, frame_size):
+        """Counts the FIFO interrupts a frame would cause at the current
+        FIFOT trigger levels. The card lock must be held."""
+        if not self.trackers:
+            return
+
+        rx_trigger, tx_trigger = fifo_triggers(self.registers['FIFOT'])
+
+        # The receive trigger fires every rx_trigger bytes and the transmit
+        # trigger every time the FIFO drains to tx_trigger and is refilled
+        counts = {
+            RFT: frame_size // max(rx_trigger, 1),
+            RFE: 1,
+            TFT: frame_size // max(FIFO_SIZE - tx_trigger, 1),
+            ALLS: 1,
+        }
+
+        for bit, count in counts.items():
+            self.interrupts[bit] = self.interrupts.get(bit, 0) + count
+
+        self.interrupt_ready.notify_all()
+
+
+def simulated_card(port_num):
+    with _cards_lock:
+        if port_num not in _cards:
+            _cards[port_num] = SimulatedCard()
+
+        return _cards[port_num]
+
+
+def reset_cards():
+    """Forgets the settings of every simulated card."""
+    with _cards_lock:
+        _cards.clear()
+
+
+def simulated_port_names(count):
+    return ['SIM{}'.format(i) for i in range(count)]
+
+
+class SimulatedPort(object):
+    """In-memory stand-in for fscc.Port.
+
+    Every driver call sleeps for latency seconds so timings resemble a real
+    card. Written frames are looped back to the receive side.
+    """
+
+    class Registers(object):
+        register_names = fscc.Port.Registers.register_names
+        readonly_register_names = fscc.Port.Registers.readonly_register_names
+        writeonly_register_names = \
+            fscc.Port.Registers.writeonly_register_names
+        editable_register_names = fscc.Port.Registers.editable_register_names
+
+        def __init__(self, port):
+            self.port = port
+            self._clear_registers()
+
+        def _clear_registers(self):
+            for register in self.register_names:
+                setattr(self, '_%s' % register, -1)
+
+        def _get_registers(self):
+            card = self.port._driver_call()
+
+            for register in self.register_names:
+                if (getattr(self, '_%s' % register) != -1 and
+                        register not in self.writeonly_register_names):
+                    setattr(self, '_%s' % register, card.registers[register])
+
+        def _set_registers(self):
+            card = self.port._driver_call()
+
+            for register in self.register_names:
+                value = getattr(self, '_%s' % register)
+
+                if (value != -1 and
+                        register not in self.readonly_register_names):
+                    card.registers[register] = value & 0xffffffff
+
+        def __getitem__(self, key):
+            return read_registers(self.port, [key])[key]
+
+        def __setitem__(self, key, value):
+            write_registers(self.port, {key: value})
+
+        def __getattr__(self, name):
+            if name in self.register_names:
+                return self[name]
+
+            raise AttributeError(name)
+
+        def _to_json(self):
+            registers = read_registers(self.port, READABLE_REGISTER_NAMES)
+            return dict((name, hex(value)) for name, value in
+                        registers.items())
+
+    class MemoryCap(object):
+
+        def __init__(self, port):
+            self.port = port
+
+        def _set_memcap(self, input_memcap, output_memcap):
+            card = self.port._driver_call()
+
+            if input_memcap != -1:
+                card.memory_cap[0] = int(input_memcap)
+
+            if output_memcap != -1:
+                card.memory_cap[1] = int(output_memcap)
+
+        def _get_memcap(self):
+            return tuple(self.port._driver_call().memory_cap)
+
+        input = property(lambda self: self._get_memcap()[0],
+                         lambda self, value: self._set_memcap(value, -1))
+        output = property(lambda self: self._get_memcap()[1],
+                          lambda self, value: self._set_memcap(-1, value))
+
+        def _to_json(self):
+            memory_cap = self._get_memcap()
+            return {'input': memory_cap[0], 'output': memory_cap[1]}
+
+    def __init__(self, port_num, append_status=True, append_timestamp=True,
+                 latency=0.0):
+        self._port_num = port_num
+        self._card = simulated_card(port_num)
+        self._closed = False
+
+        self.latency = latency
+
+        self._driver_call()
+
+        self.registers = SimulatedPort.Registers(self)
+        self.memory_cap = SimulatedPort.MemoryCap(self)
+
+        if append_status is not None:
+            self.append_status = append_status
+
+        if append_timestamp is not None:
+            self.append_timestamp = append_timestamp
+
+    def _driver_call(self):
+        if self._closed:
+            raise OSError('Port is closed')
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        return self._card
+
+    def _attribute(name):
+        def fget(self):
+            return getattr(self._driver_call(), name)
+
+        def fset(self, value):
+            setattr(self._driver_call(), name, type(getattr(self._card,
+                                                            name))(value))
+
+        return property(fget, fset)
+
+    append_status = _attribute('append_status')
+    append_timestamp = _attribute('append_timestamp')
+    ignore_timeout = _attribute('ignore_timeout')
+    rx_multiple = _attribute('rx_multiple')
+    tx_modifiers = _attribute('tx_modifiers')
+
+    del _attribute
+
+    def _set_clock_frequency(self, frequency):
+        low, high = CLOCK_FREQUENCY_RANGE
+
+        if not low <= int(frequency) <= high:
+            raise fscc.InvalidParameterError()
+
+        # Programming the clock generator is much slower than other calls
+        card = self._driver_call()
+        time.sleep(self.latency * 10)
+        card.clock_frequency = int(frequency)
+
+    clock_frequency = property(fset=_set_clock_frequency)
+
+    def purge(self, tx=True, rx=True):
+        card = self._driver_call()
+
+        if rx:
+            with card.lock:
+                card.rx_frames.clear()
+                card.rx_bytes = 0
+
+    def write(self, data):
+        card = self._driver_call()
+        frame = (bytes(data), 0x0000, time.time())
+
+        with card.lock:
+            # Frames past the input memory cap are dropped like the driver
+            if card.rx_bytes + len(frame[0]) > card.memory_cap[0]:
+                card.rx_dropped += 1
+            else:
+                card.rx_frames.append(frame)
+                card.rx_bytes += len(frame[0])
+                card.rx_ready.notify()
+
+            card.raise_interrupts(len(frame[0]))
+
+        return len(data)
+
+    def read(self, timeout=None, size=4096):
+        card = self._driver_call()
+
+        with card.lock:
+            if not card.rx_frames:
+                card.rx_ready.wait(timeout / 1000 if timeout else None)
+
+            packet = b''
+
+            while card.rx_frames:
+                data, status, timestamp = card.rx_frames[0]
+                frame = data + self._trailer(status, timestamp)
+
+                if packet and len(packet) + len(frame) > size:
+                    break
+
+                card.rx_frames.popleft()
+                card.rx_bytes -= len(data)
+                packet += frame[:size]
+
+                if not card.rx_multiple:
+                    break
+
+        if not packet:
+            return (None, None, None)
+
+        if card.rx_multiple:
+            return (packet, None, None)
+
+        return self._parse(packet)
+
+    def _trailer(self, status, timestamp):
+        # Laid out the way the driver on this platform appends them
+        trailer = b''
+
+        if self._card.append_status:
+            trailer += struct.pack('<H', status)
+
+        if self._card.append_timestamp:
+            if os.name == 'nt':
+                filetime = int((timestamp + 11644473600) * 10000000)
+                trailer += struct.pack('q', filetime)
+            else:
+                seconds = int(timestamp)
+                useconds = int((timestamp - seconds) * 1000000)
+                trailer += struct.pack('ll', seconds, useconds)
+
+        return trailer
+
+    def _parse(self, packet):
+        timestamp_size = 8
+
+        if os.name != 'nt' and ctypes.sizeof(ctypes.c_voidp) == 8:
+            timestamp_size = 16
+
+        data, status, timestamp = packet, None, None
+
+        if self._card.append_timestamp:
+            if os.name == 'nt':
+                filetime = struct.unpack('q', data[-8:])[0]
+                timestamp = filetime / 10000000 - 11644473600
+            else:
+                seconds, useconds = struct.unpack('ll', data[-timestamp_size:])
+                timestamp = seconds + float(useconds) / 1000000
+
+            data = data[:-timestamp_size]
+
+        if self._card.append_status:
+            status = data[-2:]
+            data = data[:-2]
+
+        return (data, status, timestamp)
+
+    def track_interrupts(self, interrupts, timeout=None):
+        card = self._driver_call()
+
+        with card.lock:
+            card.trackers += 1
+
+            try:
+                pending = [bit for bit, count in card.interrupts.items()
+                           if bit & interrupts and count]
+
+                if not pending:
+                    card.interrupt_ready.wait(timeout / 1000 if timeout
+                                              else None)
+                    pending = [bit for bit, count in card.interrupts.items()
+                               if bit & interrupts and count]
+            finally:
+                card.trackers -= 1
+
+            # Interrupts close together are reported in one match
+            matches = 0
+
+            for bit in pending:
+                card.interrupts[bit] -= 1
+                matches |= bit
+
+            return matches
+
+    def close(self):
+        self._closed = True
+
+    def _to_json(self):
+        return PortState(self)._to_json()
+
+    def to_json(self, *args, **kwargs):
+        return PortState(self).to_json(*args, **kwargs)
+
+    def __str__(self):
+        return 'SIM{}'.format(self._port_num)
+
+    def __repr__(self):
+        return 'SimulatedPort({})'.format(self._port_num)
+
+
+def open_simulated_port(port_name, latency=0.0):
+    """Opens a simulated port, returning the PortState like open_port."""
+    return PortState(SimulatedPort(port_number(port_name), None, None,
+                                   latency))
@@ -0,0 +1,105 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import sys
+import json
+import time
+import threading
+
+
+class StartupProfile(object):
+    """Times the phases of getting the dialog on screen.
+
+    mark() ends a phase where the previous one left off. Phases running
+    in the background, like port enumeration, overlap the others so they
+    are recorded with their own start through timed() or record().
+    """
+
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.phases = []
+
+        self._last = self.start
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        with self._lock:
+            return any(phase[0] == name for phase in self.phases)
+
+    def mark(self, name):
+        now = time.perf_counter()
+
+        with self._lock:
+            self.phases.append((name, self._last, now, False))
+            self._last = now
+
+    def record(self, name, start, end, background=True):
+        with self._lock:
+            self.phases.append((name, start, end, background))
+
+    def timed(self, name, function):
+        """Returns function wrapped to record how long its first call
+        takes."""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if name not in self:
+                    self.record(name, start, time.perf_counter())
+
+        return wrapper
+
+    def results(self):
+        """Returns each phase's name, start, duration and end in
+        milliseconds since launch."""
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+
+        return [{'name': name,
+                 'start': (start - self.start) * 1000,
+                 'duration': (end - start) * 1000,
+                 'end': (end - self.start) * 1000,
+                 'background': background}
+                for name, start, end, background in phases]
+
+    def format(self):
+        lines = []
+
+        for result in self.results():
+            lines.append('{:<20} {:>9.1f} ms  done at {:>7.1f} ms{}'.format(
+                result['name'], result['duration'], result['end'],
+                '  (background)' if result['background'] else ''))
+
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        """Writes the results as JSON, or prints them for '-'."""
+        if filename == '-':
+            # Windowed builds on Windows have no console to print to
+            if sys.stdout is not None:
+                print(self.format())
+            return
+
+        with open(filename, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'frozen': bool(getattr(sys, 'frozen', False)),
+                       'phases': self.results()}, f, indent=4)
@@ -0,0 +1,283 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import threading
+from array import array
+from collections import OrderedDict
+
+from portstate import RFO, RDO, RFL
+
+
+SAMPLE_INTERVAL = 0.2  # Seconds between samples of the counters
+RAW_SIZE = 1500  # Raw samples kept, five minutes at SAMPLE_INTERVAL
+
+# (seconds per point, points kept), two hours of seconds and a week of
+# minutes
+ROLLUPS = [(1.0, 7200), (60.0, 10080)]
+
+# Rates kept for a port, each from a running total in PortCounters
+METRICS = ['rx_frames', 'rx_bytes', 'tx_frames', 'tx_bytes', 'drops',
+           'status_errors']
+
+# Interrupts counted as drops, frames or data the receiver had no room for
+DROP_INTERRUPTS = RFO | RDO | RFL
+
+
+class Rollup(object):
+    """Fixed size ring of the lowest, highest and mean value of the
+    samples in each interval, or of every sample without an interval."""
+
+    def __init__(self, interval, size):
+        self.interval = interval
+        self.size = size
+        self.count = 0  # Points started since the rollup was created
+
+        self._times = array('d', [0.0]) * size
+        self._lows = array('d', [0.0]) * size
+        self._highs = array('d', [0.0]) * size
+        self._sums = array('d', [0.0]) * size
+        self._counts = array('I', [0]) * size
+
+        self._bucket = None
+
+    def add(self, timestamp, value):
+        if self.interval:
+            bucket = int(timestamp // self.interval)
+        else:
+            bucket = None
+
+        if bucket is None or bucket != self._bucket:
+            self._bucket = bucket
+
+            index = self.count % self.size
+            self._times[index] = (bucket * self.interval if self.interval
+                                  else timestamp)
+            self._lows[index] = self._highs[index] = value
+            self._sums[index] = 0.0
+            self._counts[index] = 0
+
+            self.count += 1
+        else:
+            index = (self.count - 1) % self.size
+
+            if value < self._lows[index]:
+                self._lows[index] = value
+
+            if value > self._highs[index]:
+                self._highs[index] = value
+
+        self._sums[index] += value
+        self._counts[index] += 1
+
+    def oldest(self):
+        if not self.count:
+            return None
+
+        return self._times[max(self.count - self.size, 0) % self.size]
+
+    def points(self, start=None):
+        """Returns (time, low, high, mean) for each interval from start on,
+        oldest first."""
+        first = max(self.count - self.size, 0)
+        points = []
+
+        for i in range(first, self.count):
+            index = i % self.size
+
+            end = self._times[index] + self.interval
+
+            if start is not None and end < start:
+                continue
+
+            points.append((self._times[index], self._lows[index],
+                           self._highs[index],
+                           self._sums[index] / self._counts[index]))
+
+        return points
+
+
+class TimeSeries(object):
+    """Samples of one value at several resolutions.
+
+    The newest samples are kept as they are and every sample also goes
+    into coarser rollups, so a long run takes a fixed amount of memory
+    and the recent past stays detailed.
+    """
+
+    def __init__(self, raw_size=RAW_SIZE, rollups=ROLLUPS):
+        self.raw = Rollup(0, raw_size)
+        self.rollups = [Rollup(interval, size) for interval, size in rollups]
+
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, value):
+        with self._lock:
+            self.raw.add(timestamp, value)
+
+            for rollup in self.rollups:
+                rollup.add(timestamp, value)
+
+    def latest(self):
+        with self._lock:
+            points = self.raw.points()[-1:]
+
+        return points[0][1] if points else None
+
+    def points(self, start=None):
+        """Returns (time, low, high, mean) points from start on, from the
+        finest resolution still holding start."""
+        with self._lock:
+            for level in [self.raw] + self.rollups:
+                oldest = level.oldest()
+
+                if oldest is not None and (start is None or oldest <= start):
+                    return level.points(start)
+
+            # Nothing goes back far enough, the coarsest goes back furthest
+            return self.rollups[-1].points(start) if self.rollups else []
+
+
+def downsample(points, start, end, columns):
+    """Reduces points to at most one (time, low, high) per column between
+    start and end, keeping the extremes so spikes still show."""
+    if end <= start or columns <= 0:
+        return []
+
+    width = (end - start) / columns
+    reduced = OrderedDict()
+
+    for timestamp, low, high, mean in points:
+        if timestamp < start or timestamp > end:
+            continue
+
+        column = min(int((timestamp - start) / width), columns - 1)
+        previous = reduced.get(column)
+
+        if previous is None:
+            reduced[column] = [timestamp, low, high]
+        else:
+            previous[1] = min(previous[1], low)
+            previous[2] = max(previous[2], high)
+
+    return [tuple(point) for point in reduced.values()]
+
+
+class PortCounters(object):
+    """Running totals of a port's traffic, read from whatever is moving it.
+
+    Received frames come from a capture.CaptureRecorder, transmitted ones
+    from a traffic.TrafficGenerator and drops from a tuning.InterruptCounter
+    watching the overflow interrupts. Sources can be swapped as they start
+    and stop, the totals carry on from where the last one left off.
+    """
+
+    def __init__(self):
+        self.recorder = None
+        self.generator = None
+        self.drop_counter = None
+
+        self._base = dict((metric, 0) for metric in METRICS)
+        self._lock = threading.Lock()
+
+    def attach(self, recorder=None, generator=None, drop_counter=None):
+        with self._lock:
+            totals = self._totals()
+
+            if recorder is not None:
+                self.recorder = recorder
+
+            if generator is not None:
+                self.generator = generator
+
+            if drop_counter is not None:
+                self.drop_counter = drop_counter
+
+            # What the sources counted before now isn't added again
+            sources = self._source_totals()
+            self._base = dict((metric, totals[metric] - sources[metric])
+                              for metric in METRICS)
+
+    def detach(self):
+        with self._lock:
+            self._base = self._totals()
+            self.recorder = self.generator = self.drop_counter = None
+
+    def _source_totals(self):
+        totals = dict((metric, 0) for metric in METRICS)
+
+        if self.recorder is not None:
+            totals['rx_frames'] = self.recorder.frames
+            totals['rx_bytes'] = self.recorder.bytes
+            totals['status_errors'] = self.recorder.status_errors
+
+        if self.generator is not None:
+            totals['tx_frames'] = self.generator.sent
+            totals['tx_bytes'] = self.generator.bytes
+
+        if self.drop_counter is not None:
+            totals['drops'] = self.drop_counter.events
+
+        return totals
+
+    def _totals(self):
+        sources = self._source_totals()
+
+        return dict((metric, self._base[metric] + sources[metric])
+                    for metric in METRICS)
+
+    def totals(self):
+        with self._lock:
+            return self._totals()
+
+
+class ThroughputHistory(object):
+    """Per second rates of a port's counters as TimeSeries."""
+
+    def __init__(self, counters, raw_size=RAW_SIZE, rollups=ROLLUPS):
+        self.counters = counters
+        self.series = OrderedDict((metric, TimeSeries(raw_size, rollups))
+                                  for metric in METRICS)
+
+        self._last = None
+
+    def sample(self, now=None):
+        """Adds the rates since the previous sample, call it every
+        SAMPLE_INTERVAL or so."""
+        if now is None:
+            now = time.time()
+
+        totals = self.counters.totals()
+
+        if self._last is not None:
+            then, previous = self._last
+            elapsed = now - then
+
+            if elapsed > 0:
+                for metric, series in self.series.items():
+                    series.append(now, (totals[metric] - previous[metric]) /
+                                  elapsed)
+
+        self._last = (now, totals)
+
+    def rates(self):
+        """Returns the newest rate of every metric."""
+        return OrderedDict((metric, series.latest())
+                           for metric, series in self.series.items())
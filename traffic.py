@@ -0,0 +1,173 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import threading
+from array import array
+
+from capture import CaptureFile
+
+
+SPIN_TIME = 0.002  # Seconds before a send that are busy-waited, not slept
+MAX_BURST = 16  # Late frames sent back to back before the schedule resets
+
+
+def template_frames(size, count=1):
+    """Returns count frames of size bytes with counting byte patterns."""
+    return [bytes((i + j) & 0xff for j in range(size)) for i in range(count)]
+
+
+def capture_frames(path, limit=None):
+    """Returns the frames of a capture and the seconds between them."""
+    frames, gaps = [], array('d')
+    previous = None
+
+    with CaptureFile(path) as capture:
+        for sequence, flags, status, timestamp, data in capture.records():
+            if limit is not None and len(frames) >= limit:
+                break
+
+            frames.append(bytes(data))
+
+            if previous is not None:
+                gaps.append(max(timestamp - previous, 0.0))
+
+            previous = timestamp
+
+    # The last frame waits as long as the one before it before looping
+    gaps.append(gaps[-1] if gaps else 0.0)
+
+    return frames, gaps
+
+
+class TrafficGenerator(threading.Thread):
+    """Sends frames at a target frame rate or bit rate.
+
+    The frames and the gap after each one are prepared up front so nothing
+    is built while sending. Waits are slept until SPIN_TIME before each send
+    and busy-waited from there for accuracy. Without a rate frames are sent
+    as fast as the port takes them.
+    """
+
+    def __init__(self, port, frames, frame_rate=None, bit_rate=None,
+                 gaps=None, count=None, duration=None):
+        super(TrafficGenerator, self).__init__()
+
+        if not frames:
+            raise ValueError('No frames to send')
+
+        self.daemon = True
+        self.port = port
+        self.frames = [bytes(frame) for frame in frames]
+        self.count = count
+        self.duration = duration
+        self.frame_rate = frame_rate
+        self.bit_rate = bit_rate
+
+        if gaps is not None:
+            self.gaps = array('d', gaps)
+        elif frame_rate:
+            self.gaps = array('d', [1.0 / frame_rate]) * len(self.frames)
+        elif bit_rate:
+            self.gaps = array('d', (len(frame) * 8.0 / bit_rate
+                                    for frame in self.frames))
+        else:
+            self.gaps = array('d', [0.0]) * len(self.frames)
+
+        self.sent = 0
+        self.bytes = 0
+        self.start_time = None
+        self.stop_time = None
+        self.error = None
+
+        self._stop_event = threading.Event()
+
+    def run(self):
+        gaps, next_frame = self.gaps, self.next_frame
+        write, clock = self.port.write, time.perf_counter
+        length = len(self.frames)
+        count, stopped = self.count, self._stop_event.is_set
+        wait = self._stop_event.wait
+        max_lag = MAX_BURST * max(max(gaps), 1e-6)
+
+        self.start_time = clock()
+        end_time = self.start_time + self.duration if self.duration else None
+        next_send = self.start_time
+        i = 0
+
+        try:
+            while not stopped():
+                if count is not None and self.sent >= count:
+                    break
+
+                now = clock()
+
+                if end_time and now >= end_time:
+                    break
+
+                delay = next_send - now
+
+                # Waiting on the stop event lets a long replay gap be cut
+                # short by stop()
+                if delay > SPIN_TIME and wait(delay - SPIN_TIME):
+                    break
+
+                while clock() < next_send:
+                    pass
+
+                frame = next_frame(i)
+                write(frame)
+
+                self.sent += 1
+                self.bytes += len(frame)
+
+                next_send += gaps[i]
+                i = i + 1 if i + 1 < length else 0
+
+                # Don't try to make up for a long stall all at once
+                if clock() - next_send > max_lag:
+                    next_send = clock()
+        except OSError as e:
+            self.error = e
+
+        self.stop_time = clock()
+
+    def next_frame(self, i):
+        """Returns the frame to send for slot i of the frames."""
+        return self.frames[i]
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def stats(self):
+        """Returns the requested and achieved rates."""
+        elapsed = ((self.stop_time or time.perf_counter()) -
+                   (self.start_time or time.perf_counter()))
+
+        return {
+            'frames': self.sent,
+            'bytes': self.bytes,
+            'seconds': elapsed,
+            'requested_frame_rate': self.frame_rate,
+            'requested_bit_rate': self.bit_rate,
+            'frame_rate': self.sent / elapsed if elapsed else 0.0,
+            'bit_rate': self.bytes * 8 / elapsed if elapsed else 0.0,
+        }
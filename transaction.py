@@ -0,0 +1,231 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from collections import OrderedDict
+
+from portstate import *
+
+
+BOOLEAN_ATTRIBUTE_NAMES = [name for name in ATTRIBUTE_NAMES
+                           if name != 'tx_modifiers']
+
+
+class ApplyError(Exception):
+    """A change set failed partway and was rolled back."""
+
+    def __init__(self, error, rolled_back):
+        super(ApplyError, self).__init__(error, rolled_back)
+
+        self.error = error
+        self.rolled_back = rolled_back
+
+    def __str__(self):
+        if self.rolled_back:
+            return '{} (the previous settings were restored)'.format(
+                self.error)
+
+        return '{} (the previous settings could not all be restored)'.format(
+            self.error)
+
+
+class ChangeSet(object):
+    """Settings to write to a port together.
+
+    Apply collects every widget's edits into one of these so nothing is
+    written until all of them are known to be valid.
+    """
+
+    def __init__(self):
+        self.memory_cap = None
+        self.attributes = OrderedDict()
+        self.clock_frequency = None
+        self.registers = OrderedDict()
+        self.invalid = []
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Returns the changes in a .fscc settings dictionary."""
+        changes = cls()
+
+        if 'memory_cap' in settings:
+            changes.set_memory_cap(settings['memory_cap']['input'],
+                                   settings['memory_cap']['output'])
+
+        for name in ATTRIBUTE_NAMES:
+            if name in settings:
+                changes.set_attribute(name, settings[name])
+
+        if 'clock_frequency' in settings:
+            changes.set_clock_frequency(settings['clock_frequency'])
+
+        changes.set_registers(
+            dict((name, int(value, 0)) for name, value
+                 in settings.get('registers', {}).items()
+                 if name in REGISTER_NAMES))
+
+        return changes
+
+    def set_memory_cap(self, input_memcap, output_memcap):
+        self.memory_cap = (int(input_memcap), int(output_memcap))
+
+    def set_attribute(self, name, value):
+        self.attributes[name] = value
+
+    def set_clock_frequency(self, frequency):
+        self.clock_frequency = int(frequency)
+
+    def set_registers(self, registers):
+        for name in REGISTER_NAMES:
+            if name in registers:
+                self.registers[name] = int(registers[name])
+
+    def reject(self, reason):
+        """Marks the change set as unusable, it won't be applied."""
+        self.invalid.append(reason)
+
+    def is_empty(self):
+        return (self.memory_cap is None and not self.attributes and
+                self.clock_frequency is None and not self.registers)
+
+    def pending(self, state):
+        """Returns the changes that differ from what is on the port.
+
+        Settings the port doesn't support are dropped.
+        """
+        pending = ChangeSet()
+
+        if self.memory_cap is not None and hasattr(state, 'memory_cap'):
+            if self.memory_cap != (state.memory_cap['input'],
+                                   state.memory_cap['output']):
+                pending.memory_cap = self.memory_cap
+
+        # The boolean attributes go before tx_modifiers
+        for name in BOOLEAN_ATTRIBUTE_NAMES + ['tx_modifiers']:
+            if name in self.attributes and hasattr(state, name):
+                if self.attributes[name] != getattr(state, name):
+                    pending.attributes[name] = self.attributes[name]
+
+        if self.clock_frequency != state.clock_frequency:
+            pending.clock_frequency = self.clock_frequency
+
+        pending.registers = changed_registers(state.registers,
+                                              self.registers)
+
+        return pending
+
+
+def _roll_back(undo):
+    restored = True
+
+    for action in reversed(undo):
+        try:
+            if action is None:
+                restored = False
+            else:
+                action()
+        except Exception:
+            restored = False
+
+    return restored
+
+
+def verify_changes(state, changes):
+    """Returns {setting: (written, read back)} for the changes the port
+    doesn't report."""
+    unverified = OrderedDict()
+
+    if changes.memory_cap is not None and hasattr(state, 'memory_cap'):
+        memory_cap = (state.memory_cap['input'], state.memory_cap['output'])
+
+        if memory_cap != changes.memory_cap:
+            unverified['memory_cap'] = (changes.memory_cap, memory_cap)
+
+    for name, value in changes.attributes.items():
+        if getattr(state, name, None) != value:
+            unverified[name] = (value, getattr(state, name, None))
+
+    for name, value in changed_registers(state.registers,
+                                         changes.registers).items():
+        unverified[name] = (value, state.registers.get(name))
+
+    return unverified
+
+
+def apply_change_set(state, changes):
+    """Writes a change set to a port, all of it or none of it.
+
+    Only what differs from the port is written, in an order that is safe
+    for a live link: the memory cap, the boolean attributes, tx_modifiers,
+    the clock and last the registers in a single batch (so BGR divides the
+    new clock). Everything is read back in one pass afterwards. If a write
+    fails, the writes before it are undone from the state's snapshot and
+    ApplyError is raised.
+
+    Returns the settings that didn't read back what was written.
+    """
+    changes = changes.pending(state)
+
+    if changes.is_empty():
+        return OrderedDict()
+
+    port = state.port
+    undo = []
+
+    try:
+        if changes.memory_cap is not None:
+            previous = (state.memory_cap['input'], state.memory_cap['output'])
+            undo.append(lambda: port.memory_cap._set_memcap(*previous))
+            port.memory_cap._set_memcap(*changes.memory_cap)
+
+        for name, value in changes.attributes.items():
+            undo.append(lambda name=name, value=getattr(state, name):
+                        setattr(port, name, value))
+            setattr(port, name, value)
+
+        if changes.clock_frequency is not None:
+            previous_clock = state.clock_frequency
+
+            # A clock that was never set through this state can't be put back
+            if previous_clock is None:
+                undo.append(None)
+            else:
+                undo.append(lambda: state.set_clock_frequency(previous_clock))
+
+            state.set_clock_frequency(changes.clock_frequency)
+
+        if changes.registers:
+            previous_registers = OrderedDict(
+                (name, state.registers[name]) for name in changes.registers
+                if name in state.registers)
+            undo.append(lambda: write_registers(port, previous_registers))
+            write_registers(port, changes.registers)
+    except Exception as e:
+        rolled_back = _roll_back(undo)
+
+        try:
+            state.refresh()
+        except OSError:
+            pass
+
+        raise ApplyError(e, rolled_back)
+
+    state.refresh()
+
+    return verify_changes(state, changes)
@@ -0,0 +1,260 @@
+"""
+    Copyright (C) 2014 Commtech, Inc.
+
+    This file is part of qfscc.
+
+    qfscc is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    qfscc is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with qfscc.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import time
+import threading
+
+import fscc
+
+from portstate import *
+from loopback import run_loopback
+
+
+# Memory caps tried, 16 KB to 64 MB
+MEMORY_CAPS = [2 ** i for i in range(14, 27)]
+
+TRIAL_TIME = 2.0  # Seconds of traffic per memory cap
+READ_INTERVAL = 0.1  # How often the receiver drains the port, in seconds
+RATE_TOLERANCE = 0.99  # Fraction of the target rate that counts as met
+
+
+def measure_memory_cap(tx_port, rx_port, memory_cap, size, frame_rate,
+                       duration=TRIAL_TIME, read_interval=READ_INTERVAL):
+    """Runs loopback traffic with both memory caps set to memory_cap."""
+    rx_port.memory_cap._set_memcap(memory_cap, -1)
+    tx_port.memory_cap._set_memcap(-1, memory_cap)
+
+    results = run_loopback(tx_port, rx_port, size, frame_rate,
+                           duration=duration, read_interval=read_interval)
+
+    return {
+        'memory_cap': memory_cap,
+        'sent': results['sent'],
+        'lost': results['lost'],
+        'loss_ratio': results['loss_ratio'],
+        'frame_rate': results['send_frame_rate'],
+        'bit_rate': results['send_frame_rate'] * size * 8,
+        'peak_in_flight': results['peak_in_flight'],
+        'errors': results['errors'],
+    }
+
+
+def sustains(trial, frame_rate, max_loss=0.0):
+    """Returns whether a trial kept up with frame_rate."""
+    return (not trial['errors'] and trial['loss_ratio'] <= max_loss and
+            trial['frame_rate'] >= frame_rate * RATE_TOLERANCE)
+
+
+def tune_memory_cap(tx_port, frame_rate, rx_port=None, size=1024,
+                    memory_caps=MEMORY_CAPS, duration=TRIAL_TIME,
+                    read_interval=READ_INTERVAL, max_loss=0.0, apply=False):
+    """Finds the smallest memory cap that sustains frame_rate.
+
+    More memory never makes a port drop more frames, so the caps are
+    searched by bisection instead of trying every one. The original caps
+    are put back afterwards unless apply is set and a cap was found.
+    Returns the recommended cap (None if even the largest falls short) and
+    every trial that was run.
+    """
+    rx_port = rx_port or tx_port
+    memory_caps = sorted(memory_caps)
+
+    original = (rx_port.memory_cap._get_memcap()[0],
+                tx_port.memory_cap._get_memcap()[1])
+
+    trials = []
+    low, high = 0, len(memory_caps)
+
+    try:
+        while low < high:
+            middle = (low + high) // 2
+            trial = measure_memory_cap(tx_port, rx_port, memory_caps[middle],
+                                       size, frame_rate, duration,
+                                       read_interval)
+            trial['sustained'] = sustains(trial, frame_rate, max_loss)
+            trials.append(trial)
+
+            if trial['sustained']:
+                high = middle
+            else:
+                low = middle + 1
+    finally:
+        rx_port.memory_cap._set_memcap(original[0], -1)
+        tx_port.memory_cap._set_memcap(-1, original[1])
+
+    # high only ever moves to a cap that was measured to keep up
+    recommended = memory_caps[high] if high < len(memory_caps) else None
+
+    if apply and recommended is not None:
+        rx_port.memory_cap._set_memcap(recommended, -1)
+        tx_port.memory_cap._set_memcap(-1, recommended)
+
+    return {
+        'recommended': recommended,
+        'frame_rate': frame_rate,
+        'size': size,
+        'trials': sorted(trials, key=lambda t: t['memory_cap']),
+    }
+
+
+# FIFO trigger levels tried, in bytes
+FIFO_TRIGGERS = [32, 128, 512, 1024, 2048, 4096, 6144]
+
+# Interrupts counted while tuning the FIFO triggers
+FIFO_INTERRUPTS = RFT | RFE | TFT | ALLS
+
+TRACK_TIMEOUT = 100  # Milliseconds
+
+
+class InterruptCounter(threading.Thread):
+    """Counts the interrupts a port reports through track_interrupts.
+
+    Interrupts that happen while a match is being counted are reported
+    together or missed, so the counts are a lower bound.
+    """
+
+    def __init__(self, port, interrupts=FIFO_INTERRUPTS):
+        super(InterruptCounter, self).__init__()
+
+        self.daemon = True
+        self.port = port
+        self.interrupts = interrupts
+        self.events = 0
+        self.error = None
+
+        self._stop_event = threading.Event()
+
+    def run(self):
+        track = self.port.track_interrupts
+
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    matches = track(self.interrupts, TRACK_TIMEOUT)
+                except fscc.TimeoutError:
+                    continue
+
+                if matches:
+                    self.events += 1
+        except OSError as e:
+            self.error = e
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def set_fifo_triggers(tx_port, rx_port, rx_trigger, tx_trigger):
+    """Sets the receive trigger on rx_port and the transmit trigger on
+    tx_port, leaving the rest of FIFOT alone."""
+    for port in set([tx_port, rx_port]):
+        fifot = read_registers(port, ['FIFOT'])['FIFOT']
+        rx, tx = fifo_triggers(fifot)
+
+        if port is rx_port:
+            rx = rx_trigger
+
+        if port is tx_port:
+            tx = tx_trigger
+
+        write_registers(port, {'FIFOT': fifot_value(rx, tx, fifot)})
+
+
+def measure_fifo_triggers(tx_port, rx_port, rx_trigger, tx_trigger, size,
+                          frame_rate, duration=TRIAL_TIME):
+    """Runs loopback traffic at one pair of FIFO trigger levels."""
+    set_fifo_triggers(tx_port, rx_port, rx_trigger, tx_trigger)
+
+    counters = [InterruptCounter(port) for port in set([tx_port, rx_port])]
+
+    for counter in counters:
+        counter.start()
+
+    start = time.perf_counter()
+
+    try:
+        results = run_loopback(tx_port, rx_port, size, frame_rate,
+                               duration=duration)
+    finally:
+        for counter in counters:
+            counter.stop()
+
+    elapsed = time.perf_counter() - start
+    events = sum(counter.events for counter in counters)
+
+    return {
+        'rx_trigger': rx_trigger,
+        'tx_trigger': tx_trigger,
+        'interrupt_rate': events / elapsed if elapsed else 0.0,
+        'frame_rate': results['receive_frame_rate'],
+        'bit_rate': results['receive_bit_rate'],
+        'lost': results['lost'],
+        'latency_p50': results['latency']['p50'],
+        'latency_p99': results['latency']['p99'],
+        'errors': results['errors'] + [str(counter.error) for counter
+                                       in counters if counter.error],
+    }
+
+
+def efficient_trials(trials):
+    """Marks the trials no other lossless trial beats on both interrupt
+    rate and p99 latency, the points on the tradeoff curve."""
+    usable = [t for t in trials if not t['lost'] and not t['errors'] and
+              t['latency_p99'] is not None]
+
+    for trial in trials:
+        trial['efficient'] = trial in usable and not any(
+            other['interrupt_rate'] <= trial['interrupt_rate'] and
+            other['latency_p99'] <= trial['latency_p99'] and
+            (other['interrupt_rate'] < trial['interrupt_rate'] or
+             other['latency_p99'] < trial['latency_p99'])
+            for other in usable)
+
+    return trials
+
+
+def tune_fifo_triggers(tx_port, frame_rate, rx_port=None, size=1024,
+                       triggers=None, duration=TRIAL_TIME):
+    """Measures interrupt rate, throughput and latency at several FIFO
+    trigger levels.
+
+    triggers is a list of (receive, transmit) levels, by default the same
+    level for both from FIFO_TRIGGERS. The original FIFOT values are put
+    back afterwards, apply the chosen point with set_fifo_triggers.
+    """
+    rx_port = rx_port or tx_port
+    triggers = triggers or [(level, level) for level in FIFO_TRIGGERS]
+
+    original = dict((port, read_registers(port, ['FIFOT']))
+                    for port in set([tx_port, rx_port]))
+
+    trials = []
+
+    try:
+        for rx_trigger, tx_trigger in triggers:
+            trials.append(measure_fifo_triggers(
+                tx_port, rx_port, rx_trigger, tx_trigger, size, frame_rate,
+                duration))
+    finally:
+        for port, registers in original.items():
+            write_registers(port, registers)
+
+    return efficient_trials(sorted(trials,
+                                   key=lambda t: t['interrupt_rate']))
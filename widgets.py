@@ -18,16 +18,24 @@
 
 """
 
-import re
+import time
 import json
+from array import array
+from collections import OrderedDict
 
-from PySide.QtCore import Signal
+from PySide.QtCore import Signal, Qt, QObject, QRunnable, QThreadPool, QTimer
+from PySide.QtCore import QAbstractTableModel, QModelIndex
 from PySide.QtGui import *
 
 from dialogs import *
+from portstate import *
+from pool import PortPool
+from monitor import RegisterHistory, RegisterPoller, POLL_RATE
+from capture import CaptureFile, CaptureRecorder, CAPTURE_SIZE
+from timeseries import *
+from transaction import ChangeSet, ApplyError, apply_change_set
 
 import fscc
-from fscc.tools import list_ports
 
 
 class FBoxLayout(QWidget):
@@ -61,29 +69,105 @@ class FVBoxLayout(FBoxLayout):
         super(FVBoxLayout, self).__init__(QVBoxLayout, *args, **kwargs)
 
 
-class FPortName(FHBoxLayout):
-    port_changed = Signal(fscc.Port)
-    apply_changes = Signal(fscc.Port)
+class FWorkerSignals(QObject):
+    finished = Signal(object)
+    failed = Signal(object)
+
+
+class FWorker(QRunnable):
+    """Runs a function on the global thread pool and signals the result."""
+
+    def __init__(self, function, *args):
+        super(FWorker, self).__init__()
+
+        self.function = function
+        self.args = args
+        self.signals = FWorkerSignals()
 
-    def __init__(self, apply_changes_signal):
+    def run(self):
+        try:
+            result = self.function(*self.args)
+        except Exception as e:
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+class FPortName(FHBoxLayout):
+    port_loading = Signal()
+    ports_listed = Signal(object)
+    port_selected = Signal(str)
+    port_changed = Signal(object)
+    state_changed = Signal(object)
+    apply_changes = Signal(object)
+
+    def __init__(self, apply_changes_signal, pool=None,
+                 enumerate_ports=port_names):
         super(FPortName, self).__init__()
 
         self.port = None
+        self.state = None
+        self.names = []
+        self.workers = set()
+        self.open_count = 0
 
-        self.label = QLabel('Port')
+        # Switching back to a recent port reuses its handle and state
+        self.pool = pool if pool is not None else PortPool()
+        self.acquired_name = None
+
+        self.sweep_timer = QTimer(self)
+        self.sweep_timer.timeout.connect(self.sweep_ports)
+        self.sweep_timer.start(int(min(self.pool.idle_timeout, 30) * 1000))
 
-        port_names = [x[1] for x in sorted(list_ports.fsccports())]
+        self.label = QLabel('Port')
 
         self.combo_box = QComboBox()
-        self.combo_box.addItems(port_names)
+        self.combo_box.setEnabled(False)
         self.combo_box.currentIndexChanged.connect(self.currentIndexChanged)
-        self.combo_box.setCurrentIndex(-1)
 
         apply_changes_signal.connect(self.apply_changes_clicked)
 
         self.addWidget(self.label)
         self.addWidget(self.combo_box)
 
+        # Enumerating can be slow, so the dialog shows before it finishes
+        self.start_worker(enumerate_ports, self.ports_found,
+                          self.ports_failed)
+
+    def start_worker(self, function, finished, failed=None, *args):
+        worker = FWorker(function, *args)
+        worker.signals.finished.connect(finished)
+
+        if failed:
+            worker.signals.failed.connect(failed)
+
+        # Hold a reference until the worker is done with its signals
+        self.workers.add(worker)
+        worker.signals.finished.connect(lambda _: self.workers.discard(worker))
+        worker.signals.failed.connect(lambda _: self.workers.discard(worker))
+
+        QThreadPool.globalInstance().start(worker)
+
+    def ports_found(self, names):
+        self.names = list(names)
+        self.ports_listed.emit(self.names)
+
+        self.combo_box.blockSignals(True)
+        self.combo_box.addItems(names)
+        self.combo_box.setCurrentIndex(-1)
+        self.combo_box.blockSignals(False)
+        self.combo_box.setEnabled(True)
+
+        if names:
+            self.set_port(names[0])
+        else:
+            self.port_changed.emit(None)
+            FNoPortsFound().exec_()
+
+    def ports_failed(self, e):
+        self.port_changed.emit(None)
+        FNoPortsFound().exec_()
+
     def set_port(self, port_name):
         index = self.combo_box.findText(port_name)
 
@@ -91,27 +175,94 @@ class FPortName(FHBoxLayout):
             self.combo_box.setCurrentIndex(index)
 
     def currentIndexChanged(self):
-        if self.port:
-            self.port.close()
+        if self.acquired_name:
+            self.start_worker(self.pool.release, lambda _: None, None,
+                              self.acquired_name, self.state)
+            self.acquired_name = None
             self.port = None
+            self.state = None
+
+        # Lets results from ports that are no longer selected be ignored
+        self.open_count += 1
+        open_count = self.open_count
 
         port_name = self.combo_box.currentText()
 
-        if port_name:
-            port_num = int(re.search('(\d+)$', port_name).group(0))
+        if not port_name:
+            self.port_changed.emit(None)
+            return
+
+        self.port_loading.emit()
+
+        self.start_worker(
+            self.pool.acquire,
+            lambda state: self.port_opened(open_count, port_name, state),
+            lambda e: self.port_failed(open_count, e),
+            port_name)
+
+    def port_opened(self, open_count, port_name, state):
+        # The selection moved on while this port was opening
+        if open_count != self.open_count:
+            self.start_worker(self.pool.release, lambda _: None, None,
+                              port_name, state)
+            return
+
+        self.acquired_name = port_name
+        self.port = state.port
+
+        # Every widget renders from this instead of reading the card
+        self.state = state
+        self.port_selected.emit(port_name)
+        self.port_changed.emit(self.state)
+
+    def port_failed(self, open_count, e):
+        if open_count != self.open_count:
+            return
+
+        # Widgets are disabled since the port connection didn't complete
+        self.port_changed.emit(None)
+
+        if isinstance(e, fscc.PortNotFoundError):
+            FPortNotFound().exec_()
+        elif isinstance(e, fscc.InvalidAccessError):
+            FInvalidAccess().exec_()
+        else:
+            raise e
+
+    def sweep_ports(self):
+        self.start_worker(self.pool.sweep, lambda _: None)
 
-            try:
-                self.port = fscc.Port(port_num, None, None)
-            except fscc.PortNotFoundError:
-                FPortNotFound().exec_()
-            except fscc.InvalidAccessError:
-                FInvalidAccess().exec_()
+    def close_ports(self):
+        self.sweep_timer.stop()
+        self.pool.close_all()
 
-        # Will be None if port connection didn't complete
-        self.port_changed.emit(self.port)
+        self.acquired_name = None
+        self.port = None
+        self.state = None
 
     def apply_changes_clicked(self):
-        self.apply_changes.emit(self.port)
+        if not self.state:
+            return
+
+        # Every widget adds its edits before anything is written
+        changes = ChangeSet()
+        self.apply_changes.emit(changes)
+
+        # One bad value leaves the card untouched instead of half configured
+        if changes.invalid:
+            return
+
+        unverified = {}
+
+        try:
+            unverified = apply_change_set(self.state, changes)
+        except ApplyError as e:
+            FApplyFailed(e).exec_()
+
+        self.state_changed.emit(self.state)
+
+        if unverified:
+            FSettingsNotVerified(list(unverified.keys())).exec_()
 
 
 class PortChangedTracker:
@@ -124,21 +275,27 @@ class PortChangedTracker:
     def attach_port_changed(self, signal):
         signal.connect(self._port_changed)
 
+    def attach_port_loading(self, signal):
+        signal.connect(self._port_loading)
+
+    def attach_state_changed(self, signal):
+        signal.connect(self._state_changed)
+
     def attach_apply_changes(self, signal):
         signal.connect(self._apply_changes)
 
     def attach_import_settings(self, signal):
         signal.connect(self._import_settings)
 
-    def _port_changed(self, port):
+    def _port_changed(self, state):
         # There isn't a port opened so we disable the widget
-        if port is None:
+        if state is None:
             self.setEnabled(False)
             return
 
         try:
             # Call port_changed on child class
-            self.port_changed(port)
+            self.port_changed(state)
         except AttributeError:
             # This functionality isn't supported on this port
             self.unsupported()
@@ -147,18 +304,30 @@ class PortChangedTracker:
         else:
             self.supported()
 
-    def _apply_changes(self, port):
+    def _port_loading(self):
+        self.setEnabled(False)
+        self.setToolTip('Loading port settings...')
+
+    def _state_changed(self, state):
+        if self.isEnabled():
+            self.state_changed(state)
+
+    def _apply_changes(self, changes):
         if self.isEnabled():
-            self.apply_changes(port)
+            self.collect_changes(changes)
 
     def _import_settings(self, settings):
         if self.isEnabled():
             self.import_settings(settings)
 
-    def port_changed(self, port):
+    def port_changed(self, state):
         raise NotImplementedError
 
-    def apply_changes(self, port):
+    def state_changed(self, state):
+        # The settings were re-read from the card, so redisplay them
+        self.port_changed(state)
+
+    def collect_changes(self, changes):
         raise NotImplementedError
 
     def import_settings(self, settings):
@@ -173,53 +342,316 @@ class PortChangedTracker:
         self.setToolTip('This feature is not supported on this port.')
 
 
+class FRegisterModel(QAbstractTableModel):
+    """Register values for one or more ports, one column per port.
+
+    Values are kept in flat integer arrays and only formatted when a view
+    asks for a visible cell.
+    """
+    HIGHLIGHT_COLOR = QColor(255, 255, 160)
+
+    def __init__(self, register_names, editable_names=(), column_names=('',),
+                 parent=None):
+        super(FRegisterModel, self).__init__(parent)
+
+        self.register_names = list(register_names)
+        self.column_names = list(column_names)
+        self.rows = dict((name, i) for i, name in
+                         enumerate(self.register_names))
+        self.editable = [name in editable_names for name in
+                         self.register_names]
+
+        size = len(self.register_names) * len(self.column_names)
+
+        self.values = array('I', [0]) * size
+        self.changed_bits = array('I', [0]) * size
+        self.changed_at = array('d', [0.0]) * size
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.register_names)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.column_names)
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+        if self.editable[index.row()]:
+            flags |= Qt.ItemIsEditable
+
+        return flags
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+
+        if orientation == Qt.Vertical:
+            return self.register_names[section]
+        else:
+            return self.column_names[section]
+
+    def data(self, index, role=Qt.DisplayRole):
+        i = self._offset(index.row(), index.column())
+
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return '{:08x}'.format(self.values[i])
+        elif role == Qt.BackgroundRole:
+            if self.changed_bits[i]:
+                return self.HIGHLIGHT_COLOR
+        elif role == Qt.ToolTipRole:
+            if self.changed_bits[i]:
+                return 'Changed bits: {:08x}'.format(self.changed_bits[i])
+
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or not self.editable[index.row()]:
+            return False
+
+        try:
+            value = int(value, 16)
+        except (TypeError, ValueError):
+            return False
+
+        if not 0 <= value <= 0xffffffff:
+            return False
+
+        self.values[self._offset(index.row(), index.column())] = value
+        self.dataChanged.emit(index, index)
+
+        return True
+
+    def value(self, column, register_name):
+        return self.values[self._offset(self.rows[register_name], column)]
+
+    def set_values(self, column, registers, highlight=False):
+        """Updates a column from a dictionary of register values.
+
+        Emits a single dataChanged covering every row that changed.
+        """
+        now = time.monotonic()
+        changed_rows = []
+
+        for name, value in registers.items():
+            row = self.rows.get(name)
+
+            if row is None:
+                continue
+
+            i = self._offset(row, column)
+            changed_bits = self.values[i] ^ (value & 0xffffffff)
+
+            if not changed_bits:
+                continue
+
+            self.values[i] = value & 0xffffffff
+
+            if highlight:
+                self.changed_bits[i] = changed_bits
+                self.changed_at[i] = now
+
+            changed_rows.append(row)
+
+        self._rows_changed(changed_rows, column, column)
+
+    def fade_highlights(self, age):
+        """Clears highlights older than age seconds."""
+        now = time.monotonic()
+        faded_rows = []
+
+        for i, changed_bits in enumerate(self.changed_bits):
+            if changed_bits and now - self.changed_at[i] >= age:
+                self.changed_bits[i] = 0
+                faded_rows.append(i // len(self.column_names))
+
+        self._rows_changed(faded_rows, 0, len(self.column_names) - 1)
+
+    def clear_highlights(self):
+        self.fade_highlights(0)
+
+    def _offset(self, row, column):
+        return row * len(self.column_names) + column
+
+    def _rows_changed(self, rows, first_column, last_column):
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), first_column),
+                                  self.index(max(rows), last_column))
+
+
 class FRegisters(FVBoxLayout, PortChangedTracker):
+    DISPLAY_INTERVAL = 33  # Milliseconds between repaints while monitoring
+    HIGHLIGHT_TIME = 1.0  # Seconds a changed register stays highlighted
 
     def __init__(self):
         FVBoxLayout.__init__(self)
         PortChangedTracker.__init__(self)
 
-        self.register_names = fscc.Port.Registers.editable_register_names
-        self.register_names.remove(
-            *fscc.Port.Registers.writeonly_register_names)
+        # VSTR is shown by FFirmware
+        self.display_names = [r for r in READABLE_REGISTER_NAMES
+                              if r != 'VSTR']
+        self.register_names = list(REGISTER_NAMES)
+        self.state = None
+        self.snapshot = {}
 
-        table = QTableWidget(len(self.register_names), 1)
+        self.model = FRegisterModel(self.display_names, self.register_names)
 
-        for i, register_name in enumerate(self.register_names):
-            widget = QTableWidgetItem('{:08x}'.format(0))
-            setattr(self, register_name.lower(), widget)
-            table.setItem(i, 0, getattr(self, register_name.lower()))
+        self.table = QTableView()
+        self.table.setModel(self.model)
 
-        header = table.horizontalHeader()
+        header = self.table.horizontalHeader()
         header.setStretchLastSection(True)
         header.hide()
 
-        table.setVerticalHeaderLabels(self.register_names)
-        table.resizeColumnsToContents()
+        self.table.resizeColumnsToContents()
+
+        self.monitor_check_box = QCheckBox('Monitor')
+        self.monitor_check_box.setToolTip('Poll the selected registers (or '
+                                          'all of them if none are selected)')
+        self.monitor_check_box.toggled.connect(self.monitor_toggled)
+
+        self.rate_spin_box = QDoubleSpinBox()
+        self.rate_spin_box.setRange(0.1, 1000)
+        self.rate_spin_box.setValue(POLL_RATE)
+        self.rate_spin_box.setSuffix(' Hz')
+        self.rate_spin_box.valueChanged.connect(self.rate_changed)
+
+        tune_button = QPushButton('Tune FIFOT')
+        tune_button.setToolTip('Measure interrupt rate and latency at '
+                               'several FIFO trigger levels')
+        tune_button.clicked.connect(self.tune_clicked)
+
+        monitor_box = QHBoxLayout()
+        monitor_box.addWidget(self.monitor_check_box)
+        monitor_box.addWidget(self.rate_spin_box)
+        monitor_box.addStretch()
+        monitor_box.addWidget(tune_button)
+
+        self.addWidget(self.table)
+        self.addLayout(monitor_box)
+
+        self.poller = None
+        self.displayed_count = 0
+
+        # Repaints are limited to the display rate however fast the polling
+        self.display_timer = QTimer(self)
+        self.display_timer.setInterval(self.DISPLAY_INTERVAL)
+        self.display_timer.timeout.connect(self.display_monitor)
+
+    def _port_loading(self):
+        self.stop_monitor()
+        PortChangedTracker._port_loading(self)
+
+    def port_changed(self, state):
+        self.stop_monitor()
+
+        self.state = state
+        self.snapshot = state.registers
+        self.display_registers()
+
+        if self.monitor_check_box.isChecked():
+            self.start_monitor()
+
+    def state_changed(self, state):
+        self.snapshot = state.registers
+        self.display_registers()
+
+    def display_registers(self):
+        self.model.set_values(0, self.snapshot)
+
+    def set_register(self, name, value):
+        """Shows value as an edit to a register, written with the next
+        Apply."""
+        self.model.set_values(0, {name: value})
 
-        self.addWidget(table)
+    def tune_clicked(self):
+        self.stop_monitor()
 
-    def port_changed(self, port):
-        for reg_name in self.register_names:
-            register_value = getattr(port.registers, reg_name)
-            hex_display = '{:08x}'.format(register_value)
-            getattr(self, reg_name.lower()).setText(hex_display)
+        tuner = FFifoTuner(self.state.port, self)
 
-    def apply_changes(self, port):
-        for reg_name in self.register_names:
-            register_value = int(getattr(self, reg_name.lower()).text(), 16)
-            setattr(port.registers, reg_name, register_value)
+        if tuner.exec_() == QDialog.Accepted:
+            # Shown as an edit, it is written with the next Apply
+            self.set_register('FIFOT', fifot_value(
+                tuner.rx_trigger, tuner.tx_trigger,
+                self.model.value(0, 'FIFOT')))
+
+        if self.monitor_check_box.isChecked():
+            self.start_monitor()
+
+    def monitor_toggled(self, checked):
+        if checked and self.isEnabled():
+            self.start_monitor()
+        else:
+            self.stop_monitor()
+
+    def rate_changed(self, rate):
+        if self.poller:
+            self.poller.rate = rate
+
+    def start_monitor(self):
+        self.stop_monitor()
+
+        selected = set(self.display_names[index.row()] for index in
+                       self.table.selectionModel().selectedIndexes())
+        names = [r for r in self.display_names if r in selected]
+
+        history = RegisterHistory(names or self.display_names)
+
+        self.poller = RegisterPoller(self.state.port, history,
+                                     self.rate_spin_box.value())
+        self.poller.start()
+
+        self.displayed_count = 0
+        self.display_timer.start()
+
+    def stop_monitor(self):
+        if not self.poller:
+            return
+
+        self.display_timer.stop()
+        self.poller.stop()
+        self.poller = None
+
+        self.model.clear_highlights()
+
+    def display_monitor(self):
+        self.model.fade_highlights(self.HIGHLIGHT_TIME)
+
+        if self.poller.error:
+            self.monitor_check_box.setChecked(False)
+            return
+
+        latest = self.poller.history.latest()
+
+        if not latest or latest[0] == self.displayed_count:
+            return
+
+        self.displayed_count, timestamp, registers = latest
+
+        # Only what the card changed is redisplayed, edits are kept otherwise
+        changes = changed_registers(self.snapshot, registers)
+
+        # The card changed so this is what Apply compares against now
+        self.snapshot.update(changes)
+        self.model.set_values(0, changes, highlight=True)
+
+    def collect_changes(self, changes):
+        values = OrderedDict((reg_name, self.model.value(0, reg_name))
+                             for reg_name in self.register_names)
+
+        # Only write what differs from the card, CCR0/CCR1 writes reset the
+        # line even when the value is the same
+        changes.set_registers(changed_registers(self.snapshot, values))
 
     def import_settings(self, settings):
-        for name, value in settings['registers'].items():
-            try:
-                hex_display = '{:08x}'.format(int(value, 0))
-                getattr(self, name.lower()).setText(hex_display)
-            except AttributeError:
-                pass
+        values = dict((name, int(value, 0))
+                      for name, value in settings['registers'].items()
+                      if name in self.register_names)
+
+        self.model.set_values(0, values)
 
 
 class FClockFrequency(FHBoxLayout, PortChangedTracker):
+    bgr_solved = Signal(int)
 
     def __init__(self):
         FHBoxLayout.__init__(self)
@@ -228,26 +660,202 @@ class FClockFrequency(FHBoxLayout, PortChangedTracker):
         label = QLabel('Clock Frequency')
         self.line_edit = QLineEdit()
 
+        solve_button = QPushButton('Baud Rate')
+        solve_button.setToolTip('Find the clock frequency and BGR for a '
+                                'bit rate')
+        solve_button.clicked.connect(self.solve_clicked)
+
         self.addWidget(label)
         self.addWidget(self.line_edit)
+        self.addWidget(solve_button)
         self.addStretch()
 
-    def port_changed(self, port):
-        self.line_edit.setText('')
+        self._state = None
+
+    def port_changed(self, state):
+        self._state = state
+
+        # Only known once it has been set through this port
+        if state.clock_frequency is None:
+            self.line_edit.setText('')
+        else:
+            self.line_edit.setText(str(state.clock_frequency))
+
+    def solve_clicked(self):
+        rate, ok = QInputDialog.getDouble(self, 'Baud Rate', 'Bit rate:',
+                                          9600, 1, CLOCK_FREQUENCY_RANGE[1],
+                                          3)
+
+        if not ok:
+            return
+
+        try:
+            clock_frequency = int(self.line_edit.text())
+        except ValueError:
+            clock_frequency = self._state.clock_frequency
+
+        # Loaded on first use to keep it out of startup
+        from baud import solve_baud_rate
+
+        solution = solve_baud_rate(rate, clock_frequency)
 
-    def apply_changes(self, port):
-        if self.line_edit.text():
-            try:
-                port.clock_frequency = int(self.line_edit.text())
-            except fscc.InvalidParameterError:
-                FInvalidClockFrequency().exec_()
-            except ValueError:
-                FInvalidClockFrequency().exec_()
+        if solution is None:
+            FBaudRateNotFound(rate).exec_()
+            return
+
+        # Both are written with the next Apply, the clock only if it changed
+        self.line_edit.setText(str(solution.clock_frequency))
+        self.bgr_solved.emit(solution.bgr)
+
+    def collect_changes(self, changes):
+        if not self.line_edit.text():
+            return
+
+        low, high = CLOCK_FREQUENCY_RANGE
+
+        try:
+            clock_frequency = int(self.line_edit.text())
+        except ValueError:
+            clock_frequency = None
+
+        if clock_frequency is None or not low <= clock_frequency <= high:
+            FInvalidClockFrequency().exec_()
+            changes.reject('clock_frequency')
+        else:
+            changes.set_clock_frequency(clock_frequency)
 
     def import_settings(self, settings):
         pass
 
 
+class FFifoTuner(QDialog):
+    """Runs tune_fifo_triggers on a port and lets a point be picked."""
+    COLUMNS = ['RX Trigger', 'TX Trigger', 'Interrupts/s', 'Frames/s',
+               'Lost', 'p50 (us)', 'p99 (us)']
+
+    def __init__(self, port, parent=None):
+        super(FFifoTuner, self).__init__(parent)
+
+        self.port = port
+        self.trials = []
+        self.worker = None
+        self.rx_trigger = None
+        self.tx_trigger = None
+
+        self.rate_spin_box = QSpinBox()
+        self.rate_spin_box.setRange(1, 10000000)
+        self.rate_spin_box.setValue(1000)
+        self.rate_spin_box.setSuffix(' frames/s')
+
+        self.size_spin_box = QSpinBox()
+        self.size_spin_box.setRange(32, 65536)
+        self.size_spin_box.setValue(1024)
+        self.size_spin_box.setSuffix(' bytes')
+
+        self.run_button = QPushButton('Run')
+        self.run_button.clicked.connect(self.run_clicked)
+
+        settings_box = QHBoxLayout()
+        settings_box.addWidget(self.rate_spin_box)
+        settings_box.addWidget(self.size_spin_box)
+        settings_box.addWidget(self.run_button)
+
+        self.status_label = QLabel('Test frames are sent and must loop back '
+                                   'to this port.')
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok |
+                                        QDialogButtonBox.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(False)
+        self.table.itemSelectionChanged.connect(self.selection_changed)
+
+        layout = QVBoxLayout()
+        layout.addLayout(settings_box)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.table)
+        layout.addWidget(self.buttons)
+
+        self.setLayout(layout)
+        self.resize(640, 360)
+        self.setWindowTitle('Tune FIFO Triggers')
+
+    def run_clicked(self):
+        self.run_button.setEnabled(False)
+        self.buttons.setEnabled(False)
+        self.status_label.setText('Measuring...')
+
+        # Pulls in the loopback and traffic modules, so only when needed
+        from tuning import tune_fifo_triggers
+
+        self.worker = FWorker(tune_fifo_triggers, self.port,
+                              self.rate_spin_box.value(), None,
+                              self.size_spin_box.value())
+        self.worker.signals.finished.connect(self.tuned)
+        self.worker.signals.failed.connect(self.tune_failed)
+
+        QThreadPool.globalInstance().start(self.worker)
+
+    def tuned(self, trials):
+        self.tune_finished()
+        self.trials = trials
+
+        self.table.setRowCount(len(trials))
+
+        for row, trial in enumerate(trials):
+            values = [trial['rx_trigger'], trial['tx_trigger'],
+                      '{:,.0f}'.format(trial['interrupt_rate']),
+                      '{:,.1f}'.format(trial['frame_rate']), trial['lost'],
+                      '{:,.1f}'.format(trial['latency_p50'] or 0),
+                      '{:,.1f}'.format(trial['latency_p99'] or 0)]
+
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+
+                # Points on the tradeoff curve stand out
+                if trial['efficient']:
+                    font = item.font()
+                    font.setBold(True)
+                    item.setFont(font)
+
+                self.table.setItem(row, column, item)
+
+        self.table.resizeColumnsToContents()
+        self.status_label.setText('Points in bold have no other point with '
+                                  'both fewer interrupts and lower latency.')
+
+    def tune_failed(self, e):
+        self.tune_finished()
+        self.status_label.setText(str(e))
+
+    def tune_finished(self):
+        self.worker = None
+        self.run_button.setEnabled(True)
+        self.buttons.setEnabled(True)
+
+    def selection_changed(self):
+        rows = self.table.selectionModel().selectedRows()
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(bool(rows))
+
+        if rows:
+            trial = self.trials[rows[0].row()]
+            self.rx_trigger = trial['rx_trigger']
+            self.tx_trigger = trial['tx_trigger']
+
+    def reject(self):
+        # The measurement has to finish before its results have somewhere
+        # to go
+        if not self.worker:
+            super(FFifoTuner, self).reject()
+
+
 class FBooleanAttribute(QCheckBox, PortChangedTracker):
 
     def __init__(self, label, attribute):
@@ -256,11 +864,11 @@ class FBooleanAttribute(QCheckBox, PortChangedTracker):
 
         self.attribute = attribute
 
-    def port_changed(self, port):
-        self.setChecked(getattr(port, self.attribute))
+    def port_changed(self, state):
+        self.setChecked(getattr(state, self.attribute))
 
-    def apply_changes(self, port):
-        setattr(port, self.attribute, self.isChecked())
+    def collect_changes(self, changes):
+        changes.set_attribute(self.attribute, self.isChecked())
 
     def import_settings(self, settings):
         self.setChecked(settings[self.attribute])
@@ -330,8 +938,8 @@ class FTxModifiers(FVBoxLayout, PortChangedTracker):
         else:
             self.options.addItem('External Signal')
 
-    def port_changed(self, port):
-        tx_modifiers = port.tx_modifiers
+    def port_changed(self, state):
+        tx_modifiers = state.tx_modifiers
 
         self.options.setCurrentIndex(0)
 
@@ -343,7 +951,7 @@ class FTxModifiers(FVBoxLayout, PortChangedTracker):
         if tx_modifiers & fscc.TXEXT:
             self.options.setCurrentIndex(2)
 
-    def apply_changes(self, port):
+    def collect_changes(self, changes):
         tx_modifiers = 0
 
         if self.xrep_check_box.isChecked():
@@ -355,7 +963,7 @@ class FTxModifiers(FVBoxLayout, PortChangedTracker):
         if self.options.currentIndex() == 2:
             tx_modifiers |= fscc.TXEXT
 
-        port.tx_modifiers = tx_modifiers
+        changes.set_attribute('tx_modifiers', tx_modifiers)
 
     def import_settings(self, settings):
         tx_modifiers = settings['tx_modifiers']
@@ -399,25 +1007,88 @@ class FMemoryCap(QGroupBox, PortChangedTracker):
         output_box.addStretch()
         output_box.addWidget(self.output_line_edit)
 
+        self.tune_button = QPushButton('Auto-Tune')
+        self.tune_button.clicked.connect(self.tune_clicked)
+
+        tune_box = QHBoxLayout()
+        tune_box.addStretch()
+        tune_box.addWidget(self.tune_button)
+
         box.addLayout(input_box)
         box.addLayout(output_box)
+        box.addLayout(tune_box)
+
+        self._port = None
+        self.tune_port = None
+        self.tune_frame_rate = None
+        self.worker = None
 
-    def port_changed(self, port):
-        self.input_line_edit.setText(str(port.memory_cap.input))
-        self.output_line_edit.setText(str(port.memory_cap.output))
+    def port_changed(self, state):
+        self._port = state.port
+
+        self.input_line_edit.setText(str(state.memory_cap['input']))
+        self.output_line_edit.setText(str(state.memory_cap['output']))
+
+    def tune_clicked(self):
+        frame_rate, ok = QInputDialog.getInt(
+            self, 'Auto-Tune Memory Cap',
+            'Frames per second to keep up with. Test frames are sent and\n'
+            'must loop back to this port.', 1000, 1, 10000000)
+
+        if not ok:
+            return
 
-    def apply_changes(self, port):
+        self.tune_button.setEnabled(False)
+        self.tune_button.setText('Tuning...')
+
+        self.tune_port = self._port
+        self.tune_frame_rate = frame_rate
+
+        from tuning import tune_memory_cap
+
+        # The sweep takes several seconds of traffic so keep it off the UI
+        self.worker = FWorker(tune_memory_cap, self._port, frame_rate)
+        self.worker.signals.finished.connect(self.tuned)
+        self.worker.signals.failed.connect(self.tune_failed)
+
+        QThreadPool.globalInstance().start(self.worker)
+
+    def tuned(self, results):
+        self.tune_finished()
+
+        # Another port was selected while tuning
+        if self.tune_port is not self._port:
+            return
+
+        memory_cap = results['recommended']
+
+        if memory_cap is not None:
+            self.input_line_edit.setText(str(memory_cap))
+            self.output_line_edit.setText(str(memory_cap))
+
+        FMemoryCapTuned(memory_cap, results['frame_rate']).exec_()
+
+    def tune_failed(self, e):
+        self.tune_finished()
+        FMemoryCapTuned(None, self.tune_frame_rate).exec_()
+
+    def tune_finished(self):
+        self.worker = None
+        self.tune_button.setEnabled(True)
+        self.tune_button.setText('Auto-Tune')
+
+    def collect_changes(self, changes):
         try:
             input_memcap = int(self.input_line_edit.text())
             output_memcap = int(self.output_line_edit.text())
-
-            if input_memcap < 0 or output_memcap < 0:
-                FInvalidMemoryCap().exec_()
         except ValueError:
+            input_memcap = output_memcap = -1
+
+        if input_memcap < 0 or output_memcap < 0:
             FInvalidMemoryCap().exec_()
+            changes.reject('memory_cap')
         else:
-            port.memory_cap.input = input_memcap
-            port.memory_cap.output = output_memcap
+            changes.set_memory_cap(input_memcap, output_memcap)
 
     def import_settings(self, settings):
         self.input_line_edit.setText(str(settings['memory_cap']['input']))
@@ -448,10 +1119,10 @@ class FCommands(QGroupBox, PortChangedTracker):
         box.addWidget(timr_button)
         box.addWidget(stimr_button)
 
-    def port_changed(self, port):
-        self._port = port
+    def port_changed(self, state):
+        self._port = state.port
 
-    def apply_changes(self, port):
+    def collect_changes(self, changes):
         pass
 
     def import_settings(self, settings):
@@ -461,10 +1132,356 @@ class FCommands(QGroupBox, PortChangedTracker):
         self._port.purge()
 
     def timr_clicked(self):
-        self._port.registers.CMDR = 0x00000001
+        write_registers(self._port, {'CMDR': 0x00000001})
 
     def stimr_clicked(self):
-        self._port.registers.CMDR = 0x00000001
+        write_registers(self._port, {'CMDR': 0x00000001})
+
+
+class FCapture(QGroupBox, PortChangedTracker):
+    STATUS_INTERVAL = 500  # Milliseconds between status updates
+
+    def __init__(self):
+        QGroupBox.__init__(self)
+        PortChangedTracker.__init__(self)
+
+        self.setTitle('Capture')
+        self.setFlat(True)
+
+        self._port = None
+        self._port_name = None
+        self.recorder = None
+
+        self.file_line_edit = QLineEdit()
+        browse_button = QPushButton('Browse')
+        browse_button.clicked.connect(self.browse_clicked)
+
+        self.size_spin_box = QSpinBox()
+        self.size_spin_box.setRange(1, 1024 * 1024)
+        self.size_spin_box.setValue(CAPTURE_SIZE // (1024 * 1024))
+        self.size_spin_box.setSuffix(' MB')
+
+        self.start_button = QPushButton('Start')
+        self.start_button.clicked.connect(self.start_clicked)
+
+        throughput_button = QPushButton('Throughput')
+        throughput_button.setToolTip('Plot the rates of received frames, '
+                                     'drops and status errors')
+        throughput_button.clicked.connect(self.throughput_clicked)
+
+        self.status_label = QLabel('')
+
+        file_box = QHBoxLayout()
+        file_box.addWidget(self.file_line_edit)
+        file_box.addWidget(browse_button)
+
+        control_box = QHBoxLayout()
+        control_box.addWidget(self.size_spin_box)
+        control_box.addWidget(self.start_button)
+        control_box.addWidget(throughput_button)
+        control_box.addWidget(self.status_label)
+        control_box.addStretch()
+
+        box = QVBoxLayout()
+        box.addLayout(file_box)
+        box.addLayout(control_box)
+        self.setLayout(box)
+
+        self.status_timer = QTimer(self)
+        self.status_timer.setInterval(self.STATUS_INTERVAL)
+        self.status_timer.timeout.connect(self.update_status)
+
+        # Each port keeps its history by name while the dialog is open, so
+        # it outlives the port's handle being closed and reopened
+        self.histories = {}
+        self.history = None
+        self.drop_counter = None
+        self.error_mask = 0
+        self.throughput = None
+
+        self.sample_timer = QTimer(self)
+        self.sample_timer.setInterval(int(SAMPLE_INTERVAL * 1000))
+        self.sample_timer.timeout.connect(self.sample_throughput)
+
+    def _port_loading(self):
+        self.stop_capture()
+        PortChangedTracker._port_loading(self)
+
+    def set_port_name(self, port_name):
+        self._port_name = port_name
+
+    def port_changed(self, state):
+        self.stop_capture()
+        self._port = state.port
+
+        if self._port_name not in self.histories:
+            self.histories[self._port_name] = ThroughputHistory(
+                PortCounters())
+
+        self.history = self.histories[self._port_name]
+        self.sample_timer.start()
+
+        if self.throughput:
+            self.throughput.set_history(self.history)
+
+    def state_changed(self, state):
+        # The append settings may have just been changed by an apply
+        if self.recorder:
+            reader = self.recorder.reader
+            reader.append_status = state.append_status
+            reader.append_timestamp = state.append_timestamp
+            reader.rx_multiple = state.rx_multiple
+
+    def collect_changes(self, changes):
+        pass
+
+    def import_settings(self, settings):
+        pass
+
+    def browse_clicked(self):
+        filename, filter = QFileDialog.getSaveFileName(
+            self, 'Capture File', None, 'Capture Files (*.cap)')
+
+        if filename:
+            self.file_line_edit.setText(filename)
+
+    def start_clicked(self):
+        if self.recorder:
+            self.stop_capture()
+            return
+
+        if not self.file_line_edit.text():
+            self.browse_clicked()
+
+        if not self.file_line_edit.text():
+            return
+
+        try:
+            capture = CaptureFile(self.file_line_edit.text(),
+                                  self.size_spin_box.value() * 1024 * 1024)
+        except (OSError, ValueError):
+            FCaptureFailed().exec_()
+            return
+
+        self.recorder = CaptureRecorder(self._port, capture)
+        self.recorder.error_mask = self.error_mask
+        self.recorder.start()
+
+        from tuning import InterruptCounter
+
+        self.drop_counter = InterruptCounter(self._port, DROP_INTERRUPTS)
+        self.drop_counter.start()
+
+        self.history.counters.attach(recorder=self.recorder,
+                                     drop_counter=self.drop_counter)
+
+        self.start_button.setText('Stop')
+        self.file_line_edit.setEnabled(False)
+        self.size_spin_box.setEnabled(False)
+        self.status_timer.start()
+
+    def stop_capture(self):
+        if not self.recorder:
+            return
+
+        self.status_timer.stop()
+        self.recorder.stop()
+        self.drop_counter.stop()
+        self.show_status()
+
+        self.history.counters.detach()
+        self.recorder.capture.close()
+        self.recorder = None
+        self.drop_counter = None
+
+        self.start_button.setText('Start')
+        self.file_line_edit.setEnabled(True)
+        self.size_spin_box.setEnabled(True)
+
+    def show_status(self):
+        self.status_label.setText('{:,} frames, {} wraps'.format(
+            self.recorder.frames, self.recorder.capture.wraps))
+
+    def update_status(self):
+        self.show_status()
+
+        if self.recorder.error:
+            self.stop_capture()
+            FCaptureFailed().exec_()
+
+    def sample_throughput(self):
+        self.history.sample()
+
+    def throughput_clicked(self):
+        if not self.throughput:
+            # A window of its own, not disabled along with this box
+            self.throughput = FThroughput(self.window())
+            self.throughput.error_mask_changed.connect(self.set_error_mask)
+
+        self.throughput.set_history(self.history)
+        self.throughput.set_error_mask(self.error_mask)
+        self.throughput.show()
+        self.throughput.raise_()
+
+    def set_error_mask(self, error_mask):
+        self.error_mask = error_mask
+
+        if self.recorder:
+            self.recorder.error_mask = error_mask
+
+
+class FPlot(QWidget):
+    """Plots one TimeSeries, each pixel column showing the lowest and
+    highest value in its time span."""
+
+    def __init__(self, title, unit, parent=None):
+        super(FPlot, self).__init__(parent)
+
+        self.title = title
+        self.unit = unit
+        self.series = None
+        self.span = 300.0
+
+        self.setMinimumSize(320, 100)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().base())
+
+        width, height = self.width(), self.height()
+        end = time.time()
+        start = end - self.span
+
+        points = []
+
+        if self.series:
+            points = downsample(self.series.points(start), start, end,
+                                width)
+
+        top = max([high for timestamp, low, high in points] + [1.0])
+        scale = (height - 20) / top
+
+        painter.setPen(self.palette().highlight().color())
+
+        previous = None
+
+        for timestamp, low, high in points:
+            x = int((timestamp - start) / self.span * (width - 1))
+            y_low = height - 1 - int(low * scale)
+            y_high = height - 1 - int(high * scale)
+
+            painter.drawLine(x, y_low, x, y_high)
+
+            if previous is not None:
+                painter.drawLine(previous[0], previous[1], x, y_high)
+
+            previous = (x, y_high)
+
+        latest = self.series.latest() if self.series else None
+
+        painter.setPen(self.palette().text().color())
+        painter.drawText(4, 14, '{}: {} (peak {})'.format(
+            self.title, format_rate(latest or 0, self.unit),
+            format_rate(top if points else 0, self.unit)))
+
+        painter.end()
+
+
+def format_rate(value, unit):
+    for scale, prefix in [(1e9, 'G'), (1e6, 'M'), (1e3, 'k')]:
+        if value >= scale:
+            return '{:.1f} {}{}/s'.format(value / scale, prefix, unit)
+
+    return '{:.1f} {}/s'.format(value, unit)
+
+
+class FThroughput(QDialog):
+    """Live rates of the selected port's received traffic over a chosen
+    span.
+
+    Transmit rates are left out, the dialog doesn't generate traffic so
+    they would always be zero. PortCounters only has them when a
+    traffic.TrafficGenerator is attached.
+    """
+    REPAINT_INTERVAL = 500  # Milliseconds
+    SPANS = [('5 minutes', 300), ('1 hour', 3600), ('1 day', 86400),
+             ('1 week', 604800)]
+    PLOTS = [('rx_frames', 'RX', 'frames'), ('rx_bytes', 'RX', 'B'),
+             ('drops', 'Drops', 'events'),
+             ('status_errors', 'Status errors', 'frames')]
+
+    error_mask_changed = Signal(int)
+
+    def __init__(self, parent=None):
+        super(FThroughput, self).__init__(parent)
+
+        self.span_combo_box = QComboBox()
+
+        for name, seconds in self.SPANS:
+            self.span_combo_box.addItem(name, seconds)
+
+        self.span_combo_box.currentIndexChanged.connect(self.span_changed)
+
+        self.error_mask_line_edit = QLineEdit()
+        self.error_mask_line_edit.setToolTip('Appended status bits that '
+                                             'count as a status error (hex)')
+        self.error_mask_line_edit.editingFinished.connect(
+            self.error_mask_edited)
+
+        options = QHBoxLayout()
+        options.addWidget(QLabel('Last'))
+        options.addWidget(self.span_combo_box)
+        options.addStretch()
+        options.addWidget(QLabel('Error bits 0x'))
+        options.addWidget(self.error_mask_line_edit)
+
+        self.plots = {}
+        grid = QGridLayout()
+
+        for i, (metric, title, unit) in enumerate(self.PLOTS):
+            self.plots[metric] = FPlot(title, unit)
+            grid.addWidget(self.plots[metric], i // 2, i % 2)
+
+        layout = QVBoxLayout()
+        layout.addLayout(options)
+        layout.addLayout(grid)
+        self.setLayout(layout)
+
+        self.setWindowTitle('Throughput')
+
+        self.repaint_timer = QTimer(self)
+        self.repaint_timer.setInterval(self.REPAINT_INTERVAL)
+        self.repaint_timer.timeout.connect(self.update_plots)
+        self.repaint_timer.start()
+
+    def set_history(self, history):
+        for metric, plot in self.plots.items():
+            plot.series = history.series[metric] if history else None
+
+        self.update_plots()
+
+    def set_error_mask(self, error_mask):
+        self.error_mask_line_edit.setText('{:04x}'.format(error_mask))
+
+    def span_changed(self, index):
+        for plot in self.plots.values():
+            plot.span = float(self.span_combo_box.itemData(index))
+
+        self.update_plots()
+
+    def error_mask_edited(self):
+        try:
+            error_mask = int(self.error_mask_line_edit.text(), 16) & 0xffff
+        except ValueError:
+            error_mask = 0
+
+        self.set_error_mask(error_mask)
+        self.error_mask_changed.emit(error_mask)
+
+    def update_plots(self):
+        if self.isVisible():
+            for plot in self.plots.values():
+                plot.update()
 
 
 class FFileOptions(QGroupBox, PortChangedTracker):
@@ -509,7 +1526,7 @@ class FFileOptions(QGroupBox, PortChangedTracker):
         filename, filter = QFileDialog.getSaveFileName(self, 'Save Settings', None, 'Settings Files (*.fscc)')
         try:
             with open(filename, 'w') as outfile:
-                outfile.write(self._port.to_json(sort_keys=True, indent=4))
+                outfile.write(self._state.to_json(sort_keys=True, indent=4))
         except FileNotFoundError: # Handle 'Cancel' situation
             pass
 
@@ -521,10 +1538,10 @@ class FFileOptions(QGroupBox, PortChangedTracker):
         except FileNotFoundError: # TODO: Handle missing defaults.fscc
             pass
 
-    def port_changed(self, port):
-        self._port = port
+    def port_changed(self, state):
+        self._state = state
 
-    def apply_changes(self, port):
+    def collect_changes(self, changes):
         pass
 
     def import_settings(self, port):
@@ -543,12 +1560,10 @@ class FFirmware(FHBoxLayout, PortChangedTracker):
         self.addWidget(label)
         self.addWidget(self.version)
 
-    def port_changed(self, port):
-        prev = (port.registers.VSTR & 0x0000ff00) >> 8
-        frev = port.registers.VSTR & 0x000000ff
-        self.version.setText('{:2x}.{:02x}'.format(prev, frev))
+    def port_changed(self, state):
+        self.version.setText('{:2x}.{:02x}'.format(*state.firmware))
 
-    def apply_changes(self, port):
+    def collect_changes(self, changes):
         pass
 
     def import_settings(self, settings):
@@ -582,12 +1597,19 @@ class FDialogButtonBox(QDialogButtonBox, PortChangedTracker):
     def apply_clicked(self):
         self.apply.emit()
 
-    def _port_changed(self, port):
-        self.apply_button.setEnabled(bool(port))
-        self.ok_button.setEnabled(bool(port))
+    def _port_changed(self, state):
+        self.apply_button.setEnabled(bool(state))
+        self.ok_button.setEnabled(bool(state))
         self.close_button.setEnabled(True)
 
-    def apply_changes(self, port):
+    def _port_loading(self):
+        self.apply_button.setEnabled(False)
+        self.ok_button.setEnabled(False)
+
+    def _state_changed(self, state):
+        pass
+
+    def collect_changes(self, changes):
         pass
 
     def import_settings(self, settings):